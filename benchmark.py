@@ -0,0 +1,329 @@
+import argparse
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import cluster
+import launcher
+import logs
+import node1
+from channel import ChannelPool
+from sharding import RoutingTable
+
+# Load generator and latency benchmark. Starts N participants as local processes
+# (through the launcher), runs the coordinator in this process and drives it, e.g.
+#   python benchmark.py --participants 8 --transactions 20000 --concurrency 64
+#   python benchmark.py --rate 2000 --batch-window 0.005 --output results.json
+# Transactions are started by --concurrency workers, each starting its next
+# transaction once the previous one has finished; --rate additionally spaces the
+# starts evenly at that many per second.
+#
+# For every committed transaction the coordinator records when each step ended,
+# and the report gives p50/p99/p999 latency of each phase in node1.phases
+# (prepare fan-out, vote collection, decision log write, the precommit round of
+# three-phase commit, commit fan-out, total).
+# The JSON result (stdout, or --output) also records the configuration and the
+# git revision, so runs of different versions can be compared.
+#
+# --participants-per-transaction K runs each transaction at K of the
+# participants, chosen round-robin; with K = 1 every transaction takes the
+# one-phase fast path:
+#   python benchmark.py --participants 4 --participants-per-transaction 1
+#
+# With --shards N the coordinator runs instead as N separate processes, each
+# owning an equal range of the transaction IDs (see sharding.py), and
+# --client-processes processes send them BEGIN requests, routed to the owning
+# shard. Only the end-to-end latency is reported then:
+#   python benchmark.py --shards 4 --participants 4 --transactions 40000 --concurrency 256
+
+
+def percentile(ordered, fraction):
+    """ Nearest-rank percentile of an already sorted list. """
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(samples):
+    """ Latency statistics in milliseconds for a list of durations in seconds. """
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return {
+        'p50': percentile(ordered, 0.50) * 1000,
+        'p99': percentile(ordered, 0.99) * 1000,
+        'p999': percentile(ordered, 0.999) * 1000,
+        'mean': sum(ordered) / len(ordered) * 1000,
+        'max': ordered[-1] * 1000,
+    }
+
+
+def wait_for_participants(timeout=10):
+    """ Wait until every participant accepts connections. """
+    deadline = time.monotonic() + timeout
+    for node in node1.participant_nodes:
+        while True:
+            try:
+                node1.pool.get(node)
+                break
+            except ConnectionError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+
+
+def transaction_nodes(nodes, index, spread):
+    """ The spread participants (all for 0) that transaction number index runs at, taken round-robin. """
+    if not spread:
+        return list(nodes)
+    return [nodes[(index + offset) % len(nodes)] for offset in range(spread)]
+
+
+def drive(prefix, count, concurrency, rate, spread=0):
+    """ Run count transactions through the coordinator. Returns (their Transactions, elapsed seconds). """
+    finished = []
+    next_index = [0]
+    lock = threading.Lock()
+    started = time.monotonic()
+
+    def worker():
+        while True:
+            with lock:
+                index = next_index[0]
+                if index >= count:
+                    return
+                next_index[0] += 1
+            if rate:
+                delay = started + index / rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            transaction = node1.begin(f"{prefix}-{index}",
+                                      nodes=transaction_nodes(node1.participant_nodes, index, spread))
+            transaction.finished.wait()
+            with lock:
+                finished.append(transaction)
+
+    workers = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return finished, time.monotonic() - started
+
+
+def start_shards(config, data_dir, count, node_args):
+    """ Start one coordinator process per shard. Returns their Popen objects. """
+    processes = []
+    for shard in range(count):
+        output = open(os.path.join(data_dir, f"tc_shard{shard}.out"), 'a')
+        processes.append(subprocess.Popen(
+            [sys.executable, '-u', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'node1.py'), '--serve',
+             '--config', config, '--shard', str(shard), '--log-dir', os.path.join(data_dir, f"tc_log_shard{shard}"),
+             *node_args],
+            stdin=subprocess.DEVNULL, stdout=output, stderr=subprocess.STDOUT))
+        output.close()
+    return processes
+
+
+def wait_for_shards(routing, timeout=10):
+    """ Wait until every shard's coordinator accepts connections. """
+    pool = ChannelPool()
+    deadline = time.monotonic() + timeout
+    for shard in range(len(routing)):
+        while True:
+            try:
+                pool.get(cluster.parse_address(routing.coordinators(shard)[0]))
+                break
+            except ConnectionError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+    pool.close()
+
+
+def drive_shards(config, prefix, count, concurrency, rate, spread=0):
+    """ Client process of a sharded run: send count BEGIN requests to the shards that own them.
+
+    Returns (decision, seconds) for each transaction.
+    """
+    routing = cluster.routing(config)
+    nodes = list(cluster.load(config)[1].values())
+    pool = ChannelPool()
+    finished = []
+    next_index = [0]
+    lock = threading.Lock()
+    started = time.monotonic()
+
+    def worker():
+        while True:
+            with lock:
+                index = next_index[0]
+                if index >= count:
+                    return
+                next_index[0] += 1
+            if rate:
+                delay = started + index / rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            transaction_id = f"{prefix}-{index}"
+            address = cluster.parse_address(routing.coordinators(routing.shard(transaction_id))[0])
+            begun = time.monotonic()
+            verb, _ = pool.get(address).request("BEGIN", transaction_id,
+                                                *transaction_nodes(nodes, index, spread)).result(timeout=60)
+            with lock:
+                finished.append((verb, time.monotonic() - begun))
+
+    workers = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    pool.close()
+    return finished
+
+
+def drive_remote(config, prefix, count, concurrency, rate, processes, spread=0):
+    """ Run count transactions through the shards from several client processes. Returns (results, seconds). """
+    shares = [count // processes + (index < count % processes) for index in range(processes)]
+    with multiprocessing.Pool(processes) as clients:
+        started = time.monotonic()
+        parts = clients.starmap(drive_shards, [(config, f"{prefix}-{index}", share, max(1, concurrency // processes),
+                                                rate / processes, spread) for index, share in enumerate(shares)])
+        elapsed = time.monotonic() - started
+    return [result for part in parts for result in part], elapsed
+
+
+def report_remote(results, elapsed):
+    """ Throughput and end-to-end latency of a sharded run. """
+    committed = [seconds for decision, seconds in results if decision == 'COMMIT']
+    return {
+        'transactions': len(results),
+        'committed': len(committed),
+        'aborted': len(results) - len(committed),
+        'seconds': elapsed,
+        'throughput': len(committed) / elapsed if elapsed else 0,
+        'latency_ms': {'total': summarize(committed)},
+    }
+
+
+def report(transactions, elapsed):
+    """ Throughput and per-phase latency of a finished run. """
+    committed = [transaction for transaction in transactions if transaction.decision == 'COMMIT']
+    latency = {}
+    for phase, (start, end) in node1.phases.items():
+        latency[phase] = summarize([transaction.times[end] - transaction.times[start] for transaction in committed
+                                    if start in transaction.times and end in transaction.times])
+    return {
+        'transactions': len(transactions),
+        'committed': len(committed),
+        'aborted': len(transactions) - len(committed),
+        'seconds': elapsed,
+        'throughput': len(committed) / elapsed if elapsed else 0,
+        'latency_ms': latency,
+    }
+
+
+def revision():
+    """ The git revision of this checkout, or None outside a git repository. """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the two-phase commit cluster on this machine.")
+    parser.add_argument('--participants', type=int, default=2, help="number of participant processes")
+    parser.add_argument('--transactions', type=int, default=10000, help="transactions to measure")
+    parser.add_argument('--warmup', type=int, default=200, help="transactions to run first without measuring")
+    parser.add_argument('--concurrency', type=int, default=32, help="most transactions in flight at once")
+    parser.add_argument('--rate', type=float, default=0, help="transactions started per second (0: as fast as possible)")
+    parser.add_argument('--batch-window', type=float, default=0, help="coordinator batch window in seconds")
+    parser.add_argument('--batch-size', type=int, default=1000, help="most transactions in one batched round")
+    parser.add_argument('--presumption', default='abort', choices=cluster.presumptions,
+                        help="protocol variant: presumed abort or presumed commit")
+    parser.add_argument('--protocol', default='2pc', choices=cluster.protocols,
+                        help="two-phase or three-phase commit (three-phase needs presumed abort)")
+    parser.add_argument('--participants-per-transaction', type=int, default=0,
+                        help="participants each transaction runs at, chosen round-robin (0: all of them)")
+    parser.add_argument('--vote', default='auto', help="vote policy of every participant (see vote_policy.py)")
+    parser.add_argument('--shards', type=int, default=0,
+                        help="run the coordinator as this many shard processes instead of in this process")
+    parser.add_argument('--client-processes', type=int,
+                        help="processes sending BEGIN requests to the shards (default: one per shard)")
+    parser.add_argument('--coordinator-port', type=int, default=1025,
+                        help="coordinator port; the other shards and the participants use the ports after it")
+    parser.add_argument('--data-dir', help="directory for every node's logs (default: a new temporary directory)")
+    parser.add_argument('--output', help="write the JSON result to this file instead of stdout")
+    parser.add_argument('--log-level', default='warning', choices=logs.levels, help="log level of every node")
+    options = parser.parse_args()
+    if options.protocol == '3pc' and options.presumption != 'abort':
+        parser.error("three-phase commit needs --presumption abort")
+    if not 0 <= options.participants_per_transaction <= options.participants:
+        parser.error("--participants-per-transaction must be between 0 and --participants")
+    spread = options.participants_per_transaction
+    logs.setup(options.log_level, sys.stderr)
+
+    data_dir = options.data_dir or tempfile.mkdtemp(prefix='2pc-bench-')
+    config = os.path.join(data_dir, 'cluster.json')
+    shards = [f"localhost:{options.coordinator_port + shard}" for shard in range(max(1, options.shards))]
+    coordinator, participants = cluster.local(options.participants,
+                                              coordinator_port=options.coordinator_port + len(shards) - 1)
+    routing = RoutingTable.even([[address] for address in shards])
+    os.makedirs(data_dir, exist_ok=True)
+    cluster.save(config, shards[0], participants, options.presumption, options.protocol,
+                 shards=routing if options.shards else None)
+    node1.tc_address = cluster.parse_address(shards[0])
+    node1.participant_nodes = list(participants.values())
+    node1.log_directory = os.path.join(data_dir, 'tc_log')
+    node1.presumption, node1.protocol = options.presumption, options.protocol
+    node1.batch_window, node1.batch_size = options.batch_window, options.batch_size
+
+    processes = launcher.start_participants(config, data_dir, options.vote, ['--log-level', options.log_level])
+    prefix = f"bench-{int(time.time())}"
+    try:
+        if options.shards:
+            client_processes = options.client_processes or options.shards
+            processes.update(enumerate(start_shards(
+                config, data_dir, options.shards, ['--log-level', options.log_level, '--batch-window',
+                                                   str(options.batch_window), '--batch-size', str(options.batch_size)])))
+            wait_for_shards(routing)
+            drive_remote(config, f"{prefix}-warmup", options.warmup, options.concurrency, options.rate,
+                         client_processes, spread)
+            results, elapsed = drive_remote(config, prefix, options.transactions, options.concurrency, options.rate,
+                                            client_processes, spread)
+            measured = report_remote(results, elapsed)
+        else:
+            node1.start()
+            wait_for_participants()
+            drive(f"{prefix}-warmup", options.warmup, options.concurrency, options.rate, spread)
+            transactions, elapsed = drive(prefix, options.transactions, options.concurrency, options.rate, spread)
+            measured = report(transactions, elapsed)
+    finally:
+        launcher.stop_participants(processes)
+
+    result = {
+        'revision': revision(),
+        'config': {name: value for name, value in vars(options).items() if name not in ('output', 'data_dir')},
+        **measured,
+    }
+    print(f"{result['committed']} committed, {result['aborted']} aborted in {elapsed:.2f}s: "
+          f"{result['throughput']:.0f} commits/s", file=sys.stderr)
+    for phase, stats in result['latency_ms'].items():
+        if stats:
+            print(f"  {phase:9} p50 {stats['p50']:8.2f} ms   p99 {stats['p99']:8.2f} ms   p999 {stats['p999']:8.2f} ms",
+                  file=sys.stderr)
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(result, f, indent=2)
+            f.write("\n")
+    else:
+        print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
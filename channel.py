@@ -0,0 +1,218 @@
+import logging
+import socket
+import threading
+import itertools
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+import metrics
+from protocol import REQUEST, REPLY, FrameReader, ProtocolError, encode_message, take_frame
+
+# Long-lived connections between nodes. A channel carries the messages of many
+# transactions over one TCP connection using the framed protocol in protocol.py.
+# Every message carries a request ID so replies can be matched to the request
+# that caused them; one-way messages use request ID 0.
+
+log = logging.getLogger('channel')
+open_channels = metrics.gauge('tpc_outbound_connections', "Open channels to other nodes")
+
+
+class Channel:
+    """ One persistent, multiplexed connection to a peer node. """
+
+    def __init__(self, sock, on_message=None, name=None):
+        self.sock = sock
+        self.on_message = on_message
+        self.name = name
+        self.closed = False
+        self.pending = {}  # request_id -> Future waiting for the reply
+        self.request_ids = itertools.cycle(range(1, 2 ** 32))  # Request IDs are 32-bit on the wire
+        self.outgoing = []  # Encoded messages waiting to be written
+        self.flushing = False  # True while some thread is writing self.outgoing
+        self.lock = threading.Lock()
+        open_channels.inc()
+        self.reader = threading.Thread(target=self.read_messages, daemon=True)
+        self.reader.start()
+
+    @classmethod
+    def connect(cls, address, on_message=None, timeout=5):
+        """ Open a channel to address, a (host, port) tuple or a 'host:port' string. """
+        if isinstance(address, str):
+            host, port = address.split(':')
+            address = host, int(port)
+        try:
+            sock = socket.create_connection(address, timeout=timeout)
+        except OSError as e:
+            raise ConnectionError(f"Could not connect to {address[0]}:{address[1]}: {e}") from e
+        sock.settimeout(None)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return cls(sock, on_message, f"{address[0]}:{address[1]}")
+
+    def request(self, verb, *args):
+        """ Send a message and return a Future that resolves to the peer's (verb, args) reply.
+
+        A channel that is closed or fails fails the Future with ConnectionError.
+        Raises ProtocolError, sending nothing, for a message too large to encode.
+        """
+        future = Future()
+        with self.lock:
+            request_id = next(self.request_ids)
+            self.pending[request_id] = future
+        try:
+            message = encode_message(REQUEST, request_id, verb, args)
+        except ProtocolError:
+            with self.lock:
+                self.pending.pop(request_id, None)
+            raise
+        try:
+            self.write(message)
+        except ConnectionError as e:
+            with self.lock:
+                self.pending.pop(request_id, None)
+            # close() may already have failed it
+            if not future.done():
+                future.set_exception(e)
+        return future
+
+    def send(self, verb, *args):
+        """ Send a one-way message that expects no reply. """
+        self.write(encode_message(REQUEST, 0, verb, args))
+
+    def reply(self, request_id, verb, *args):
+        """ Answer the request with the given ID. """
+        self.write(encode_message(REPLY, request_id, verb, args))
+
+    def write(self, message):
+        """ Queue an encoded message and write the queue as frames.
+
+        Whichever thread finds the channel idle writes everything queued by
+        concurrent callers in the meantime, so messages are batched into
+        frames under load without an extra writer thread.
+        """
+        with self.lock:
+            if self.closed:
+                raise ConnectionError(f"Channel to {self.name} is closed")
+            self.outgoing.append(message)
+            if self.flushing:
+                return
+            self.flushing = True
+        try:
+            while True:
+                with self.lock:
+                    if not self.outgoing:
+                        self.flushing = False
+                        return
+                    frame = take_frame(self.outgoing)
+                self.sock.sendall(frame)
+        except Exception as e:
+            # Whatever failed, the queue cannot be written any more: without closing, later writes would only pile up
+            self.close()
+            raise ConnectionError(f"Channel to {self.name} failed: {e}") from e
+
+    def read_messages(self):
+        """ Dispatch incoming messages: replies complete their request, everything else goes to on_message. """
+        try:
+            for kind, request_id, verb, args in FrameReader(self.sock).messages():
+                if kind == REPLY:
+                    future = self.pending.pop(request_id, None)
+                    if future is not None:
+                        future.set_result((verb, args))
+                elif self.on_message is not None:
+                    self.on_message(self, request_id, verb, args)
+        except ProtocolError as e:
+            log.warning("Closing channel to %s: %s", self.name, e)
+        except OSError:
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.outgoing = []
+            open_channels.dec()
+            pending, self.pending = self.pending, {}
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError(f"Channel to {self.name} closed"))
+
+
+class ChannelPool:
+    """ Keeps one open channel per peer address and reconnects when it breaks. """
+
+    def __init__(self, on_message=None, connect_timeout=5, max_workers=32):
+        self.on_message = on_message
+        self.connect_timeout = connect_timeout
+        self.channels = {}
+        self.connect_locks = {}  # One lock per address, so a slow connect only delays its own peer
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='fan-out')
+
+    def get(self, address):
+        """ Return an open channel to address, connecting if needed. Raises ConnectionError when the peer is down. """
+        key = address if isinstance(address, str) else f"{address[0]}:{address[1]}"
+        with self.lock:
+            channel = self.channels.get(key)
+            if channel is not None and not channel.closed:
+                return channel
+            connect_lock = self.connect_locks.setdefault(key, threading.Lock())
+        with connect_lock:
+            channel = self.channels.get(key)
+            if channel is None or channel.closed:
+                channel = Channel.connect(key, self.on_message, self.connect_timeout)
+                with self.lock:
+                    self.channels[key] = channel
+            return channel
+
+    def fan_out(self, addresses, action, timeout=None):
+        """ Run action(address, channel) for every address concurrently on a bounded thread pool.
+
+        Returns {address: result}. A peer that cannot be reached, raises, or
+        does not finish within timeout seconds maps to the exception instead,
+        so the whole phase takes about as long as its slowest peer.
+        """
+        futures = {self.executor.submit(lambda address=address: action(address, self.get(address))): address
+                   for address in addresses}
+        wait(futures, timeout=timeout)
+        results = {}
+        for future, address in futures.items():
+            if not future.done():
+                future.cancel()
+                results[address] = TimeoutError(f"No answer from {address} within {timeout}s")
+            elif future.exception() is not None:
+                results[address] = future.exception()
+            else:
+                results[address] = future.result()
+        return results
+
+    def request_all(self, requests, timeout=None):
+        """ Send each peer its request, {address: (verb, *args)}, and wait up to timeout seconds for the replies.
+
+        Returns {address: (verb, args) reply, or None if the peer could not be
+        reached, failed or did not answer in time}.
+        """
+        return self.replies(self.send_all(requests, timeout), timeout)
+
+    def send_all(self, requests, timeout=None):
+        """ The sending half of request_all(): returns {address: Future of the reply, or the exception}. """
+        return self.fan_out(list(requests), lambda address, channel: channel.request(*requests[address]), timeout)
+
+    @staticmethod
+    def replies(futures, timeout=None):
+        """ The waiting half of request_all(): {key: reply or None} for futures, {key: Future or exception}. """
+        wait([future for future in futures.values() if not isinstance(future, Exception)], timeout=timeout)
+        return {key: future.result() if not isinstance(future, Exception) and future.done()
+                and future.exception() is None else None
+                for key, future in futures.items()}
+
+    def close(self):
+        with self.lock:
+            channels, self.channels = list(self.channels.values()), {}
+        for channel in channels:
+            channel.close()
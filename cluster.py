@@ -0,0 +1,100 @@
+import json
+
+from sharding import HASH_SPACE, RoutingTable
+
+# The cluster layout shared by the coordinator, the participants and the launcher,
+# kept in a JSON file (cluster.json by default):
+#   {
+#     "coordinator": "localhost:1025",
+#     "coordinators": ["localhost:1025", "localhost:1035", "localhost:1036"],
+#     "participants": {"node2": "localhost:1026", "node3": "localhost:1027"},
+#     "presumption": "abort",
+#     "protocol": "2pc"
+#   }
+# Participants are keyed by node ID, which also names their files in the data directory.
+# "presumption" selects the protocol variant every node must agree on: "abort"
+# (presumed abort, the default) or "commit" (presumed commit). "protocol" is "2pc"
+# (the default) or "3pc", the non-blocking three-phase variant, which needs
+# presumed abort.
+# "coordinators" is optional: a replicated coordinator group (see replication.py)
+# that participants fail over between; "coordinator" is then the first of them.
+# "shards" is optional too: it splits the transaction IDs between several
+# coordinators (or replicated groups), each with its own decision log; see sharding.py.
+
+default_config = 'cluster.json'
+presumptions = ('abort', 'commit')
+protocols = ('2pc', '3pc')
+
+
+def parse_address(text):
+    """ Turn 'host:port' into a (host, port) tuple. """
+    host, _, port = text.rpartition(':')
+    return host, int(port)
+
+
+def load(path=default_config):
+    """ Read a cluster file. Returns (coordinator address tuple, {node_id: 'host:port'}). """
+    with open(path) as f:
+        config = json.load(f)
+    return parse_address(config['coordinator']), dict(config['participants'])
+
+
+def coordinators(path=default_config):
+    """ Every coordinator of a cluster file as 'host:port': its replicated group, or just the coordinator. """
+    with open(path) as f:
+        config = json.load(f)
+    return list(config.get('coordinators') or [config['coordinator']])
+
+
+def routing(path=default_config):
+    """ The RoutingTable of a cluster file: its "shards", or a single shard of every coordinator. """
+    with open(path) as f:
+        config = json.load(f)
+    if 'shards' in config:
+        return RoutingTable((shard['range'][0], shard['range'][1], shard['coordinators'])
+                            for shard in config['shards'])
+    return RoutingTable([(0, HASH_SPACE, coordinators(path))])
+
+
+def presumption(path=default_config):
+    """ The protocol variant of a cluster file: 'abort' or 'commit'. """
+    with open(path) as f:
+        value = json.load(f).get('presumption', 'abort')
+    if value not in presumptions:
+        raise ValueError(f"Unknown presumption {value!r} in {path}")
+    return value
+
+
+def protocol(path=default_config):
+    """ The commit protocol of a cluster file: '2pc' or '3pc'. """
+    with open(path) as f:
+        config = json.load(f)
+    value = config.get('protocol', '2pc')
+    if value not in protocols:
+        raise ValueError(f"Unknown protocol {value!r} in {path}")
+    if value == '3pc' and config.get('presumption', 'abort') != 'abort':
+        raise ValueError(f"Three-phase commit needs presumed abort in {path}")
+    return value
+
+
+def save(path, coordinator, participants, presumption='abort', protocol='2pc', coordinators=None, shards=None):
+    """ Write a cluster file; coordinator is 'host:port', participants is {node_id: 'host:port'}.
+
+    coordinators lists a replicated coordinator group, which should start with
+    coordinator; shards is a RoutingTable for a sharded cluster.
+    """
+    config = {'coordinator': coordinator, 'participants': participants, 'presumption': presumption,
+              'protocol': protocol}
+    if coordinators:
+        config['coordinators'] = list(coordinators)
+    if shards is not None:
+        config['shards'] = shards.to_config()
+    with open(path, 'w') as f:
+        json.dump(config, f, indent=2)
+        f.write("\n")
+
+
+def local(count, host='localhost', coordinator_port=1025):
+    """ Layout of count participants on consecutive ports after the coordinator's, named node2, node3, ... """
+    participants = {f"node{i + 2}": f"{host}:{coordinator_port + 1 + i}" for i in range(count)}
+    return f"{host}:{coordinator_port}", participants
@@ -0,0 +1,55 @@
+# The decision rules of the commit protocol, shared by the coordinator
+# (node1.py), the participants (participant.py) and the simulation
+# (simulation.py), so the simulation checks the rules the nodes actually run.
+#
+# Votes are 'YES', 'NO' or 'READ_ONLY', or None while a vote is outstanding.
+# A participant's state of a transaction, as exchanged during cooperative
+# termination, is one STATES letter:
+#   C  committed      A  aborted (or voted NO, or aborted before voting)
+#   U  prepared, in doubt          P  precommitted (three-phase commit)
+#   ?  nothing known
+
+
+def presumed_outcome(presumption):
+    """ The outcome of a transaction the coordinator has no record of: 'COMMIT' under presumed commit, else 'ABORT'. """
+    return 'COMMIT' if presumption == 'commit' else 'ABORT'
+
+
+def vote_outcome(votes):
+    """ 'ABORT' once any vote is NO, 'COMMIT' once every vote is YES or READ_ONLY, None while that is open. """
+    votes = list(votes)
+    if 'NO' in votes:
+        return 'ABORT'
+    if all(vote in ('YES', 'READ_ONLY') for vote in votes):
+        return 'COMMIT'
+    return None
+
+
+def second_phase_nodes(decision, responses):
+    """ The nodes of responses, {node: vote}, that take part in the second phase of decision.
+
+    A commit goes to the nodes that voted YES: a READ_ONLY voter has nothing
+    to commit. An abort goes to every node that may have prepared, which
+    leaves out those that voted NO or READ_ONLY.
+    """
+    if decision == 'COMMIT':
+        return [node for node, vote in responses.items() if vote == 'YES']
+    return [node for node, vote in responses.items() if vote not in ('NO', 'READ_ONLY')]
+
+
+def acknowledged(decision, presumption):
+    """ Whether the participants acknowledge decision: only the outcome that is not presumed is tracked. """
+    return decision != presumed_outcome(presumption)
+
+
+def termination_outcome(states):
+    """ Settle an in-doubt transaction from its peers' STATES letters: 'COMMIT' or 'ABORT' if any peer knows, else None.
+
+    A peer that aborted the transaction, voted NO or was asked before it voted answers 'A'.
+    """
+    states = set(states)
+    if 'C' in states:
+        return 'COMMIT'
+    if 'A' in states:
+        return 'ABORT'
+    return None
@@ -0,0 +1,64 @@
+import threading
+from collections import OrderedDict
+
+# In-memory index the coordinator uses to answer INQUIRE without touching disk.
+#
+# Lookups check, in order:
+#   1. recent decisions (COMMIT and ABORT), a bounded LRU filled by every decision
+#      and, at startup, by the decisions found in the decision log
+#   2. the decision log's in-memory state, for decisions that fell out of the LRU
+#   3. a bounded negative cache of IDs already found in neither
+# Anything not found gets the presumed outcome: ABORT under presumed abort (the
+# log never records aborts), COMMIT under presumed commit.
+
+
+class DecisionCache:
+    """ Bounded LRU of transaction outcomes backed by the decision log. """
+
+    def __init__(self, decision_log, capacity=100000, negative_capacity=100000, presumed='ABORT'):
+        self.decision_log = decision_log
+        self.presumed = presumed
+        self.capacity = capacity
+        self.negative_capacity = negative_capacity
+        self.recent = OrderedDict()  # transaction_id -> 'COMMIT' | 'ABORT', least recently used first
+        self.unknown = OrderedDict()  # IDs with no record, least recently used first
+        self.lock = threading.Lock()
+        for transaction_id, decision in list(decision_log.completed.items()):
+            self.record(transaction_id, decision)
+        for transaction_id in decision_log.pending_transactions():
+            self.record(transaction_id, 'COMMIT')
+        for transaction_id in list(decision_log.pending_aborts()) + list(decision_log.collecting_transactions()):
+            self.record(transaction_id, 'ABORT')
+
+    def record(self, transaction_id, decision):
+        """ Remember a decision as the most recently used entry. """
+        with self.lock:
+            self.unknown.pop(transaction_id, None)
+            self.recent[transaction_id] = decision
+            self.recent.move_to_end(transaction_id)
+            if len(self.recent) > self.capacity:
+                self.recent.popitem(last=False)
+
+    def lookup(self, transaction_id):
+        """ Return 'COMMIT' or 'ABORT' for a decided transaction, or None if nothing is recorded. """
+        with self.lock:
+            decision = self.recent.get(transaction_id)
+            if decision is not None:
+                self.recent.move_to_end(transaction_id)
+                return decision
+            if transaction_id in self.unknown:
+                self.unknown.move_to_end(transaction_id)
+                return None
+        decision = self.decision_log.outcome(transaction_id)
+        if decision is not None:
+            self.record(transaction_id, decision)
+            return decision
+        with self.lock:
+            self.unknown[transaction_id] = None
+            if len(self.unknown) > self.negative_capacity:
+                self.unknown.popitem(last=False)
+        return None
+
+    def outcome(self, transaction_id):
+        """ Like lookup(), but answers the presumed outcome for transactions with no record. """
+        return self.lookup(transaction_id) or self.presumed
@@ -0,0 +1,232 @@
+import threading
+from collections import OrderedDict
+
+from wal import WriteAheadLog
+
+# The coordinator's durable record of decisions, kept in a write-ahead log.
+# Records:
+#   ('COMMIT', transaction_id, node, node, ...)      forced before any COMMIT is sent
+#   ('ABORT', transaction_id, node, node, ...)       presumed commit: abort to deliver to the nodes; with no
+#                                                    nodes, also a logged commit that three-phase recovery aborted
+#   ('DONE', transaction_id, node)                   node has acknowledged the outcome
+#   ('COLLECTING', transaction_id, node, node, ...)  presumed commit only: forced before PREPARE is sent
+#   ('COMPLETED', transaction_id)                    fully finished commit
+#   ('ABORTED', transaction_id)                      fully finished abort (presumed commit only)
+#   ('INDEX', index, term)                           replicated log: ends the entry with that number
+# Under presumed abort (the default) aborts are not logged: a transaction without
+# a COMMIT record was aborted. Under presumed commit a transaction without a
+# record was committed, so the log instead holds every transaction from PREPARE
+# until its decision, and every abort until each node has acknowledged it.
+# Once every node has acknowledged a decision no node will ask about it again, so
+# it is dropped from the log at the next checkpoint (unless retained_decisions
+# asks to keep the most recent ones).
+#
+# In a replicated coordinator group (see replication.py) the leader's appends are
+# numbered entries that a forced append waits for a majority of the group to
+# store, and followers receive the leader's entries with apply_entries().
+
+
+class DecisionLog:
+    """ Decisions and per-participant progress, rebuilt from the log at startup. """
+
+    def __init__(self, directory, segment_size=16 * 1024 * 1024, retained_decisions=0, sync=True):
+        self.wal = WriteAheadLog(directory, sync)
+        self.segment_size = segment_size
+        self.retained_decisions = retained_decisions
+        self.lock = threading.Lock()
+        self.pending = {}  # transaction_id -> {node: 'pending' | 'done'} for undelivered decisions
+        self.aborting = set()  # The transactions in self.pending whose decision is ABORT
+        self.collecting = {}  # transaction_id -> nodes, for undecided transactions (presumed commit)
+        self.completed = OrderedDict()  # Last retained_decisions finished decisions, transaction_id -> 'COMMIT' | 'ABORT'
+        self.last_index, self.last_term = 0, 0  # Number of the last replicated entry
+        self.replica = None  # The group member that replicates this log, or None when it is not replicated
+        self.checkpointing = False
+        for record in self.wal.replay():
+            self.apply(record)
+
+    def apply(self, record):
+        """ Update the in-memory state for one record. Callers hold self.lock (or are replaying). """
+        kind, transaction_id = record[0], record[1]
+        if kind in ('COMMIT', 'ABORT'):
+            self.collecting.pop(transaction_id, None)
+            self.pending[transaction_id] = {node: 'pending' for node in record[2:]}
+            if kind == 'ABORT':
+                self.aborting.add(transaction_id)
+            if not record[2:]:
+                self.finish(transaction_id)
+        elif kind == 'DONE':
+            nodes_commit_status = self.pending.get(transaction_id)
+            if nodes_commit_status is not None:
+                nodes_commit_status[record[2]] = 'done'
+                if all(status == 'done' for status in nodes_commit_status.values()):
+                    self.finish(transaction_id)
+        elif kind == 'COLLECTING':
+            self.collecting[transaction_id] = record[2:]
+        elif kind == 'COMPLETED':
+            self.collecting.pop(transaction_id, None)
+            self.remember_completed(transaction_id, 'COMMIT')
+        elif kind == 'ABORTED':
+            self.remember_completed(transaction_id, 'ABORT')
+        elif kind == 'INDEX':
+            self.last_index, self.last_term = int(record[1]), int(record[2])
+
+    def finish(self, transaction_id):
+        del self.pending[transaction_id]
+        if transaction_id in self.aborting:
+            self.aborting.discard(transaction_id)
+            self.remember_completed(transaction_id, 'ABORT')
+        else:
+            self.remember_completed(transaction_id, 'COMMIT')
+
+    def remember_completed(self, transaction_id, decision):
+        self.completed[transaction_id] = decision
+        while len(self.completed) > self.retained_decisions:
+            self.completed.popitem(last=False)
+
+    def log_commit(self, transaction_id, nodes):
+        """ Durably record the decision to commit. Returns once it is on disk. """
+        self.append([('COMMIT', transaction_id, *nodes)], wait=True)
+
+    def log_commits(self, transaction_nodes):
+        """ Durably record the commits of a whole batch, {transaction_id: nodes}, with one write and one fsync. """
+        self.append([('COMMIT', transaction_id, *nodes) for transaction_id, nodes in transaction_nodes.items()],
+                    wait=True)
+
+    def log_collecting(self, transaction_ids, nodes):
+        """ Presumed commit: durably record that the transactions are about to be prepared. """
+        self.append([('COLLECTING', transaction_id, *nodes) for transaction_id in transaction_ids], wait=True)
+
+    def log_completed(self, transaction_ids, wait=True):
+        """ Presumed commit: durably record commits that need no further delivery tracking. """
+        self.append([('COMPLETED', transaction_id) for transaction_id in transaction_ids], wait)
+
+    def log_aborts(self, transaction_nodes):
+        """ Presumed commit: record aborts, {transaction_id: nodes}, that the nodes must acknowledge. Not forced. """
+        self.append([('ABORT', transaction_id, *nodes) for transaction_id, nodes in transaction_nodes.items()],
+                    wait=False)
+
+    def log_done_many(self, transaction_ids, node):
+        """ Record that node has acknowledged the outcome of every listed transaction.
+
+        Not forced: losing it only causes a resend after a crash.
+        """
+        self.append([('DONE', transaction_id, node) for transaction_id in transaction_ids], wait=False)
+
+    def append(self, records, wait):
+        if records:
+            self.write(records, wait)
+
+    def barrier(self):
+        """ Replicated log: commit an empty entry, which also commits every entry before it. """
+        self.write([], wait=True)
+
+    def write(self, records, wait):
+        """ Append records; when replicated, as one new entry, waiting for a majority if wait is set.
+
+        Raises replication.NotLeader on a replica that is not the leader.
+        """
+        with self.lock:
+            if self.replica is not None:
+                index, term = self.last_index + 1, self.replica.leader_term()
+                records = records + [('INDEX', str(index), str(term))]
+            for record in records:
+                self.apply(record)
+            done = self.wal.submit(records)
+            if self.replica is not None:
+                self.replica.appended(index, term, records)
+        if wait:
+            done.wait()
+            if self.replica is not None:
+                self.replica.wait_replicated(index, term)
+        self.maybe_checkpoint()
+
+    def apply_entries(self, records):
+        """ Follower: append records replicated from the leader, returning once they are durable. """
+        with self.lock:
+            for record in records:
+                self.apply(record)
+            done = self.wal.submit(records)
+        done.wait()
+        self.maybe_checkpoint()
+
+    def position(self):
+        """ (index, term) of the last replicated entry in this log. """
+        with self.lock:
+            return self.last_index, self.last_term
+
+    def snapshot(self):
+        """ The live state as records, ending with the number of the last entry. """
+        with self.lock:
+            return self.live_records()
+
+    def restore(self, records):
+        """ Follower: replace the whole log with a leader's snapshot. """
+        with self.lock:
+            self.pending, self.aborting, self.collecting, self.completed = {}, set(), {}, OrderedDict()
+            self.last_index, self.last_term = 0, 0
+            for record in records:
+                self.apply(record)
+            sequence = self.wal.roll()
+            self.wal.checkpoint(sequence, records)
+
+    def outcome(self, transaction_id):
+        """ 'COMMIT' or 'ABORT' if the log knows the outcome, else None.
+
+        A transaction still collecting votes when the log was last written is
+        reported as aborted: recovery will abort it.
+        """
+        with self.lock:
+            if transaction_id in self.pending:
+                return 'ABORT' if transaction_id in self.aborting else 'COMMIT'
+            if transaction_id in self.collecting:
+                return 'ABORT'
+            return self.completed.get(transaction_id)
+
+    def pending_transactions(self):
+        """ Return {transaction_id: {node: status}} for commits not yet delivered to every node. """
+        with self.lock:
+            return {transaction_id: dict(status) for transaction_id, status in self.pending.items()
+                    if transaction_id not in self.aborting}
+
+    def pending_aborts(self):
+        """ Return {transaction_id: {node: status}} for aborts not yet acknowledged by every node. """
+        with self.lock:
+            return {transaction_id: dict(self.pending[transaction_id]) for transaction_id in self.aborting}
+
+    def collecting_transactions(self):
+        """ Return {transaction_id: nodes} for transactions logged as collecting votes but never decided. """
+        with self.lock:
+            return dict(self.collecting)
+
+    def maybe_checkpoint(self):
+        """ Compact the log in the background once the current segment is large enough. """
+        with self.lock:
+            if self.checkpointing or self.wal.segment_bytes < self.segment_size:
+                return
+            self.checkpointing = True
+        threading.Thread(target=self.checkpoint, daemon=True).start()
+
+    def checkpoint(self):
+        """ Rewrite the live state into a checkpoint and drop the segments it replaces. """
+        try:
+            with self.lock:
+                sequence = self.wal.roll()
+                records = self.live_records()
+            self.wal.checkpoint(sequence, records)
+        finally:
+            with self.lock:
+                self.checkpointing = False
+
+    def live_records(self):
+        """ Records that rebuild the current state. Callers hold self.lock. """
+        records = [('COMPLETED' if decision == 'COMMIT' else 'ABORTED', transaction_id)
+                   for transaction_id, decision in self.completed.items()]
+        records.extend(('COLLECTING', transaction_id, *nodes) for transaction_id, nodes in self.collecting.items())
+        for transaction_id, nodes_commit_status in self.pending.items():
+            kind = 'ABORT' if transaction_id in self.aborting else 'COMMIT'
+            records.append((kind, transaction_id, *nodes_commit_status))
+            records.extend(('DONE', transaction_id, node)
+                           for node, status in nodes_commit_status.items() if status == 'done')
+        if self.last_index:
+            records.append(('INDEX', str(self.last_index), str(self.last_term)))
+        return records
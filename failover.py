@@ -0,0 +1,258 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import cluster
+import launcher
+import logs
+from channel import ChannelPool
+
+# Failover test of a replicated coordinator group on this machine, e.g.
+#   python failover.py --replicas 3 --participants 2 --transactions 600 --crash-after 100
+# Starts the participants and --replicas coordinators (node1.py --serve), each of
+# which exits abruptly halfway through sending its --crash-after-th COMMIT round:
+# the COMMIT has reached one participant and not the others. A crashed replica is
+# started again at once (without the crash), so the group keeps its majority.
+#
+# Clients send BEGIN to the leader, following NOT_LEADER redirects. A transaction
+# whose coordinator fails while it runs has an unknown outcome, and the client
+# goes on with a new transaction. For every crash the report gives the time from
+# the crash to the first commit by the new leader. Afterwards it checks that
+#   - every participant's committed history is the same, without duplicates,
+#   - every transaction a client saw commit is in it, and none it saw abort,
+#   - no participant is left with a transaction in doubt.
+
+node_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+class Group:
+    """ The coordinator processes, restarted without the crash once they exit. """
+
+    def __init__(self, config, data_dir, replicas, crash_after, extra_args):
+        self.config = config
+        self.data_dir = data_dir
+        self.extra_args = list(extra_args)
+        self.processes = [self.spawn(index, crash_after) for index in range(replicas)]
+        self.crashes = []  # Monotonic time of each crash
+
+    def spawn(self, index, crash_after=None):
+        arguments = [sys.executable, '-u', os.path.join(node_dir, 'node1.py'), '--serve', '--config', self.config,
+                     '--replica', str(index), '--log-dir', os.path.join(self.data_dir, f"tc{index}_log"),
+                     *self.extra_args]
+        if crash_after:
+            arguments += ['--crash-after', str(crash_after)]
+        output = open(os.path.join(self.data_dir, f"tc{index}.out"), 'a')
+        process = subprocess.Popen(arguments, stdin=subprocess.DEVNULL, stdout=output, stderr=subprocess.STDOUT)
+        output.close()
+        return process
+
+    def watch(self, stop):
+        """ Record and restart every coordinator that exits, until stop is set. """
+        while not stop.is_set():
+            for index, process in enumerate(self.processes):
+                if process.poll() is not None:
+                    self.crashes.append(time.monotonic())
+                    print(f"Coordinator {index} exited with status {process.returncode}; restarting it",
+                          file=sys.stderr)
+                    self.processes[index] = self.spawn(index)
+            time.sleep(0.005)
+
+    def stop(self):
+        for process in self.processes:
+            if process.poll() is None:
+                process.terminate()
+        for process in self.processes:
+            process.wait()
+
+
+class Client:
+    """ Runs transactions through whichever coordinator leads, remembering what each one answered. """
+
+    def __init__(self, coordinators, timeout):
+        self.coordinators = [cluster.parse_address(address) for address in coordinators]
+        self.timeout = timeout
+        self.pool = ChannelPool(connect_timeout=timeout)
+        self.leader = None
+        self.outcomes = {}  # transaction_id -> 'COMMIT' | 'ABORT' | None (unknown)
+        self.commit_times = []  # Monotonic time of every COMMIT answer
+        self.lock = threading.Lock()
+
+    def find_leader(self, deadline):
+        """ Ask every coordinator until one answers as leader. """
+        while time.monotonic() < deadline:
+            for address in self.coordinators:
+                try:
+                    verb, args = self.pool.get(address).request("INQUIRE_BATCH", "failover-probe").result(
+                        timeout=self.timeout)
+                except (ConnectionError, TimeoutError):
+                    continue
+                if verb != "NOT_LEADER":
+                    self.leader = address
+                    return address
+            time.sleep(0.01)
+        raise TimeoutError("No coordinator became leader")
+
+    def run(self, transaction_id, deadline):
+        """ Run one transaction. A NOT_LEADER answer to BEGIN started nothing, so it is retried at the leader.
+
+        A lost connection or UNDECIDED leaves the outcome unknown (None): the transaction may have started.
+        """
+        while True:
+            address = self.leader or self.find_leader(deadline)
+            try:
+                verb, args = self.pool.get(address).request("BEGIN", transaction_id).result(timeout=self.timeout)
+            except (ConnectionError, TimeoutError):
+                self.leader = None
+                outcome = None
+                break
+            if verb == "UNDECIDED":
+                self.leader = None
+                outcome = None
+                break
+            if verb != "NOT_LEADER":
+                outcome = verb
+                break
+            self.leader = cluster.parse_address(args[0]) if args and args[0] else None
+        with self.lock:
+            self.outcomes[transaction_id] = outcome
+            if outcome == 'COMMIT':
+                self.commit_times.append(time.monotonic())
+        return outcome
+
+
+def drive(client, prefix, count, concurrency, deadline):
+    next_index = [0]
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                index = next_index[0]
+                if index >= count:
+                    return
+                next_index[0] += 1
+            client.run(f"{prefix}-{index}", deadline)
+
+    workers = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+
+def unresolved(pool, participants, transaction_ids, timeout):
+    """ {node: number of the transactions it still has in doubt}, asked with PEER_INQUIRE. """
+    counts = {}
+    for node in participants.values():
+        in_doubt = 0
+        for start in range(0, len(transaction_ids), 1000):
+            chunk = transaction_ids[start:start + 1000]
+            _, args = pool.get(cluster.parse_address(node)).request("PEER_INQUIRE", *chunk).result(timeout=timeout)
+            in_doubt += sum(state in 'UP' for state in args[0])
+        counts[node] = in_doubt
+    return counts
+
+
+def histories(data_dir, participants):
+    result = {}
+    for node_id in participants:
+        with open(os.path.join(data_dir, f"{node_id}committed.txt")) as f:
+            result[node_id] = [line.rstrip('\n') for line in f]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Crash the leader of a replicated coordinator group mid-commit "
+                                                 "and check that the new leader takes over.")
+    parser.add_argument('--replicas', type=int, default=3, help="coordinators in the group")
+    parser.add_argument('--participants', type=int, default=2, help="number of participant processes")
+    parser.add_argument('--transactions', type=int, default=600, help="transactions to run")
+    parser.add_argument('--concurrency', type=int, default=8, help="most transactions in flight at once")
+    parser.add_argument('--crash-after', type=int, default=100,
+                        help="each coordinator crashes during its this many-th COMMIT round (0: never)")
+    parser.add_argument('--presumption', default='abort', choices=cluster.presumptions,
+                        help="protocol variant: presumed abort or presumed commit")
+    parser.add_argument('--batch-window', type=float, default=0, help="coordinator batch window in seconds")
+    parser.add_argument('--base-port', type=int, default=1025,
+                        help="first coordinator port; the other coordinators and the participants use the ports after it")
+    parser.add_argument('--settle-timeout', type=float, default=60,
+                        help="seconds to wait for the participants to resolve every transaction")
+    parser.add_argument('--data-dir', help="directory for every node's logs (default: a new temporary directory)")
+    parser.add_argument('--log-level', default='warning', choices=logs.levels, help="log level of every node")
+    options = parser.parse_args()
+    logs.setup(options.log_level, sys.stderr)
+
+    data_dir = options.data_dir or tempfile.mkdtemp(prefix='2pc-failover-')
+    os.makedirs(data_dir, exist_ok=True)
+    config = os.path.join(data_dir, 'cluster.json')
+    coordinators = [f"localhost:{options.base_port + index}" for index in range(options.replicas)]
+    _, participants = cluster.local(options.participants, coordinator_port=options.base_port + options.replicas - 1)
+    cluster.save(config, coordinators[0], participants, options.presumption, coordinators=coordinators)
+
+    processes = launcher.start_participants(config, data_dir, 'auto', ['--log-level', options.log_level])
+    group = Group(config, data_dir, options.replicas, options.crash_after,
+                  ['--log-level', options.log_level, '--batch-window', str(options.batch_window)])
+    stop = threading.Event()
+    watcher = threading.Thread(target=group.watch, args=(stop,), daemon=True)
+    watcher.start()
+    client = Client(coordinators, timeout=5)
+    prefix = f"failover-{int(time.time())}"
+    try:
+        client.find_leader(time.monotonic() + 30)
+        started = time.monotonic()
+        drive(client, prefix, options.transactions, options.concurrency, time.monotonic() + 600)
+        elapsed = time.monotonic() - started
+        transaction_ids = list(client.outcomes)
+        settle_deadline = time.monotonic() + options.settle_timeout
+        while True:
+            in_doubt = unresolved(client.pool, participants, transaction_ids, timeout=5)
+            if not any(in_doubt.values()) or time.monotonic() > settle_deadline:
+                break
+            time.sleep(0.5)
+        history = histories(data_dir, participants)
+    finally:
+        stop.set()
+        watcher.join()
+        group.stop()
+        launcher.stop_participants(processes)
+
+    outcomes = list(client.outcomes.values())
+    print(f"{outcomes.count('COMMIT')} committed, {outcomes.count('ABORT')} aborted, "
+          f"{outcomes.count(None)} unknown in {elapsed:.2f}s; {len(group.crashes)} coordinator crashes",
+          file=sys.stderr)
+    for crash in group.crashes:
+        after = [moment for moment in client.commit_times if moment > crash]
+        if after:
+            print(f"  failover: first commit {(min(after) - crash) * 1000:.0f} ms after the crash", file=sys.stderr)
+        else:
+            print("  failover: no commit after the crash", file=sys.stderr)
+
+    failures = []
+    committed = {transaction_id for transaction_id, outcome in client.outcomes.items() if outcome == 'COMMIT'}
+    aborted = {transaction_id for transaction_id, outcome in client.outcomes.items() if outcome == 'ABORT'}
+    reference = set(next(iter(history.values())))
+    for node_id, ids in history.items():
+        if len(ids) != len(set(ids)):
+            failures.append(f"{node_id} committed some transactions twice")
+        if set(ids) != reference:
+            failures.append(f"{node_id} disagrees with the other participants on {len(set(ids) ^ reference)} commits")
+        if committed - set(ids):
+            failures.append(f"{node_id} is missing {len(committed - set(ids))} commits the client saw")
+        if aborted & set(ids):
+            failures.append(f"{node_id} committed {len(aborted & set(ids))} transactions the client saw abort")
+    for node, count in in_doubt.items():
+        if count:
+            failures.append(f"{node} still has {count} transactions in doubt")
+    for failure in failures:
+        print("FAILED:", failure, file=sys.stderr)
+    if not failures:
+        print(f"OK: {len(reference)} commits agreed by every participant, none in doubt", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
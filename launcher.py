@@ -0,0 +1,84 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import cluster
+
+# Starts the participants of a cluster as local processes, e.g.
+#   python launcher.py --participants 16 --vote auto
+# writes a 16-participant cluster.json and starts node2 ... node17; then run
+#   python node1.py --config cluster.json
+# Without --participants every participant already in the cluster file is started.
+# Other options (such as --commit-delay) are passed on to every participant.
+# Each node's output goes to <data dir>/<node ID>.out. Ctrl-C stops them all.
+# With --metrics-base-port the participants serve their metrics on consecutive ports from it.
+
+
+def start_participants(config, data_dir, vote, extra_args=(), metrics_base_port=None):
+    """ Start one participant process per node in the cluster file. Returns {node_id: Popen}. """
+    _, participants = cluster.load(config)
+    os.makedirs(data_dir, exist_ok=True)
+    processes = {}
+    for index, node_id in enumerate(participants):
+        node_args = list(extra_args)
+        if metrics_base_port:
+            node_args += ['--metrics-port', str(metrics_base_port + index)]
+        output = open(os.path.join(data_dir, f"{node_id}.out"), 'a')
+        processes[node_id] = subprocess.Popen(
+            [sys.executable, '-u', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'participant.py'),
+             '--node-id', node_id, '--config', config, '--data-dir', data_dir, '--vote', vote, *node_args],
+            stdin=subprocess.DEVNULL, stdout=output, stderr=subprocess.STDOUT)
+        output.close()
+    return processes
+
+
+def stop_participants(processes):
+    """ Terminate the participant processes and wait for them to exit. """
+    for process in processes.values():
+        if process.poll() is None:
+            process.terminate()
+    for process in processes.values():
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Start the participant nodes of a two-phase commit cluster.")
+    parser.add_argument('--config', default=cluster.default_config, help="cluster file to read (or write)")
+    parser.add_argument('--participants', type=int,
+                        help="write a cluster file with this many participants on consecutive local ports first")
+    parser.add_argument('--host', default='localhost', help="host of the generated cluster file")
+    parser.add_argument('--coordinator-port', type=int, default=1025,
+                        help="coordinator port of the generated cluster file; participants use the ports after it")
+    parser.add_argument('--presumption', default='abort', choices=cluster.presumptions,
+                        help="protocol variant of the generated cluster file")
+    parser.add_argument('--protocol', default='2pc', choices=cluster.protocols,
+                        help="commit protocol of the generated cluster file")
+    parser.add_argument('--data-dir', default='cluster_data', help="directory for every node's logs and output")
+    parser.add_argument('--vote', default='auto', help="vote policy of every participant (see vote_policy.py)")
+    parser.add_argument('--metrics-base-port', type=int, help="serve participant metrics on ports from this one up")
+    options, extra_args = parser.parse_known_args()
+    if options.protocol == '3pc' and options.presumption != 'abort':
+        parser.error("three-phase commit needs --presumption abort")
+    if options.participants is not None:
+        cluster.save(options.config, *cluster.local(options.participants, options.host, options.coordinator_port),
+                     options.presumption, options.protocol)
+    processes = start_participants(options.config, options.data_dir, options.vote, extra_args,
+                                   options.metrics_base_port)
+    print(f"Started {len(processes)} participants from {options.config}; output in {options.data_dir}. Ctrl-C to stop.")
+    try:
+        while processes:
+            for node_id, process in list(processes.items()):
+                if process.poll() is not None:
+                    print(f"{node_id} exited with status {process.returncode}")
+                    del processes[node_id]
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("Stopping participants.")
+    finally:
+        stop_participants(processes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+
+# Logging for every node. Log calls only put the record on a queue; one background
+# thread formats and writes them, so a slow terminal never stalls the protocol.
+# Levels: DEBUG for every message sent or received, INFO for per-transaction
+# events, WARNING for failures. Choose the level with --log-level.
+
+levels = ('debug', 'info', 'warning', 'error')
+
+
+def setup(level='info', stream=None):
+    """ Log records of the given level and above to stream (stdout by default) from a background thread. """
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, handler)
+    root = logging.getLogger()
+    root.handlers[:] = [logging.handlers.QueueHandler(records)]
+    root.setLevel(level.upper())
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,158 @@
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Counters, gauges and histograms for the hot path, served in the Prometheus text
+# format at http://localhost:<port>/metrics once serve(port) has been called.
+#
+# Updating a metric takes one short, rarely contended lock and allocates nothing,
+# so it is cheap enough to do for every message. A metric declared with labels
+# is a family: metric.labels('votes') returns the child for those label values.
+
+registry = []  # (name, help, type, metric) in registration order
+default_buckets = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def label_text(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    """ A count that only goes up. """
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self, name, pairs):
+        yield f"{name}{label_text(pairs)} {self.value}"
+
+
+class Gauge:
+    """ A value that goes up and down, or is read from function() when scraped. """
+
+    def __init__(self, function=None):
+        self.value = 0
+        self.function = function
+        self.lock = threading.Lock()
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def samples(self, name, pairs):
+        yield f"{name}{label_text(pairs)} {self.function() if self.function else self.value}"
+
+
+class Histogram:
+    """ Distribution of observed values (seconds, usually) over fixed buckets. """
+
+    def __init__(self, buckets=default_buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last one counts values above every bucket
+        self.sum = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def samples(self, name, pairs):
+        with self.lock:
+            counts, total = list(self.counts), self.sum
+        cumulative = 0
+        for bound, count in zip((*self.buckets, '+Inf'), counts):
+            cumulative += count
+            yield f"{name}_bucket{label_text(pairs + [('le', bound)])} {cumulative}"
+        yield f"{name}_sum{label_text(pairs)} {total}"
+        yield f"{name}_count{label_text(pairs)} {cumulative}"
+
+
+class Family:
+    """ One child metric per combination of label values. """
+
+    def __init__(self, labels, factory):
+        self.label_names = labels
+        self.factory = factory
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self.factory())
+        return child
+
+    def samples(self, name, pairs):
+        for values, child in list(self.children.items()):
+            yield from child.samples(name, pairs + list(zip(self.label_names, values)))
+
+
+def register(name, help, kind, metric, labels):
+    if labels:
+        metric = Family(labels, metric)
+    else:
+        metric = metric()
+    registry.append((name, help, kind, metric))
+    return metric
+
+
+def counter(name, help, labels=()):
+    return register(name, help, 'counter', Counter, labels)
+
+
+def gauge(name, help, function=None, labels=()):
+    return register(name, help, 'gauge', lambda: Gauge(function), labels)
+
+
+def histogram(name, help, labels=(), buckets=default_buckets):
+    return register(name, help, 'histogram', lambda: Histogram(buckets), labels)
+
+
+def render():
+    """ Every registered metric in the Prometheus text exposition format. """
+    lines = []
+    for name, help, kind, metric in registry:
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(metric.samples(name, []))
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, host='localhost'):
+    """ Serve the metrics on host:port from a background thread. Returns the HTTP server. """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name='metrics').start()
+    return server
@@ -1,226 +1,983 @@
-import socket
+import argparse
+import itertools
+import logging
+import os
 import threading
 import time
-import os
-# Configuration
-participant_nodes = ['localhost:1026', 'localhost:1027']  # Example addresses for participant nodes
+from concurrent.futures import ThreadPoolExecutor
+from channel import ChannelPool
+from protocol import batch_verb
+from server import serve
+from decision_log import DecisionLog
+from decision_cache import DecisionCache
+from commit_rules import presumed_outcome, vote_outcome, second_phase_nodes, acknowledged
+from timer_wheel import TimerWheel
+from retry_queue import RetryQueue
+from replication import Replica, NotLeader
+from sharding import WrongShard
+from wal import Signal
+import replication
+import cluster
+import logs
+import metrics
+# Configuration; main() replaces the addresses with those in the cluster file
+participant_nodes = ['localhost:1026', 'localhost:1027']  # Addresses of the participant nodes
+tc_address = 'localhost', 1025  # This coordinator's address
+vote_timeout = 60  # Seconds to wait for every participant's vote before aborting
+node_timeout = 5  # Seconds one participant may take to accept a message during a fan-out
+log_directory = 'tc_log'  # Where the coordinator's decision log lives
+batch_window = 0  # Seconds to collect transactions into one batched round (0 disables batching)
+batch_size = 1000  # Most transactions in one batched round
+presumption = 'abort'  # Protocol variant, 'abort' or 'commit'; main() takes it from the cluster file
+protocol = '2pc'  # Commit protocol, '2pc' or '3pc'; main() takes it from the cluster file
+coordinator_group = []  # Every coordinator of a replicated group, as 'host:port' (empty: this TC runs alone)
+routing = None  # Sharded cluster: the RoutingTable of which shard owns which transaction IDs (None: all are ours)
+shard = 0  # This TC's shard in routing
+crash_after = None  # Test hook: exit abruptly in the middle of the commit fan-out of this many-th commit round
+simulated_outage = 40  # Test hook: seconds a simulated TC failure holds back a transaction's PREPARE
+
+# Durable record of commit decisions and the in-memory index used to answer inquiries, opened by start()
+decision_log = None
+decision_cache = None
+# This coordinator's member of a replicated coordinator group, started by start() when there is a group
+replica = None
+
+# Transactions in flight, keyed by transaction ID
+transactions = {}
+transactions_lock = threading.Lock()
+
+# Drives the vote timeouts of every transaction and the batch window from one thread
+timers = TimerWheel()
+
+# Run the steps of every transaction that may block (sending PREPARE, recording the vote that decides it and
+# logging the decision, the second phase, batched rounds) on a bounded pool instead of a thread each. Votes
+# and one-phase replies arrive on the channel reader threads and are handed over here. A step never waits
+# for another step, and the fan-outs it waits for run on the channel pool's own threads
+workers = ThreadPoolExecutor(max_workers=64, thread_name_prefix='transaction')
+
+# Three-phase commit: logged commits that participants may have aborted while the TC was down, with the
+# state reported so far by each participant, {transaction_id: {node: STATES letter}}. Each stays
+# undecided here until reconcile_commits() settles it
+unreconciled = {}
+unreconciled_lock = threading.Lock()
+
+log = logging.getLogger('coordinator')
+
+# Protocol variants:
+#   presumed abort   the commit decision is the only forced write; aborts are neither
+#                    logged nor acknowledged, and an unknown transaction was aborted
+#   presumed commit  a forced COLLECTING record precedes PREPARE and the forced commit
+#                    record needs no delivery tracking; aborts are logged (not forced)
+#                    and acknowledged by every participant that may have prepared, and
+#                    an unknown transaction was committed
+# In both, a participant that votes READ_ONLY has nothing to commit and takes no
+# part in phase two, and a transaction that is read-only everywhere is committed
+# without a forced log write.
+#
+# PREPARE names every participant of the transaction, so participants left in
+# doubt while the TC is down can settle it among themselves (see participant.py).
+# Three-phase commit (protocol '3pc', presumed abort only) adds a PRECOMMIT round
+# between the logged commit decision and COMMIT, which lets the participants
+# also terminate transactions none of them knows the outcome of. Because they
+# may have aborted a logged commit while the TC was down, a restarted TC asks
+# them about its unfinished commits (RECONCILE), and answers UNDECIDED for each
+# until every one of its participants has reported its state (or one has
+# committed it). A participant that reports a transaction in doubt leaves its
+# outcome to the TC from then on, so a commit kept on those reports is safe.
+#
+# A transaction runs at every participant unless its BEGIN names a subset. One
+# with a single participant takes the one-phase fast path: that participant's
+# vote is the outcome, so it is sent one ONE_PHASE request and commits at once.
+# Nothing is logged here and no participant is ever in doubt about it, under
+# either presumption; if the reply is lost the outcome is simply unknown here.
+
+# Phases of a committed transaction, as (first step, last step) in Transaction.times
+phases = {
+    'prepare': ('begun', 'prepare_sent'),  # PREPARE reached every participant (includes batch queueing)
+    'votes': ('prepare_sent', 'voted'),  # every vote collected
+    'log': ('voted', 'logged'),  # commit decision durable in the decision log
+    'precommit': ('logged', 'precommitted'),  # three-phase commit: PRECOMMIT acknowledged
+    'commit': ('logged', 'completed'),  # COMMIT reached every participant
+    'total': ('begun', 'completed'),
+}
+
+# Metrics, served on --metrics-port
+transactions_in_flight = metrics.gauge('tpc_transactions_in_flight', "Transactions begun and not yet finished",
+                                       lambda: len(transactions))
+decisions = metrics.counter('tpc_transactions_total', "Transactions decided, by decision", labels=('decision',))
+phase_seconds = metrics.histogram('tpc_phase_seconds', "Duration of each phase of committed transactions",
+                                  labels=('phase',))
+vote_timeouts = metrics.counter('tpc_vote_timeouts_total', "Transactions aborted because a vote did not arrive in time")
+inquiries = metrics.counter('tpc_inquiries_total', "Transaction outcomes asked for by participants")
+recovery_backlog = metrics.gauge('tpc_recovery_backlog', "Logged commits not yet delivered to every participant",
+                                 lambda: len(decision_log.pending) if decision_log else 0)
+
+
+class InFlight(ValueError):
+    """ Raised by begin() for a transaction ID that is already running. """
+
+    def __init__(self, transaction):
+        super().__init__(f"Transaction {transaction.transaction_id} is already in flight")
+        self.transaction = transaction
+
+
+class Transaction:
+    """ Coordinator-side state of one transaction: its vote table, vote timer and decision. """
+
+    def __init__(self, transaction_id, nodes):
+        self.transaction_id = transaction_id
+        self.prepare_sent = False
+        self.responses = {node: None for node in nodes}
+        self.decision = None
+        self.one_phase = False  # Decided by its only participant (one-phase commit)
+        self.decided = Signal()
+        self.finished = threading.Event()  # Set once the second phase is over and the transaction is forgotten
+        self.timer = None
+        # Monotonic time of each step: begun, prepare_sent, voted, logged and precommitted (commits only), completed
+        self.times = {'begun': time.monotonic()}
+
+    def mark(self, step):
+        self.times[step] = time.monotonic()
+
+    def wait_for_decision(self, timeout=None):
+        """ Block until the transaction is decided and return 'COMMIT' or 'ABORT'.
+
+        Returns None on timeout, or if this coordinator lost the leadership of
+        its group before the decision was logged; the new leader settles it then.
+        """
+        self.decided.wait(timeout)
+        return self.decision
+
+    def __repr__(self):
+        return f"Transaction({self.transaction_id!r}, responses={self.responses}, decision={self.decision})"
+
+
+def notify_participant_nodes_of_new_transaction(transaction_id, nodes):
+    """ Notify participant nodes about the start of a new transaction. """
+    results = pool.fan_out(nodes, lambda node, channel: channel.send("START", transaction_id), node_timeout)
+    for node, result in results.items():
+        if isinstance(result, Exception):
+            log.warning("Failed to notify %s about the start of transaction %s: %s", node, transaction_id, result)
+        else:
+            log.debug("Notified %s about the start of transaction %s", node, transaction_id)
 
-# States
-state = {'transaction_id': None, 'prepare_sent': False, 'responses': {}}
+def simulate_tc_failure(transaction):
+    """ Announce a transaction with START, then hold its PREPARE back for simulated_outage seconds. """
+    transaction_id = transaction.transaction_id
+    notify_participant_nodes_of_new_transaction(transaction_id, list(transaction.responses))
+    log.warning("Simulating TC failure for transaction %s. No 'prepare' message will be sent.", transaction_id)
+    timers.schedule(simulated_outage, prepare_later, transaction)
 
-def notify_participant_nodes_of_new_transaction(transaction_id):
-    """ Notify participant nodes about the start of a new transaction. """
-    for node in participant_nodes:
-        host, port = node.split(':')
-        try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.connect((host, int(port)))
-                s.sendall(f"START {transaction_id}".encode())
-                print(f"Notified {node} about the start of transaction {transaction_id}")
-        except ConnectionError as e:
-            print(f"Failed to notify {node} about the start of transaction {transaction_id}: {e}")
-
-def send_prepare_message(transaction_id, simulate_failure):
-    global state
-    state['transaction_id'] = transaction_id
-    state['prepare_sent'] = False
-    state['responses'] = {node: None for node in participant_nodes}
-
-    # Check if we need to simulate TC failure
-    if simulate_failure:
-        notify_participant_nodes_of_new_transaction(transaction_id)
-        print(f"Simulating TC failure for transaction {transaction_id}. No 'prepare' message will be sent.")
-        time.sleep(40)
-
-    # Send prepare message to each participant node
-    for node in participant_nodes:
-        host, port = node.split(':')
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            try:
-                s.connect((host, int(port)))
-                s.sendall(f"PREPARE {transaction_id}".encode())
-                print(f"Sent PREPARE to {node}")
-            except ConnectionError as e:
-                print(f"Failed to send PREPARE to {node}: {e}")
 
-    state['prepare_sent'] = True
+def prepare_later(transaction):
+    # Runs on the timer wheel's thread, which must not block
+    workers.submit(send_prepare_message, transaction)
+
 
+def send_prepare_message(transaction):
+    transaction_id = transaction.transaction_id
+    nodes = list(transaction.responses)
 
-def write_transaction_to_file(transaction_id, nodes_commit_status):
-    """ Writes the transaction information and commit status to a file. """
-    filename = f"transaction_{transaction_id}.txt"
-    with open(filename, 'w') as file:
-        data_entries = [f"{node}:{status}" for node, status in nodes_commit_status.items()]
-        data = f"{transaction_id},{'|'.join(data_entries)}"
-        file.write(data)
+    if presumption == 'commit':
+        try:
+            decision_log.log_collecting([transaction_id], nodes)
+        except NotLeader as e:
+            abandon([transaction], e)
+            return
+
+    # Send prepare message to all participant nodes at once; each vote comes back as the reply
+    def send_prepare(node, channel):
+        vote = channel.request("PREPARE", transaction_id, *nodes)
+        vote.add_done_callback(lambda future: vote_received(transaction_id, node, future))
+
+    results = pool.fan_out(nodes, send_prepare, node_timeout)
+    for node, result in results.items():
+        if isinstance(result, Exception):
+            log.warning("Failed to send PREPARE to %s: %s", node, result)
+            record_vote(transaction_id, node, 'NO')
+        else:
+            log.debug("Sent PREPARE to %s for transaction %s", node, transaction_id)
 
+    transaction.prepare_sent = True
+    transaction.mark('prepare_sent')
 
 
+def vote_received(transaction_id, node, future):
+    """ Callback for the reply to a PREPARE request. A lost connection counts as a 'NO' vote.
 
-def send_commit_messages(transaction_id, nodes_commit_status):
-    """ Sends a commit message to each participant node and updates the file upon success. """
-    for node, status in nodes_commit_status.items():
-        if status == 'pending':
-            host, port = node.split(':')
+    Runs on the channel's reader thread, so the vote is recorded on a worker:
+    the last one decides the transaction and waits for the decision log.
+    """
+    try:
+        response, _ = future.result()
+    except ConnectionError as e:
+        log.warning("Lost connection to %s while waiting for its vote: %s", node, e)
+        response = 'NO'
+    workers.submit(record_vote, transaction_id, node, response)
+
+
+def begin(transaction_id, simulate_failure=False, nodes=None):
+    """ Start the prepare phase of a new transaction and return its Transaction without waiting for the outcome.
+
+    nodes lists the participants the transaction involves (default: every participant).
+    """
+    if replica is not None and not replica.leading:
+        raise NotLeader(replica.leader)
+    check_owned(transaction_id)
+    nodes = list(dict.fromkeys(nodes or participant_nodes))
+    unknown = [node for node in nodes if node not in participant_nodes]
+    if unknown:
+        raise ValueError(f"Transaction {transaction_id} names unknown participants: {', '.join(unknown)}")
+    with transactions_lock:
+        if transaction_id in transactions:
+            raise InFlight(transactions[transaction_id])
+        transaction = Transaction(transaction_id, nodes)
+        transaction.one_phase = len(nodes) == 1 and not simulate_failure
+        transactions[transaction_id] = transaction
+
+    if transaction.one_phase:
+        workers.submit(commit_one_phase, transaction)
+        return transaction
+    if batch_window > 0 and not simulate_failure:
+        add_to_batch(transaction)
+        return transaction
+    transaction.timer = timers.schedule(vote_timeout, vote_timed_out, transaction_id)
+    workers.submit(simulate_tc_failure if simulate_failure else send_prepare_message, transaction)
+    return transaction
+
+
+def commit_one_phase(transaction):
+    """ Ask a transaction's only participant to commit it outright, and take its answer as the decision.
+
+    A participant that cannot be reached never saw the transaction, which is
+    then aborted. A lost reply, or none within vote_timeout, leaves the
+    decision unknown (None).
+    """
+    transaction_id = transaction.transaction_id
+    node = next(iter(transaction.responses))
+    try:
+        channel = pool.get(node)
+    except ConnectionError as e:
+        log.warning("Failed to reach %s for one-phase transaction %s: %s", node, transaction_id, e)
+        one_phase_decided(transaction, 'ABORT')
+        return
+    transaction.mark('prepare_sent')
+    transaction.timer = timers.schedule(vote_timeout, one_phase_timed_out, transaction)
+    reply = channel.request("ONE_PHASE", transaction_id)
+    reply.add_done_callback(lambda future: workers.submit(one_phase_replied, transaction, node, future))
+
+
+def one_phase_replied(transaction, node, future):
+    """ Called on a worker with the reply to ONE_PHASE. """
+    try:
+        decision, _ = future.result()
+    except ConnectionError as e:
+        log.warning("No outcome from %s for one-phase transaction %s: %s", node, transaction.transaction_id, e)
+        decision = None
+    one_phase_decided(transaction, decision)
+
+
+def one_phase_timed_out(transaction):
+    # Runs on the timer wheel's thread; deciding without a reply does not block
+    log.warning("No outcome for one-phase transaction %s within %ss", transaction.transaction_id, vote_timeout)
+    one_phase_decided(transaction, None)
+
+
+def one_phase_decided(transaction, decision):
+    """ Take the reply to ONE_PHASE (None if there was none) as the outcome, once, and drop the transaction. """
+    transaction_id = transaction.transaction_id
+    with transactions_lock:
+        if transaction.decided.is_set():
+            return  # The reply came after the timeout, or the other way round
+        transaction.decision = decision if decision in ('COMMIT', 'ABORT') else None
+        transaction.decided.set()
+    if transaction.timer is not None:
+        transaction.timer.cancel()
+    if transaction.decision is not None:
+        transaction.mark('voted')
+        decisions.labels(transaction.decision).inc()
+        decision_cache.record(transaction_id, transaction.decision)
+    forget_transaction(transaction)
+
+
+def check_owned(transaction_id):
+    """ Raise WrongShard unless this TC's shard owns the transaction. """
+    if routing is not None:
+        owner = routing.shard(transaction_id)
+        if owner != shard:
+            raise WrongShard(transaction_id, routing.coordinators(owner))
+
+
+def vote_timed_out(transaction_id):
+    """ Called when a transaction has not collected every vote within vote_timeout. """
+    transaction = transactions.get(transaction_id)
+    if transaction is not None and transaction.decision is None:
+        log.warning("Response timeout for transaction %s. Aborting transaction.", transaction_id)
+        vote_timeouts.inc()
+        decide(transaction, 'ABORT')
+
+
+def record_vote(transaction_id, responding_node, response):
+    """ Record one participant's vote and decide the transaction once the outcome is known. """
+    transaction = transactions.get(transaction_id)
+    if transaction is None or responding_node not in transaction.responses:
+        log.info("Ignoring vote %s from %s for unknown transaction %s", response, responding_node, transaction_id)
+        return
+
+    with transactions_lock:
+        if transaction.decision is not None:
+            return
+        transaction.responses[responding_node] = response
+        outcome = vote_outcome(transaction.responses.values())
+    log.debug("Received response: %s from %s for transaction %s", response, responding_node, transaction_id)
+
+    if outcome == 'ABORT':  # Abort immediately if any node responds with 'NO'
+        log.info("At least one participant voted to abort. Aborting transaction %s.", transaction_id)
+        decide(transaction, 'ABORT')
+    elif outcome == 'COMMIT':
+        log.info("All participants agreed to commit. Logging and committing transaction %s.", transaction_id)
+        decide(transaction, 'COMMIT')
+
+
+def decide(transaction, decision):
+    """ Fix the outcome of a transaction exactly once and start the second phase. """
+    with transactions_lock:
+        if transaction.decision is not None:
+            return
+        transaction.decision = decision
+    transaction.mark('voted')
+    decisions.labels(decision).inc()
+    if transaction.timer is not None:
+        transaction.timer.cancel()
+
+    transaction_id = transaction.transaction_id
+    # Participants that voted READ_ONLY (or, for an abort, NO) take no part in the second phase
+    nodes = second_phase_nodes(decision, transaction.responses)
+    if decision == 'COMMIT':
+        try:
+            if presumption == 'commit':
+                decision_log.log_completed([transaction_id], wait=bool(nodes))
+            elif nodes:
+                decision_log.log_commit(transaction_id, nodes)
+        except NotLeader as e:
+            abandon([transaction], e)
+            return
+        transaction.mark('logged')
+        decision_cache.record(transaction_id, decision)
+        transaction.decided.set()
+        workers.submit(finish_commit, transaction, nodes)
+    elif presumption == 'commit':
+        # Every participant that may have prepared has to acknowledge the abort
+        try:
+            decision_log.log_aborts({transaction_id: nodes})
+        except NotLeader as e:
+            abandon([transaction], e)
+            return
+        decision_cache.record(transaction_id, decision)
+        transaction.decided.set()
+        workers.submit(finish_abort, transaction, nodes)
+    else:
+        decision_cache.record(transaction_id, decision)
+        transaction.decided.set()
+        # Participants that may have prepared are told at once rather than left to inquire
+        workers.submit(finish_abort, transaction, nodes)
+
+
+def finish_commit(transaction, nodes):
+    """ Run the commit phase of a decided transaction and drop it from the in-flight table. """
+    node_transactions = {node: [transaction.transaction_id] for node in nodes}
+    if acknowledged('COMMIT', presumption):
+        if protocol == '3pc':
+            precommit(node_transactions)
+            transaction.mark('precommitted')
+        send_decisions('COMMIT', node_transactions)
+    else:
+        notify_decisions('COMMIT', node_transactions)
+    forget_transaction(transaction)
+
+
+def finish_abort(transaction, nodes):
+    """ Send the abort to the nodes that may have prepared, then drop the transaction.
+
+    Under presumed commit they have to acknowledge it; under presumed abort it
+    needs no acknowledgement, as in decide_batch().
+    """
+    node_transactions = {node: [transaction.transaction_id] for node in nodes}
+    if acknowledged('ABORT', presumption):
+        send_decisions('ABORT', node_transactions)
+    else:
+        notify_decisions('ABORT', node_transactions)
+    forget_transaction(transaction)
+
+
+def abandon(abandoned, error):
+    """ Drop transactions whose decision could not be logged because this coordinator is no longer the leader. """
+    log.warning("Dropping %d transactions for the new leader to settle: %s", len(abandoned), error)
+    for transaction in abandoned:
+        transaction.decision = None
+        transaction.decided.set()
+        forget_transaction(transaction)
+
+
+def forget_transaction(transaction):
+    with transactions_lock:
+        if transactions.get(transaction.transaction_id) is transaction:
+            del transactions[transaction.transaction_id]
+    transaction.mark('completed')
+    transaction.finished.set()
+    if transaction.decision == 'COMMIT':
+        for phase, (start, end) in phases.items():
+            if start in transaction.times and end in transaction.times:
+                phase_seconds.labels(phase).observe(transaction.times[end] - transaction.times[start])
+
+
+# Batching: with batch_window > 0, begin() queues transactions. The queue is run
+# as one round every batch_window seconds, or as soon as batch_size transactions
+# are waiting: one PREPARE_BATCH per participant, one VOTES vector back, one
+# decision-log write, then one COMMIT_BATCH and one ABORT_BATCH per participant.
+# Every transaction is still decided on its own votes.
+batch = []
+batch_timer = None
+batch_lock = threading.Lock()
+
+
+def add_to_batch(transaction):
+    global batch, batch_timer
+    full = None
+    with batch_lock:
+        batch.append(transaction)
+        if len(batch) >= batch_size:
+            full, batch = batch, []
+            if batch_timer is not None:
+                batch_timer.cancel()
+                batch_timer = None
+        elif batch_timer is None:
+            batch_timer = timers.schedule(batch_window, flush_batch)
+    if full:
+        workers.submit(run_batch, full)
+
+
+def flush_batch():
+    """ Called by the timer wheel when the batch window closes: run whatever has been queued. """
+    global batch, batch_timer
+    with batch_lock:
+        full, batch, batch_timer = batch, [], None
+    if full:
+        workers.submit(run_batch, full)
+
+
+def run_batch(batched):
+    """ Collect a vote vector from every participant for the batch and decide each transaction.
+
+    Transactions that involve different sets of participants go out as one
+    PREPARE_BATCH per set, all sent before any vote is waited for.
+    """
+    groups = {}  # Participants -> the transactions of the batch that involve exactly those
+    for transaction in batched:
+        groups.setdefault(tuple(transaction.responses), []).append(transaction)
+    if presumption == 'commit':
+        try:
+            for nodes, group in groups.items():
+                decision_log.log_collecting([transaction.transaction_id for transaction in group], nodes)
+        except NotLeader as e:
+            abandon(batched, e)
+            return
+    requests = {}  # (participants, node) -> its VOTES request, or the exception
+    for nodes, group in groups.items():
+        transaction_ids = [transaction.transaction_id for transaction in group]
+        sent = pool.send_all({node: ("PREPARE_BATCH", ','.join(nodes), *transaction_ids) for node in nodes},
+                             node_timeout)
+        requests.update(((nodes, node), request) for node, request in sent.items())
+    for transaction in batched:
+        transaction.mark('prepare_sent')
+    replies = pool.replies(requests, vote_timeout)
+
+    committed, aborted = [], []
+    for nodes, group in groups.items():
+        votes = {}
+        for node in nodes:
+            reply = replies[nodes, node]
+            if reply is not None:
+                verb, args = reply
+                if verb == 'VOTES' and len(args[0]) == len(group):
+                    votes[node] = args[0]
+                    continue
+            log.warning("No usable votes from %s for a batch of %d. Aborting its transactions.", node, len(group))
+            votes[node] = 'N' * len(group)
+        for index, transaction in enumerate(group):
+            for node in nodes:
+                transaction.responses[node] = batch_votes.get(votes[node][index], 'NO')
+            if vote_outcome(transaction.responses.values()) == 'COMMIT':
+                committed.append(transaction)
+            else:
+                aborted.append(transaction)
+    decide_batch(committed, aborted)
+
+
+batch_votes = {'Y': 'YES', 'N': 'NO', 'R': 'READ_ONLY'}
+
+
+def decide_batch(committed, aborted):
+    """ Log all commits of a batch with one forced write, then send each participant the outcomes. """
+    with transactions_lock:
+        # An inquiry may already have aborted a transaction of the batch; decide() has dealt with those
+        committed = [transaction for transaction in committed if transaction.decision is None]
+        aborted = [transaction for transaction in aborted if transaction.decision is None]
+        for transaction in committed:
+            transaction.decision = 'COMMIT'
+        for transaction in aborted:
+            transaction.decision = 'ABORT'
+    for transaction in committed + aborted:
+        transaction.mark('voted')
+    decisions.labels('COMMIT').inc(len(committed))
+    decisions.labels('ABORT').inc(len(aborted))
+    # The nodes that take part in the second phase of each transaction
+    commit_nodes = {transaction.transaction_id: second_phase_nodes('COMMIT', transaction.responses)
+                    for transaction in committed}
+    abort_nodes = {transaction.transaction_id: second_phase_nodes('ABORT', transaction.responses)
+                   for transaction in aborted}
+    committed_ids = list(commit_nodes)
+    aborted_ids = list(abort_nodes)
+    try:
+        if presumption == 'commit':
+            # As in decide(): only a commit some participant has to apply is forced
+            decision_log.log_completed(committed_ids, wait=any(commit_nodes.values()))
+            decision_log.log_aborts(abort_nodes)
+        else:
+            decision_log.log_commits({transaction_id: nodes for transaction_id, nodes in commit_nodes.items() if nodes})
+    except NotLeader as e:
+        abandon(committed + aborted, e)
+        return
+    for transaction in committed:
+        transaction.mark('logged')
+    for transaction in committed + aborted:
+        decision_cache.record(transaction.transaction_id, transaction.decision)
+        transaction.decided.set()
+    log.info("Batch decided: %d committed, %d aborted.", len(committed_ids), len(aborted_ids))
+
+    node_commits = {node: [transaction_id for transaction_id, nodes in commit_nodes.items() if node in nodes]
+                    for node in participant_nodes}
+    node_aborts = {node: [transaction_id for transaction_id, nodes in abort_nodes.items() if node in nodes]
+                   for node in participant_nodes}
+    if presumption == 'commit':
+        notify_decisions('COMMIT', node_commits)
+        send_decisions('ABORT', node_aborts)
+    else:
+        if protocol == '3pc':
+            precommit(node_commits)
+            for transaction in committed:
+                transaction.mark('precommitted')
+        send_decisions('COMMIT', node_commits)
+        # Aborts need no acknowledgement; they only spare the participants an inquiry
+        notify_decisions('ABORT', node_aborts)
+    for transaction in committed + aborted:
+        forget_transaction(transaction)
+
+
+def send_decisions(verb, node_transactions):
+    """ Send each node its decisions, {node: [transaction_id]}, and log DONE as each node acknowledges them.
+
+    A node that cannot be reached or does not acknowledge within node_timeout
+    is handed to the retry queue, so it never holds up the caller for longer.
+    """
+    node_transactions = {node: transaction_ids for node, transaction_ids in node_transactions.items() if transaction_ids}
+    maybe_crash(verb, node_transactions)
+    replies = pool.request_all({node: (batch_verb(verb, transaction_ids), *transaction_ids)
+                                for node, transaction_ids in node_transactions.items()}, node_timeout)
+    for node, reply in replies.items():
+        transaction_ids = node_transactions[node]
+        if reply is not None:
+            log.debug("%s acknowledged %s of %d transactions", node, verb, len(transaction_ids))
             try:
-                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                    s.connect((host, int(port)))
-                    s.sendall(f"COMMIT {transaction_id}".encode())
-                    print(f"Sent COMMIT to {node}")
-                    nodes_commit_status[node] = 'done'
-                    write_transaction_to_file(transaction_id, nodes_commit_status)
-            except ConnectionError as e:
-                print(f"Failed to send COMMIT to {node}: {e}")
-        ## Uncomment these two below line if you want to make TC fail after sending commit to one of the participant node.
-        #print(f"Simulating TC sleep You can stop TC if you want to trigger to stop message to rest of the nodes")
-        #time.sleep(40)
-
-def handle_inquiry(transaction_id, client_socket):
+                decision_log.log_done_many(transaction_ids, node)
+            except NotLeader:
+                return  # The new leader redelivers whatever is not logged as done
+        else:
+            log.warning("%s did not acknowledge %s of %d transactions; retrying in the background",
+                        node, verb, len(transaction_ids))
+            retries.add(node, verb, transaction_ids)
+
+
+def precommit(node_transactions):
+    """ Three-phase commit: move each node's transactions, {node: [transaction_id]}, to precommitted.
+
+    Waits up to node_timeout for the acknowledgements. A node that does not
+    acknowledge is taken to have failed; it learns the outcome from the COMMIT
+    that follows (or its redelivery), or from its peers.
+    """
+    node_transactions = {node: transaction_ids for node, transaction_ids in node_transactions.items() if transaction_ids}
+    replies = pool.request_all({node: (batch_verb('PRECOMMIT', transaction_ids), *transaction_ids)
+                                for node, transaction_ids in node_transactions.items()}, node_timeout)
+    for node, reply in replies.items():
+        if reply is None:
+            log.warning("%s did not acknowledge PRECOMMIT of %d transactions", node, len(node_transactions[node]))
+
+
+commit_rounds = itertools.count(1)
+
+
+def maybe_crash(verb, node_transactions):
+    """ Test hook (--crash-after): exit abruptly once the crash_after-th COMMIT round has reached only one node. """
+    if verb != 'COMMIT' or crash_after is None or not node_transactions or next(commit_rounds) != crash_after:
+        return
+    first = next(iter(node_transactions))
+    pool.get(first).request(batch_verb(verb, node_transactions[first]),
+                            *node_transactions[first]).result(timeout=node_timeout)
+    # Printed rather than logged: os._exit() does not wait for the logging thread
+    print(f"Crashing in the middle of the commit fan-out (--crash-after {crash_after})", flush=True)
+    os._exit(1)
+
+
+def notify_decisions(verb, node_transactions):
+    """ Send each node its decisions, {node: [transaction_id]}, as one-way messages that need no acknowledgement. """
+    node_transactions = {node: transaction_ids for node, transaction_ids in node_transactions.items() if transaction_ids}
+    maybe_crash(verb, node_transactions)
+    results = pool.fan_out(list(node_transactions),
+                           lambda node, channel: channel.send(batch_verb(verb, node_transactions[node]),
+                                                              *node_transactions[node]),
+                           node_timeout)
+    for node, result in results.items():
+        if isinstance(result, Exception):
+            log.warning("Failed to send %s to %s: %s", verb, node, result)
+
+
+def deliver(node, verb, transaction_ids):
+    """ Redeliver decisions to one node and log DONE once it acknowledges them. Raises if it does not. """
+    if replica is not None and replica.role != 'leader':
+        return  # Dropped: the new leader redelivers from its own log
+    pool.get(node).request(batch_verb(verb, transaction_ids), *transaction_ids).result(timeout=node_timeout)
+    try:
+        decision_log.log_done_many(transaction_ids, node)
+    except NotLeader:
+        pass
+
+
+# Decisions that a node has not acknowledged yet, resent in the background with per-node backoff
+retries = RetryQueue(deliver, timers)
+undelivered = metrics.gauge('tpc_undelivered_decisions', "Decisions waiting in the retry queue for a node to acknowledge",
+                            lambda: retries.pending())
+
+
+async def resolve(transaction_id):
+    """ Return 'COMMIT' or 'ABORT' for an inquiry, aborting the transaction first if it is still undecided.
+
+    Returns None when the outcome is not known here: the transaction was
+    abandoned to a new leader, a one-phase commit got no answer, or a
+    three-phase commit logged before a restart is not reconciled yet.
+    """
+    inquiries.inc()
+    transaction = transactions.get(transaction_id)
+    if transaction is None:
+        if transaction_id in unreconciled:
+            return None  # Logged as committed, but a participant may have aborted it while the TC was down
+        return decision_cache.outcome(transaction_id)
+    if transaction.decision is None and not transaction.one_phase and not transaction.decided.is_set():
+        log.info("Participant inquired about undecided transaction %s. Aborting transaction.", transaction_id)
+        decide(transaction, 'ABORT')
+    if not transaction.decided.is_set():
+        # A commit is only reported once it is durable in the decision log
+        await transaction.decided.wait_async()
+    return transaction.decision
+
+async def handle_inquiry(transaction_id, connection, request_id):
     """ Handle an inquiry about a transaction's status. """
     try:
-        filename = f"transaction_{transaction_id}.txt"
-        if os.path.exists(filename):
-            # Assuming that the existence of the file means the transaction was committed
-            response_message = f"COMMIT {transaction_id}"
+        response = await resolve(transaction_id)
+        if response is None:
+            reply_unknown(connection, request_id, transaction_id)
         else:
-            response_message = f"ABORT {transaction_id}"
-        client_socket.sendall(response_message.encode())
-    except Exception as e:
-        print(f"Error handling inquiry for transaction {transaction_id}: {e}")
+            connection.reply(request_id, response, transaction_id)
+    except Exception:
+        log.exception("Error handling inquiry for transaction %s", transaction_id)
+
+async def handle_bulk_inquiry(transaction_ids, connection, request_id):
+    """ Resolve many transactions in one request; the reply has one 'C', 'A' or '?' (not known here) per ID, in order.
+
+    After losing the leadership, a batch with any unknown outcome is answered
+    NOT_LEADER instead, so the participant asks the new leader about all of it.
+    """
+    outcomes = [await resolve(transaction_id) for transaction_id in transaction_ids]
+    if None in outcomes and replica is not None and not replica.leading:
+        reply_unknown(connection, request_id, transaction_ids[outcomes.index(None)])
+        return
+    connection.reply(request_id, "OUTCOMES", ''.join(outcome_letters.get(outcome, '?') for outcome in outcomes))
+
+outcome_letters = {'COMMIT': 'C', 'ABORT': 'A'}
+
+def reply_unknown(connection, request_id, transaction_id):
+    """ Answer an inquiry whose outcome this TC does not know, never with a presumed abort: the commit may be logged.
+
+    After losing the leadership the answer is NOT_LEADER, so the participant asks the new leader; otherwise UNDECIDED.
+    """
+    if replica is not None and not replica.leading:
+        leader = replica.leader if replica.leader != replica.address else None
+        connection.reply(request_id, "NOT_LEADER", leader or '')
+    else:
+        connection.reply(request_id, "UNDECIDED", transaction_id)
+
+async def handle_begin(transaction_id, connection, request_id, nodes=()):
+    """ Run a transaction for a client, at the participants listed in nodes (default: all), and reply with its
+    decision.
+    """
+    try:
+        transaction = begin(transaction_id, nodes=nodes)
+    except InFlight as e:
+        # A retried or duplicate BEGIN gets the outcome of the run already in progress
+        transaction = e.transaction
+    except WrongShard as e:
+        connection.reply(request_id, "WRONG_SHARD", ','.join(e.coordinators))
+        return
+    except ValueError:
+        connection.reply(request_id, "ABORT", transaction_id)
+        return
+    except NotLeader as e:
+        connection.reply(request_id, "NOT_LEADER", e.leader or '')
+        return
+    await transaction.decided.wait_async()
+    decision = transaction.decision
+    if decision is None:
+        connection.reply(request_id, "UNDECIDED", transaction_id)
+    else:
+        connection.reply(request_id, decision, transaction_id)
+
+async def handle_node_message(connection, request_id, verb, args):
+    """ Handle a request arriving on any connection from a participant node, a client or another replica. """
+    if verb in replication.VERBS:
+        if replica is None:
+            log.warning("Ignoring %s from %s: this coordinator is not replicated", verb, connection.name)
+        else:
+            await replica.handle(connection, request_id, verb, args)
+        return
+    if replica is not None and not replica.leading:
+        # Only the leader runs transactions and answers inquiries
+        leader = replica.leader if replica.leader != replica.address else None
+        connection.reply(request_id, "NOT_LEADER", leader or '')
+        return
+    if verb in ("INQUIRE", "INQUIRE_BATCH"):
+        # Answering for another shard's transaction would presume its outcome
+        try:
+            for transaction_id in args:
+                check_owned(transaction_id)
+        except WrongShard as e:
+            log.warning("Inquiry sent to the wrong shard: %s", e)
+            connection.reply(request_id, "WRONG_SHARD", ','.join(e.coordinators))
+            return
+    if verb == "BEGIN":
+        await handle_begin(args[0], connection, request_id, args[1:])
+    elif verb == "INQUIRE":
+        transaction_id = args[0]
+        await handle_inquiry(transaction_id, connection, request_id)
+    elif verb == "INQUIRE_BATCH":
+        await handle_bulk_inquiry(args, connection, request_id)
+    # Handle other types of messages...
+
 
 def listen_for_requests():
-    """ Listen for and handle incoming requests from participant nodes. """
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.bind(('localhost', 1025))
-        s.listen()
-        while True:
-            conn, addr = s.accept()
-            with conn:
-                data = conn.recv(1024).decode()
-                if data.startswith("INQUIRE"):
-                    transaction_id = data.split()[1]
-                    handle_inquiry(transaction_id, conn)
-                # Handle other types of messages...
+    """ Serve every participant connection from one event loop. """
+    serve(tc_address, handle_node_message)
 
 
 
 def recover_transactions():
-    """ Recover transactions from files and complete any unfinished commitments. """
-    for filename in os.listdir('.'):
-        if filename.startswith('transaction_') and filename.endswith('.txt'):
-            with open(filename, 'r') as file:
-                data = file.read()
-
-            transaction_id, nodes_data = data.split(',')
-            nodes_commit_status = {}
-            for node_data in nodes_data.split('|'):
-                node_address, status = node_data.rsplit(':', 1)  # Split from the right at the last colon
-                nodes_commit_status[node_address] = status
-
-            pending_nodes = {node: status for node, status in nodes_commit_status.items() if status == 'pending'}
-
-            if pending_nodes:
-                send_commit_messages(transaction_id, pending_nodes)
-
-
-
-
-
-
-def listen_for_responses():
-    global state
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.bind(('localhost', 1025))
-        s.listen()
-
-        responses_received = 0
-        expected_responses = len(participant_nodes)
-        start_time = time.time()  # Record the start time
-
-        while responses_received < expected_responses and time.time() - start_time < 60:  # 30-second timeout
-            try:
-                s.settimeout(60 - (time.time() - start_time))  # Adjust the timeout as time elapses
-                conn, addr = s.accept()
-                with conn:
-                    data = conn.recv(1024).decode()
-                    transaction_id, responding_port, response = data.split()
-                    if transaction_id == state['transaction_id']:
-                        responding_node = f'localhost:{responding_port}'
-                        if responding_node in participant_nodes:
-                            state['responses'][responding_node] = response
-                            responses_received += 1
-                            print(f"Received response: {response} from {responding_node}")
-                            if response == 'NO':  # Abort immediately if any node responds with 'NO'
-                                print("At least one participant voted to abort. Aborting transaction.")
-                                return
-            except socket.timeout:
-                # Timeout occurred before receiving all responses
-                print("Response timeout. Aborting transaction.")
-                return
-
-        # Check if all responses are 'YES'
-        if all(response == 'YES' for response in state['responses'].values()):
-            nodes_commit_status = {node: 'pending' for node in participant_nodes}
-            write_transaction_to_file(state['transaction_id'], nodes_commit_status)
-            print("All participants agreed to commit. Writing to file and committing transaction.")
-            send_commit_messages(state['transaction_id'], nodes_commit_status)
-        else:
-            print("At least one participant voted to abort or did not respond. Aborting transaction.")
-
-
-def listen_for_node_requests():
-    """ Continuously listen for and handle requests from participant nodes. """
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.bind(('localhost', 1025))
-        s.listen()
-
-        while True:
-            conn, addr = s.accept()
-            with conn:
-                data = conn.recv(1024).decode()
-                if data.startswith("INQUIRE"):
-                    transaction_id = data.split()[1]
-                    handle_inquiry(transaction_id, conn)
-                elif data.startswith("PREPARE"):
-                    # Add logic to handle 'PREPARE' requests
-                    pass
-                # Add other request types as necessary
+    """ Queue every logged decision that some node has not acknowledged for redelivery in the background. """
+    # Presumed commit: transactions cut off while collecting votes are aborted
+    collecting = {transaction_id: nodes for transaction_id, nodes in decision_log.collecting_transactions().items()
+                  if transaction_id not in transactions}
+    decision_log.log_aborts(collecting)
+    if protocol == '3pc':
+        with unreconciled_lock:
+            unreconciled.clear()
+            for transaction_id, nodes_status in decision_log.pending_transactions().items():
+                if transaction_id not in transactions:
+                    # A node that acknowledged the COMMIT has committed it
+                    unreconciled[transaction_id] = {node: 'C' for node, status in nodes_status.items()
+                                                    if status == 'done'}
+        reconcile_commits(redeliver=False)
+    for verb, pending in (('COMMIT', decision_log.pending_transactions()), ('ABORT', decision_log.pending_aborts())):
+        node_transactions = {}
+        for transaction_id, nodes_status in pending.items():
+            if transaction_id in transactions or transaction_id in unreconciled:
+                continue  # Still in its own second phase, or not known to be committed yet
+            for node, status in nodes_status.items():
+                if status == 'pending':
+                    node_transactions.setdefault(node, []).append(transaction_id)
+        for node, transaction_ids in node_transactions.items():
+            log.info("Redelivering %s of %d transactions to %s", verb, len(transaction_ids), node)
+            retries.add(node, verb, transaction_ids)
+
+
+def reconcile_commits(redeliver=True):
+    """ Three-phase commit: settle the unreconciled commits by asking their participants for their state.
+
+    A commit that any participant aborted while the TC was down becomes an
+    abort. One is kept once a participant has committed it, or once every
+    participant has reported that it did not abort it; a participant that
+    does not answer decides nothing. Whatever is still unsettled is asked
+    about again after node_timeout. With redeliver, the commits kept are
+    queued for delivery to the participants that have not acknowledged them.
+    """
+    if replica is not None and not replica.leading:
+        return  # The new leader reconciles its own log
+    pending = decision_log.pending_transactions()
+    node_transactions = {}
+    with unreconciled_lock:
+        for transaction_id, states in unreconciled.items():
+            for node in pending.get(transaction_id, {}):
+                if node not in states:
+                    node_transactions.setdefault(node, []).append(transaction_id)
+    replies = pool.request_all({node: ("RECONCILE", *transaction_ids)
+                                for node, transaction_ids in node_transactions.items()}, node_timeout)
+    aborted, committed = [], []
+    with unreconciled_lock:
+        for node, reply in replies.items():
+            if reply is not None:
+                _, args = reply
+                for transaction_id, state in zip(node_transactions[node], args[0]):
+                    unreconciled[transaction_id][node] = state
+            else:
+                log.warning("%s did not report its state of %d unfinished commits", node, len(node_transactions[node]))
+        for transaction_id, states in list(unreconciled.items()):
+            if 'A' in states.values():
+                aborted.append(transaction_id)
+            elif 'C' in states.values() or len(states) == len(pending.get(transaction_id, states)):
+                committed.append(transaction_id)
+            else:
+                continue
+            del unreconciled[transaction_id]
+    if aborted:
+        log.warning("Participants aborted %d logged commits while the TC was down", len(aborted))
+        try:
+            decision_log.log_aborts({transaction_id: [] for transaction_id in aborted})
+        except NotLeader:
+            return
+        for transaction_id in aborted:
+            decision_cache.record(transaction_id, 'ABORT')
+    if redeliver:
+        node_commits = {}
+        for transaction_id in committed:
+            for node, status in pending.get(transaction_id, {}).items():
+                if status == 'pending':
+                    node_commits.setdefault(node, []).append(transaction_id)
+        for node, transaction_ids in node_commits.items():
+            retries.add(node, 'COMMIT', transaction_ids)
+    if unreconciled:
+        log.warning("%d logged commits stay undecided until every participant reports its state", len(unreconciled))
+        timers.schedule(node_timeout, reconcile_later)
+
+
+def reconcile_later():
+    # Runs on the timer wheel's thread, which must not block
+    workers.submit(reconcile_commits)
+
+
+# Long-lived connections to the participant nodes, shared by every transaction
+pool = ChannelPool(connect_timeout=node_timeout)
+
+
+def start():
+    """ Open the decision log and start listening for participant nodes. Returns the listener thread.
+
+    In a replicated group this replica starts as a follower, and take_over()
+    does the rest once it is elected leader.
+    """
+    global decision_log, decision_cache, replica
+    decision_log = DecisionLog(log_directory)
+    if len(coordinator_group) > 1:
+        address = f"{tc_address[0]}:{tc_address[1]}"
+        replica = Replica(address, [peer for peer in coordinator_group if peer != address], decision_log,
+                          log_directory, on_leader=take_over, on_follower=step_down)
+        decision_log.replica = replica
+    else:
+        decision_cache = DecisionCache(decision_log, presumed=presumed_outcome(presumption))
+        recover_transactions()
+    listener_thread = threading.Thread(target=listen_for_requests, daemon=True)
+    listener_thread.start()
+    if replica is not None:
+        replica.start()
+    return listener_thread
+
+
+def take_over():
+    """ Called once this replica leads the group, before it serves: finish the decisions it inherited.
+
+    Raises NotLeader if the leadership is lost meanwhile.
+    """
+    global decision_cache
+    decision_cache = DecisionCache(decision_log, presumed=presumed_outcome(presumption))
+    recover_transactions()
+    log.warning("This coordinator now leads the group (term %d)", replica.term)
+
+
+def step_down():
+    """ Called when this replica stops leading: leave redelivery and reconciliation to the new leader. """
+    retries.clear()
+    with unreconciled_lock:
+        unreconciled.clear()
+    log.warning("This coordinator no longer leads the group; the leader is %s", replica.leader or 'unknown')
 
 
 def main():
+    global participant_nodes, tc_address, presumption, protocol, batch_window, batch_size, coordinator_group
+    global log_directory, crash_after, routing, shard
+    parser = argparse.ArgumentParser(description="Two-phase commit transaction coordinator.")
+    parser.add_argument('--config', default=cluster.default_config, help="cluster file with the node addresses")
+    parser.add_argument('--batch-window', type=float, default=batch_window,
+                        help="seconds to collect transactions into one batched round (0 disables batching)")
+    parser.add_argument('--batch-size', type=int, default=batch_size, help="most transactions in one batched round")
+    parser.add_argument('--metrics-port', type=int, help="serve Prometheus metrics on this local port")
+    parser.add_argument('--log-level', default='info', choices=logs.levels, help="least severe log messages to show")
+    parser.add_argument('--shard', type=int, default=0, help="which of the cluster file's shards this TC serves")
+    parser.add_argument('--replica', type=int, default=0,
+                        help="which of the shard's coordinators this one is (replicated groups)")
+    parser.add_argument('--log-dir', help="directory of the decision log (default: tc_log, or tc_log_shardN)")
+    parser.add_argument('--serve', action='store_true',
+                        help="only serve participants and BEGIN requests, without the interactive console")
+    parser.add_argument('--crash-after', type=int,
+                        help="testing: exit abruptly halfway through sending this many-th COMMIT round")
+    options = parser.parse_args()
+    logs.setup(options.log_level)
+    if options.metrics_port:
+        metrics.serve(options.metrics_port)
+    _, participants = cluster.load(options.config)
+    routing, shard = cluster.routing(options.config), options.shard
+    coordinator_group = routing.coordinators(shard)
+    if len(routing) == 1:
+        routing = None  # Every transaction is this TC's
+    tc_address = cluster.parse_address(coordinator_group[options.replica])
+    participant_nodes = list(participants.values())
+    presumption, protocol = cluster.presumption(options.config), cluster.protocol(options.config)
+    batch_window, batch_size = options.batch_window, options.batch_size
+    log_directory = options.log_dir or (f"{log_directory}_shard{shard}" if routing else log_directory)
+    crash_after = options.crash_after
+    listener_thread = start()
+    if options.serve:
+        listener_thread.join()
+        return
+
     while True:
         # Choose the mode of operation for the TC
         mode = input("Select mode - 'normal' for transactions, 'recovery' for node requests, 'exit' to stop: ").lower()
 
         if mode == 'normal':
-            # Normal mode: Handle transactions
-              # Recover any incomplete transactions
+            # Normal mode: Handle transactions. Each one runs in the background, so several
+            # transactions can be in flight while the next ID is being typed.
             while True:
-                recover_transactions() ##Recovering TC transactions
-                transaction_id = input("Enter transaction ID to initiate (or 'exit' to stop): ")
+                transaction_id, *nodes = input("Enter transaction ID to initiate, optionally followed by the "
+                                               "participants it involves (or 'exit' to stop): ").split() or ['']
                 if transaction_id.lower() == 'exit':
                     break
                 simulate_failure = input("Simulate TC failure? (yes/no): ").lower() == 'yes'
-                prepare_thread = threading.Thread(target=send_prepare_message, args=(transaction_id, simulate_failure))
-                response_thread = threading.Thread(target=listen_for_responses)
-
-                prepare_thread.start()
-                response_thread.start()
-
-                prepare_thread.join()  # Wait for prepare phase to complete
-                state['prepare_sent'] = False  # Signal response thread to stop
-                response_thread.join()  # Wait for response thread to complete
-
-                print("Transaction state after prepare phase:", state)
+                try:
+                    begin(transaction_id, simulate_failure, nodes)
+                except (ValueError, NotLeader) as e:
+                    print(e)
+                    continue
+                print("Transactions in flight:", list(transactions.values()))
 
         elif mode == 'recovery':
-            # Recovery mode: Listen for node requests
+            # Recovery mode: inquiries are answered by the listener, which runs in every mode
             print("Starting in recovery mode. Listening for node requests...")
-            node_listener_thread = threading.Thread(target=listen_for_node_requests)
-            node_listener_thread.start()
-            node_listener_thread.join()
+            listener_thread.join()
 
         elif mode == 'exit':
             print("Exiting TC.")
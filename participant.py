@@ -0,0 +1,548 @@
+import argparse
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from channel import ChannelPool
+from protocol import batch_verb
+from server import serve
+from prepared_log import PreparedLog
+from timer_wheel import TimerWheel, ExpiringSet
+from commit_rules import termination_outcome
+import cluster
+import logs
+import metrics
+import vote_policy
+
+# A participant node. Every participant runs this module; main() takes the node's
+# identity from the command line and its addresses from the cluster file, e.g.
+#   python participant.py --node-id node4 --config cluster.json --data-dir data
+#
+# Termination: a transaction still in doubt termination_timeout seconds after its
+# YES vote is asked about, first at the TC and, when the TC cannot be reached, at
+# the other participants named in its PREPARE (cooperative termination). A peer
+# that committed or aborted settles it. Under three-phase commit the in-doubt
+# peers also settle it among themselves: the one with the lowest address commits
+# it (precommitting the others first) if any of them is precommitted, and aborts
+# it otherwise. This is non-blocking as long as nodes fail by crashing and the
+# network does not partition. The abort rule stands in for a TC that is down: it
+# is not used while the TC answers, even if the TC does not know the outcome yet,
+# nor for a transaction this node has reported in doubt to a restarted TC that is
+# reconciling its commits (RECONCILE), which may keep the commit on that report.
+#
+# With a replicated coordinator group, inquiries go to whichever coordinator is
+# leading: one that is not answers NOT_LEADER with the leader's address, and an
+# unreachable one is skipped for the next in the cluster file. With sharded
+# coordinators, each transaction is asked about at the shard that owns it.
+#
+# Every message is handled by its own task on one event loop, and the prepares
+# and commits await their log writes there instead of holding a thread, so a
+# PREPARE is voted on while earlier transactions wait for their fsync, and the
+# prepared log's writer forces all of them together. A transaction with this
+# node as its only participant arrives as ONE_PHASE: the vote is the outcome, and
+# a YES is committed at once without ever being in doubt.
+
+# Configuration
+tc_address = 'localhost', 1025  # Transaction Coordinator's address
+routing = None  # Which coordinators own which transaction IDs (see sharding.py); main() takes it from the cluster file
+leaders = {}  # Shard -> (host, port) of the coordinator that last answered for it
+node_id = 'node2'  # This participant's ID in the cluster file
+participant_address = 'localhost', 1026  # This participant's address
+prepare_timeout = 60  # Timeout in seconds for the "prepare" message
+recovery_batch_size = 1000  # In-doubt transaction IDs per INQUIRE_BATCH during recovery
+recovery_concurrency = 4  # INQUIRE_BATCH requests outstanding at once during recovery
+recovery_retry = 5  # Seconds between recovery attempts while the TC is unreachable
+log_directory = 'node2_log'  # Prepared/committed transaction log, <data dir>/<node ID>_log
+committed_file = 'node2committed.txt'  # History of committed transaction IDs, <data dir>/<node ID>committed.txt
+commit_delay = 0  # Seconds to sleep before applying a COMMIT, to simulate a node failing mid-commit
+presumption = 'abort'  # Protocol variant, 'abort' or 'commit'; main() takes it from the cluster file
+protocol = '2pc'  # Commit protocol, '2pc' or '3pc'; main() takes it from the cluster file
+termination_timeout = 10  # Seconds a prepared transaction waits for its outcome before the node asks for it
+peer_timeout = 5  # Seconds to wait for the other participants' answers during termination
+
+# Durable store of prepared transactions, opened by main()
+prepared_log = None
+
+# Decides each vote; see vote_policy.py. Set from the command line by main().
+vote = vote_policy.console
+
+# Transactions to vote NO on: they timed out waiting for PREPARE or were aborted before it arrived.
+# Transactions this node voted NO on are added too. Remembered for an hour
+timed_out_transactions = ExpiringSet(ttl=3600)
+# Transactions whose PREPARE has arrived and whose vote is not cast yet
+voting = set()
+# Makes casting a vote atomic with a peer aborting a transaction this node has not voted on
+vote_lock = threading.Lock()
+
+# Three-phase commit: in-doubt transactions this node reported to a reconciling TC, which it no longer aborts
+# by the termination protocol's rule, and those it has decided to abort by that rule, reported as aborted
+# from then on. Both remembered for an hour
+reported_to_coordinator = ExpiringSet(ttl=3600)
+rule_aborts = ExpiringSet(ttl=3600)
+# Makes reporting to the TC atomic with deciding an abort by the rule
+termination_lock = threading.Lock()
+
+# One thread drives every prepare timeout; pending ones are cancelled when the PREPARE arrives
+timers = TimerWheel()
+prepare_timers = {}
+
+log = logging.getLogger('participant')
+
+# Metrics, served on --metrics-port
+votes = metrics.counter('tpc_votes_total', "Votes sent to the TC, by vote", labels=('vote',))
+outcomes = metrics.counter('tpc_outcomes_total', "Prepared transactions resolved, by outcome", labels=('outcome',))
+prepare_timeouts = metrics.counter('tpc_prepare_timeouts_total', "Transactions that timed out waiting for PREPARE")
+in_doubt_transactions = metrics.gauge('tpc_in_doubt_transactions', "Prepared transactions whose outcome is not known",
+                                      lambda: len(prepared_log.prepared) if prepared_log else 0)
+recovery_backlog = metrics.gauge('tpc_recovery_backlog', "In-doubt transactions found at startup and not yet resolved")
+terminations = metrics.counter('tpc_terminations_total', "In-doubt transactions settled by their peers, by outcome",
+                               labels=('outcome',))
+
+def transaction_timeout(transaction_id):
+    """ Function to be called when the transaction times out """
+    prepare_timers.pop(transaction_id, None)
+    timed_out_transactions.add(transaction_id)
+    prepare_timeouts.inc()
+    log.info("Transaction %s timed out waiting for 'prepare' message.", transaction_id)
+
+def start_transaction_timeout(duration, transaction_id):
+    """ Start a timer for the transaction """
+    prepare_timers[transaction_id] = timers.schedule(duration, transaction_timeout, transaction_id)
+
+def cancel_transaction_timeout(transaction_id):
+    """ Stop the prepare timer of a transaction whose PREPARE has arrived. """
+    timer = prepare_timers.pop(transaction_id, None)
+    if timer is not None:
+        timer.cancel()
+
+
+def handle_start_transaction(transaction_id):
+    """ Handle the start of a new transaction. """
+    start_transaction_timeout(30,transaction_id)
+
+async def handle_tc_message(connection, request_id, verb, args):
+    """ Handles one message from the Transaction Coordinator without blocking the event loop. """
+    loop = asyncio.get_running_loop()
+    log.debug("Received message from TC: %s %s", verb, ' '.join(args))
+
+    if verb == "PREPARE":
+        transaction_id, peers = args[0], args[1:]
+        await handle_prepare(transaction_id, connection, request_id, peers)
+    elif verb == "ONE_PHASE":
+        await handle_one_phase(args[0], connection, request_id)
+    elif verb == "COMMIT":
+        transaction_id = args[0]
+        if commit_delay:
+            log.warning("Simulating Node sleep You can stop Node if you want to trigger to stop message to rest of the nodes")
+            await asyncio.sleep(commit_delay)
+        await handle_commit(args)
+        if request_id:
+            connection.reply(request_id, "ACK")
+        log.info("Transaction %s committed.", transaction_id)
+    elif verb == "PREPARE_BATCH":
+        peers = [peer for peer in args[0].split(',') if peer]
+        await handle_prepare_batch(args[1:], connection, request_id, peers)
+    elif verb == "COMMIT_BATCH":
+        await handle_commit(args)
+        if request_id:
+            connection.reply(request_id, "ACK")
+        log.info("Committed a batch of %d transactions.", len(args))
+    elif verb in ("ABORT", "ABORT_BATCH"):
+        await handle_abort(args, connection, request_id)
+    elif verb in ("PRECOMMIT", "PRECOMMIT_BATCH"):
+        precommitted = await loop.run_in_executor(None, prepared_log.precommit_many, args)
+        if request_id:
+            connection.reply(request_id, "ACK")
+        log.info("Precommitted %d transactions.", len(precommitted))
+    elif verb == "PEER_INQUIRE":
+        states = await loop.run_in_executor(None, peer_states, args)
+        connection.reply(request_id, "STATES", ''.join(states))
+    elif verb == "RECONCILE":
+        states = await loop.run_in_executor(None, reconcile_states, args)
+        connection.reply(request_id, "STATES", ''.join(states))
+    if verb == "START":
+        transaction_id = args[0]
+        handle_start_transaction(transaction_id)
+
+def listen_to_tc():
+    """ Serves the Transaction Coordinator's connections from one event loop. """
+    serve(participant_address, handle_tc_message)
+
+
+async def handle_commit(transaction_ids):
+    """ Commit the prepared transactions among transaction_ids. Forced only under presumed abort.
+
+    A COMMIT sent as a request is acknowledged afterwards, also for transactions
+    that were already committed, so redelivered decisions are acknowledged too.
+    """
+    if presumption == 'abort':
+        committed, _ = await prepared_log.resolve_async(transaction_ids, [])
+    else:
+        committed, _ = prepared_log.resolve(transaction_ids, [], sync=False)
+    outcomes.labels('COMMIT').inc(len(committed))
+
+async def handle_abort(transaction_ids, connection, request_id):
+    """ Abort the prepared transactions among transaction_ids, and make sure the others are voted NO.
+
+    An ABORT sent as a request (presumed commit) is acknowledged once the abort is durable.
+    """
+    aborted = []
+    for transaction_id in transaction_ids:
+        if prepared_log.is_prepared(transaction_id):
+            aborted.append(transaction_id)
+        else:
+            timed_out_transactions.add(transaction_id)
+    if request_id:
+        await asyncio.get_running_loop().run_in_executor(None, prepared_log.abort_many, aborted, True)
+        connection.reply(request_id, "ACK")
+    else:
+        prepared_log.abort_many(aborted)
+    outcomes.labels('ABORT').inc(len(aborted))
+
+def decide_vote(transaction_id):
+    """ Ask the vote policy about one transaction: 'YES', 'NO' or 'READ_ONLY'. Votes NO if it has already timed out. """
+    cancel_transaction_timeout(transaction_id)
+    with vote_lock:
+        voting.add(transaction_id)
+    decision = vote(transaction_id)
+    with vote_lock:
+        voting.discard(transaction_id)
+        # Check if the transaction has timed out
+        if transaction_id in timed_out_transactions:
+            log.info("Transaction %s already timed out or aborted. Responding 'no'.", transaction_id)
+            return 'NO'
+        if decision not in ('YES', 'READ_ONLY'):
+            timed_out_transactions.add(transaction_id)  # Lets this node tell its peers it was aborted
+            return 'NO'
+        return decision
+
+async def ask_vote(transaction_id):
+    """ decide_vote() off the event loop. Votes are evaluated concurrently, one worker per transaction, unless the
+    policy is serial.
+    """
+    executor = console if getattr(vote, 'serial', False) else None
+    return await asyncio.get_running_loop().run_in_executor(executor, decide_vote, transaction_id)
+
+async def handle_prepare(transaction_id, connection, request_id, peers=()):
+    """ Handles the "prepare" message from the TC by asking the vote policy. """
+    decision = await ask_vote(transaction_id)
+    log.debug("Node preparing for transaction %s...", transaction_id)
+
+    if decision == 'YES':
+        await write_aborted_commit(transaction_id, peers)
+        log.info("Transaction %s prepared successfully.", transaction_id)
+        send_response_to_tc(connection, request_id, transaction_id, 'YES')
+    elif decision == 'READ_ONLY':
+        # Nothing to commit here: no prepared record, and no part in the second phase
+        log.info("Transaction %s is read-only on this node.", transaction_id)
+        send_response_to_tc(connection, request_id, transaction_id, 'READ_ONLY')
+    else:
+        log.info("Transaction %s aborted.", transaction_id)
+        send_response_to_tc(connection, request_id, transaction_id, 'NO')
+
+async def handle_prepare_batch(transaction_ids, connection, request_id, peers=()):
+    """ Votes on a batch concurrently, prepares the YES ones with one durable write and replies with the vote vector. """
+    decisions = await asyncio.gather(*(ask_vote(transaction_id) for transaction_id in transaction_ids))
+    prepared = [transaction_id for transaction_id, decision in zip(transaction_ids, decisions) if decision == 'YES']
+    await prepared_log.prepare_async(prepared, peers)
+    if prepared:
+        timers.schedule(termination_timeout, in_doubt_timed_out, prepared)
+    for decision in ('YES', 'NO', 'READ_ONLY'):
+        votes.labels(decision).inc(decisions.count(decision))
+    log.info("Prepared %d of a batch of %d transactions.", len(prepared), len(transaction_ids))
+    connection.reply(request_id, "VOTES", ''.join(vote_letters[decision] for decision in decisions))
+
+vote_letters = {'YES': 'Y', 'NO': 'N', 'READ_ONLY': 'R'}  # A batch's votes, one letter per transaction
+
+async def write_aborted_commit(transaction_id, peers=()):
+    """ Durably record the transaction as prepared (in doubt) before voting YES. """
+    await prepared_log.prepare_async([transaction_id], peers)
+    timers.schedule(termination_timeout, in_doubt_timed_out, [transaction_id])
+
+async def handle_one_phase(transaction_id, connection, request_id):
+    """ One-phase commit: this node is the transaction's only participant, so its vote decides the outcome.
+
+    Replies COMMIT once a YES is durably committed (or at once for READ_ONLY), and ABORT for a NO.
+    """
+    decision = await ask_vote(transaction_id)
+    votes.labels(decision).inc()
+    outcome = 'ABORT' if decision == 'NO' else 'COMMIT'
+    if decision == 'YES' and not await prepared_log.commit_one_phase(transaction_id):
+        log.warning("Transaction %s was already prepared or resolved here; not committing it again.", transaction_id)
+        outcome = 'COMMIT' if prepared_log.state(transaction_id) == 'C' else 'ABORT'
+    log.info("Transaction %s %s in one phase.", transaction_id, 'committed' if outcome == 'COMMIT' else 'aborted')
+    connection.reply(request_id, outcome, transaction_id)
+
+def inquire_transaction_status(transaction_ids, shard=0):
+    """ Ask a shard's TC about many of its transactions in one request.
+
+    Returns {transaction_id: outcome}, leaving out the transactions whose outcome the TC does not know ('?').
+    """
+    verb, args = request_coordinator(shard, "INQUIRE_BATCH", *transaction_ids)
+    if verb != "OUTCOMES":
+        raise ConnectionError(f"The TC answered {verb} {' '.join(args)} instead of the outcomes")
+    return {transaction_id: 'COMMIT' if outcome == 'C' else 'ABORT'
+            for transaction_id, outcome in zip(transaction_ids, args[0]) if outcome != '?'}
+
+def request_coordinator(shard, verb, *args):
+    """ Send a request to a shard's TC, following a replicated group to its leader. Returns the reply (verb, args).
+
+    Raises ConnectionError when no coordinator of the shard can answer.
+    """
+    group = [cluster.parse_address(address) for address in routing.coordinators(shard)] if routing else [tc_address]
+    leader = leaders.get(shard, group[0])
+    candidates = [leader] + [address for address in group if address != leader]
+    tried = set()
+    while candidates:
+        address = candidates.pop(0)
+        if address in tried:
+            continue
+        tried.add(address)
+        try:
+            reply_verb, reply_args = pool.get(address).request(verb, *args).result(timeout=prepare_timeout)
+        except (ConnectionError, TimeoutError) as e:
+            log.debug("Coordinator %s:%d did not answer: %s", *address, e)
+            continue
+        if reply_verb != "NOT_LEADER":
+            leaders[shard] = address
+            return reply_verb, reply_args
+        if reply_args and reply_args[0]:
+            candidates.insert(0, cluster.parse_address(reply_args[0]))
+    raise ConnectionError(f"No coordinator answered {verb}")
+
+def check_aborted_transactions():
+    """ Resolve the in-doubt transactions found at startup, retrying while neither the TC nor the peers can. """
+    in_doubt = prepared_log.in_doubt()
+    while in_doubt:
+        recovery_backlog.set(len(in_doubt))
+        log.info("Recovering %d in-doubt transactions.", len(in_doubt))
+        in_doubt = resolve_in_doubt(in_doubt)
+        if in_doubt:
+            time.sleep(recovery_retry)
+    recovery_backlog.set(0)
+
+def resolve_in_doubt(in_doubt):
+    """ Ask the TC, then the peers, about in-doubt transactions and apply the outcomes. Returns those still in doubt.
+
+    IDs go to the TC in batches of recovery_batch_size with at most
+    recovery_concurrency requests outstanding, and each round of outcomes is
+    applied with one durable write.
+    """
+    batches = [in_doubt[i:i + recovery_batch_size] for i in range(0, len(in_doubt), recovery_batch_size)]
+    answers = {}
+    with ThreadPoolExecutor(max_workers=recovery_concurrency) as executor:
+        for result in executor.map(inquire_safely, batches):
+            answers.update(result)
+    undecided = {transaction_id for transaction_id, outcome in answers.items() if outcome is None}
+    unanswered = [transaction_id for transaction_id in in_doubt if answers.get(transaction_id) is None]
+    if unanswered:
+        answers.update(terminate(unanswered, undecided))
+    committed = [transaction_id for transaction_id, outcome in answers.items() if outcome == 'COMMIT']
+    aborted = [transaction_id for transaction_id, outcome in answers.items() if outcome == 'ABORT']
+    committed, aborted = prepared_log.resolve(committed, aborted)
+    outcomes.labels('COMMIT').inc(len(committed))
+    outcomes.labels('ABORT').inc(len(aborted))
+    log.info("Applied %d commits and %d aborts to in-doubt transactions.", len(committed), len(aborted))
+    return [transaction_id for transaction_id in in_doubt
+            if answers.get(transaction_id) is None and prepared_log.is_prepared(transaction_id)]
+
+def in_doubt_timed_out(transaction_ids):
+    """ Called termination_timeout seconds after a YES vote (or recovery_retry after a blocked attempt). """
+    # Runs on the timer wheel's thread, which must not block
+    terminator.submit(settle, transaction_ids)
+
+def settle(transaction_ids):
+    """ Resolve the listed transactions that are still in doubt, and try again later for any that stay blocked. """
+    in_doubt = [transaction_id for transaction_id in transaction_ids if prepared_log.is_prepared(transaction_id)]
+    if not in_doubt:
+        return
+    log.info("%d transactions still in doubt after %ss; asking for their outcome.", len(in_doubt), termination_timeout)
+    blocked = resolve_in_doubt(in_doubt)
+    if blocked:
+        log.warning("%d transactions are blocked until the TC or a peer knows their outcome.", len(blocked))
+        timers.schedule(recovery_retry, in_doubt_timed_out, blocked)
+
+def peer_states(transaction_ids):
+    """ This node's state of each transaction, as STATES letters, for a peer running the termination protocol.
+
+    A transaction this node has started or received the PREPARE of, but not
+    voted on yet, is aborted here on the spot, so it can only vote NO on it.
+    Any other transaction this node knows nothing of is answered '?': it may
+    have voted READ_ONLY on it, which leaves no record.
+    """
+    states = [prepared_log.state(transaction_id) for transaction_id in transaction_ids]
+    states = ['A' if state == 'U' and transaction_id in rule_aborts else state
+              for transaction_id, state in zip(transaction_ids, states)]
+    # The index only remembers recent outcomes; a commit it has forgotten is still in the history
+    forgotten = [transaction_id for transaction_id, state in zip(transaction_ids, states) if state is None]
+    committed = prepared_log.committed_among(forgotten) if forgotten else set()
+    for index, transaction_id in enumerate(transaction_ids):
+        if states[index] is not None:
+            continue
+        if transaction_id in committed:
+            states[index] = 'C'
+            continue
+        with vote_lock:
+            if transaction_id in prepare_timers or transaction_id in voting:
+                cancel_transaction_timeout(transaction_id)
+                timed_out_transactions.add(transaction_id)
+            if transaction_id in timed_out_transactions:
+                states[index] = 'A'
+        states[index] = states[index] or '?'
+    return states
+
+def reconcile_states(transaction_ids):
+    """ peer_states() for a restarted three-phase commit TC, which may keep a commit on these states.
+
+    Every transaction reported in doubt is left to the TC from then on: this node never aborts it by the rule.
+    """
+    with termination_lock:
+        states = peer_states(transaction_ids)
+        for transaction_id, state in zip(transaction_ids, states):
+            if state in ('U', 'P'):
+                reported_to_coordinator.add(transaction_id)
+    return states
+
+def terminate(transaction_ids, undecided=()):
+    """ Cooperative termination: settle in-doubt transactions from the other participants' states.
+
+    undecided lists the transactions whose TC answered but does not know the
+    outcome yet; only a peer that committed or aborted settles those.
+    Returns {transaction_id: 'COMMIT' | 'ABORT'} for the ones it could settle.
+    """
+    peers = {transaction_id: [peer for peer in transaction_peers if cluster.parse_address(peer) != participant_address]
+             for transaction_id, transaction_peers in prepared_log.peers(transaction_ids).items()}
+    node_transactions = {}
+    for transaction_id, transaction_peers in peers.items():
+        for peer in transaction_peers:
+            node_transactions.setdefault(peer, []).append(transaction_id)
+    replies = pool.request_all({node: ("PEER_INQUIRE", *peer_transaction_ids)
+                                for node, peer_transaction_ids in node_transactions.items()}, peer_timeout)
+    states = {transaction_id: {} for transaction_id in peers}  # transaction_id -> {peer: STATES letter}
+    for node, reply in replies.items():
+        if reply is not None:
+            _, args = reply
+            for transaction_id, state in zip(node_transactions[node], args[0]):
+                states[transaction_id][node] = state
+        else:
+            log.info("Peer %s did not answer during termination", node)
+
+    answers = {}
+    precommits = {}  # node -> transaction IDs to precommit before committing them (three-phase commit)
+    notices = {}  # node -> {outcome: transaction IDs} for the in-doubt peers this node terminates for
+    for transaction_id, peer_states in states.items():
+        known = set(peer_states.values())
+        outcome = termination_outcome(known)
+        if outcome is not None:
+            answers[transaction_id] = outcome
+        elif protocol == '3pc' and transaction_id not in undecided:
+            in_doubt = [node for node, state in peer_states.items() if state in ('U', 'P')]
+            if min([participant_address] + [cluster.parse_address(node) for node in in_doubt]) != participant_address:
+                continue  # A peer with a lower address terminates it
+            if 'P' in known or prepared_log.state(transaction_id) == 'P':
+                answers[transaction_id] = 'COMMIT'
+                for node in in_doubt:
+                    if peer_states[node] == 'U':
+                        precommits.setdefault(node, []).append(transaction_id)
+                precommits.setdefault(None, []).append(transaction_id)
+            else:
+                with termination_lock:
+                    if transaction_id in reported_to_coordinator:
+                        continue  # The TC may keep the commit on this node's report
+                    rule_aborts.add(transaction_id)
+                answers[transaction_id] = 'ABORT'
+            for node in in_doubt:
+                notices.setdefault(node, {}).setdefault(answers[transaction_id], []).append(transaction_id)
+    if precommits:
+        prepared_log.precommit_many(precommits.pop(None))
+        pool.request_all({node: (batch_verb("PRECOMMIT", precommitted), *precommitted)
+                          for node, precommitted in precommits.items()}, peer_timeout)
+
+    def notify(node, channel):
+        for outcome, notified in notices[node].items():
+            channel.send(batch_verb(outcome, notified), *notified)
+
+    pool.fan_out(list(notices), notify, peer_timeout)
+    for outcome in ('COMMIT', 'ABORT'):
+        terminations.labels(outcome).inc(sum(answer == outcome for answer in answers.values()))
+    if answers:
+        log.info("Termination protocol settled %d of %d in-doubt transactions.", len(answers), len(transaction_ids))
+    return answers
+
+def inquire_safely(transaction_ids):
+    """ inquire_transaction_status() at each transaction's shard, leaving out the shards whose TC is unreachable.
+
+    A transaction whose TC answered without knowing its outcome maps to None.
+    """
+    groups = routing.group(transaction_ids) if routing else {0: transaction_ids}
+    answers = {}
+    for shard, shard_transaction_ids in groups.items():
+        try:
+            outcomes = inquire_transaction_status(shard_transaction_ids, shard)
+        except (ConnectionError, TimeoutError) as e:
+            log.warning("Failed to connect to TC: %s", e)
+            continue
+        answers.update(dict.fromkeys(shard_transaction_ids))
+        answers.update(outcomes)
+    return answers
+
+def send_response_to_tc(connection, request_id, transaction_id, response):
+    """ Sends the vote back to the Transaction Coordinator as the reply to its PREPARE request. """
+    try:
+        connection.reply(request_id, response)
+        votes.labels(response).inc()
+        log.debug("Sent %s to TC for transaction %s", response, transaction_id)
+    except ConnectionError as e:
+        log.warning("Failed to send response to TC: %s", e)
+
+# Long-lived connections to the TC for inquiries, and to the peers for termination
+pool = ChannelPool(connect_timeout=peer_timeout)
+
+# Serial vote policies (the console) are asked one at a time, off the event loop
+console = ThreadPoolExecutor(max_workers=1)
+
+# Runs the termination of transactions left in doubt, one attempt at a time
+terminator = ThreadPoolExecutor(max_workers=1)
+
+
+def main(argv=None):
+    global tc_address, node_id, participant_address, log_directory, committed_file, commit_delay, presumption, protocol
+    global prepared_log, vote, routing
+    parser = argparse.ArgumentParser(description="Two-phase commit participant node.")
+    parser.add_argument('--node-id', default=node_id, help="this node's ID in the cluster file")
+    parser.add_argument('--config', default=cluster.default_config, help="cluster file with the node addresses")
+    parser.add_argument('--address', help="host:port to listen on (default: this node's entry in the cluster file)")
+    parser.add_argument('--data-dir', default='.', help="directory for this node's prepared log and committed history")
+    parser.add_argument('--commit-delay', type=float, default=commit_delay,
+                        help="seconds to sleep before applying each COMMIT, to simulate a node failure")
+    parser.add_argument('--vote', default='console',
+                        help="vote policy: console, auto, random:P[:DELAY[:SEED]], limit:N, readonly[:P[:SEED]] "
+                             "or module:callable")
+    parser.add_argument('--metrics-port', type=int, help="serve Prometheus metrics on this local port")
+    parser.add_argument('--log-level', default='info', choices=logs.levels, help="least severe log messages to show")
+    options = parser.parse_args(argv)
+    logs.setup(options.log_level)
+    if options.metrics_port:
+        metrics.serve(options.metrics_port)
+    node_id, commit_delay = options.node_id, options.commit_delay
+    tc_address, participants = cluster.load(options.config)
+    routing = cluster.routing(options.config)
+    presumption, protocol = cluster.presumption(options.config), cluster.protocol(options.config)
+    if options.address is None and node_id not in participants:
+        parser.error(f"{node_id} is not in {options.config}; pass --address")
+    participant_address = cluster.parse_address(options.address or participants[node_id])
+    os.makedirs(options.data_dir, exist_ok=True)
+    log_directory = os.path.join(options.data_dir, f"{node_id}_log")
+    committed_file = os.path.join(options.data_dir, f"{node_id}committed.txt")
+    prepared_log = PreparedLog(log_directory, committed_file)
+    vote = vote_policy.load(options.vote, prepared_log)
+    # Recovery runs in the background so new transactions are accepted right away
+    threading.Thread(target=check_aborted_transactions, daemon=True).start()
+    listen_thread = threading.Thread(target=listen_to_tc)
+    listen_thread.start()
+    listen_thread.join()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+import os
+import threading
+from collections import OrderedDict
+
+from wal import Signal, WriteAheadLog
+
+# A participant's durable record of the transactions it has voted YES on, kept
+# in a write-ahead log.
+# Records:
+#   ('PREPARED', transaction_id, peer, peer, ...)  forced before the YES vote is sent
+#   ('PRECOMMITTED', transaction_id)               three-phase commit: forced before acknowledging PRECOMMIT
+#   ('COMMITTED', transaction_id)                  tombstone: the transaction committed; alone, forced
+#                                                  before replying, a one-phase commit
+#   ('ABORTED', transaction_id)                    tombstone: the transaction aborted
+# The peers are the addresses of every participant in the transaction, which the
+# termination protocol asks when the TC cannot be reached. A checkpoint keeps the
+# records of transactions without a tombstone and the tombstones of the
+# remembered_outcomes most recent outcomes, so the log stays proportional to the
+# number of in-doubt transactions.
+#
+# Committed transaction IDs are also appended, in order, to a plain history file,
+# once their COMMITTED record is durable. A restart adds the recent commits a
+# crash kept out of it, and the history is forced before a checkpoint forgets
+# older tombstones.
+#
+# The *_async methods are for the participant's event loop: they await the fsync
+# without holding a thread, so the log's writer can group the prepares and
+# commits of however many transactions are in flight into one fsync.
+
+
+class PreparedLog:
+    """ Prepared transactions and their outcomes, with an in-memory index of the in-doubt ones. """
+
+    def __init__(self, directory, committed_file, segment_size=4 * 1024 * 1024, sync=True,
+                 remembered_outcomes=100000):
+        self.wal = WriteAheadLog(directory, sync)
+        self.segment_size = segment_size
+        self.remembered_outcomes = remembered_outcomes
+        self.lock = threading.Lock()
+        self.history_lock = threading.Lock()  # Taken by the log's writer; never held together with self.lock
+        self.prepared = {}  # In-doubt transactions: voted YES, outcome not yet known. transaction_id -> peers
+        self.precommitted = set()  # The in-doubt transactions that have also been precommitted (three-phase commit)
+        self.outcomes = OrderedDict()  # Recently resolved transactions, transaction_id -> 'C' | 'A', oldest first
+        self.checkpointing = False
+        for record in self.wal.replay():
+            self.apply(record)
+        self.committed_path = committed_file
+        self.committed_file = open(committed_file, 'a')
+        self.restore_history()
+
+    def apply(self, record):
+        """ Update the in-memory index for one record. Callers hold self.lock (or are replaying). """
+        kind, transaction_id = record[0], record[1]
+        if kind == 'PREPARED':
+            self.prepared[transaction_id] = record[2:]
+        elif kind == 'PRECOMMITTED':
+            if transaction_id in self.prepared:
+                self.precommitted.add(transaction_id)
+        else:
+            # A tombstone, also of a one-phase commit or carried by a checkpoint, with no PREPARED record
+            self.prepared.pop(transaction_id, None)
+            self.precommitted.discard(transaction_id)
+            self.outcomes[transaction_id] = 'C' if kind == 'COMMITTED' else 'A'
+            while len(self.outcomes) > self.remembered_outcomes:
+                self.outcomes.popitem(last=False)
+
+    async def prepare_async(self, transaction_ids, peers=()):
+        """ Durably record YES votes, with one write and one fsync for the whole list. """
+        if transaction_ids:
+            await self.submit([('PREPARED', transaction_id, *peers) for transaction_id in transaction_ids]).wait_async()
+
+    def precommit_many(self, transaction_ids):
+        """ Three-phase commit: durably move in-doubt transactions to precommitted. Returns the ones moved. """
+        with self.lock:
+            transaction_ids = [transaction_id for transaction_id in dict.fromkeys(transaction_ids)
+                               if transaction_id in self.prepared]
+        self.append([('PRECOMMITTED', transaction_id) for transaction_id in transaction_ids], wait=True)
+        return transaction_ids
+
+    def resolve(self, committed, aborted, sync=True):
+        """ Apply the outcomes of many in-doubt transactions with one history write and one fsync.
+
+        Transactions that are no longer in doubt are skipped, so a COMMIT
+        delivered twice is only added to the history once. With sync=False the
+        write is not waited for (presumed commit: a lost commit record only
+        means asking the TC again after a crash).
+        """
+        committed, aborted, done = self.submit_outcomes(committed, aborted)
+        if sync:
+            done.wait()
+        return committed, aborted
+
+    async def resolve_async(self, committed, aborted):
+        """ resolve() for the event loop, always forced. """
+        committed, aborted, done = self.submit_outcomes(committed, aborted)
+        await done.wait_async()
+        return committed, aborted
+
+    def submit_outcomes(self, committed, aborted):
+        """ Queue the tombstones of the in-doubt transactions of each list. Returns (committed, aborted, Signal). """
+        with self.lock:
+            committed = [transaction_id for transaction_id in dict.fromkeys(committed) if transaction_id in self.prepared]
+            aborted = [transaction_id for transaction_id in dict.fromkeys(aborted) if transaction_id in self.prepared]
+        done = self.submit([('COMMITTED', transaction_id) for transaction_id in committed] +
+                           [('ABORTED', transaction_id) for transaction_id in aborted],
+                           lambda: self.write_history(committed))
+        return committed, aborted, done
+
+    async def commit_one_phase(self, transaction_id):
+        """ Durably commit a transaction that was never prepared: this node was its only participant.
+
+        Returns False, writing nothing, if the transaction is already prepared or resolved here.
+        """
+        with self.lock:
+            if transaction_id in self.prepared or transaction_id in self.outcomes:
+                return False
+            self.apply(('COMMITTED', transaction_id))
+            done = self.wal.submit([('COMMITTED', transaction_id)], lambda: self.write_history([transaction_id]))
+        self.maybe_checkpoint()
+        await done.wait_async()
+        return True
+
+    def write_history(self, committed):
+        """ Append to the committed history. Called by the log's writer once the COMMITTED records are durable. """
+        if committed:
+            with self.history_lock:
+                self.committed_file.write(''.join(transaction_id + "\n" for transaction_id in committed))
+                self.committed_file.flush()
+
+    def restore_history(self):
+        """ Append the recently committed transactions that a crash kept out of the history. """
+        recent = [transaction_id for transaction_id, outcome in self.outcomes.items() if outcome == 'C']
+        if recent:
+            written = set(tail_lines(self.committed_path, 2 * len(recent)))
+            self.write_history([transaction_id for transaction_id in recent if transaction_id not in written])
+
+    def abort_many(self, transaction_ids, sync=False):
+        """ Resolve a batch as aborted. Not forced, as after a crash they are simply asked about again, unless
+        sync=True (presumed commit, before acknowledging).
+        """
+        self.append([('ABORTED', transaction_id) for transaction_id in transaction_ids], wait=sync)
+
+    def append(self, records, wait):
+        if records:
+            done = self.submit(records)
+            if wait:
+                done.wait()
+
+    def submit(self, records, after=None):
+        """ Apply records and queue them for the log. Returns the wal.Signal that is set once they are durable.
+
+        after() is called, on the log's writer thread, once they are.
+        """
+        if not records:
+            done = Signal()
+            done.set()
+            return done
+        with self.lock:
+            for record in records:
+                self.apply(record)
+            done = self.wal.submit(records, after)
+        self.maybe_checkpoint()
+        return done
+
+    def in_doubt(self):
+        """ Return the IDs of prepared transactions whose outcome is not known yet. """
+        with self.lock:
+            return list(self.prepared)
+
+    def is_prepared(self, transaction_id):
+        with self.lock:
+            return transaction_id in self.prepared
+
+    def peers(self, transaction_ids):
+        """ Return {transaction_id: peer addresses} for the listed transactions that are in doubt. """
+        with self.lock:
+            return {transaction_id: self.prepared[transaction_id] for transaction_id in transaction_ids
+                    if transaction_id in self.prepared}
+
+    def state(self, transaction_id):
+        """ 'U' in doubt, 'P' precommitted, 'C' or 'A' recently resolved, or None if the index does not know it. """
+        with self.lock:
+            if transaction_id in self.prepared:
+                return 'P' if transaction_id in self.precommitted else 'U'
+            return self.outcomes.get(transaction_id)
+
+    def committed_among(self, transaction_ids):
+        """ Search the whole committed history for the listed transactions; slow, for those the index has forgotten. """
+        wanted = set(transaction_ids)
+        with self.history_lock:
+            self.committed_file.flush()
+        with open(self.committed_path) as f:
+            return {transaction_id for transaction_id in (line.rstrip('\n') for line in f) if transaction_id in wanted}
+
+    def maybe_checkpoint(self):
+        """ Compact the log in the background once the current segment is large enough. """
+        with self.lock:
+            if self.checkpointing or self.wal.segment_bytes < self.segment_size:
+                return
+            self.checkpointing = True
+        threading.Thread(target=self.checkpoint, daemon=True).start()
+
+    def checkpoint(self):
+        """ Rewrite the in-doubt transactions and the recent outcomes into a checkpoint and drop the segments it
+        replaces.
+        """
+        try:
+            with self.lock:
+                sequence = self.wal.roll()
+                records = [('COMMITTED' if outcome == 'C' else 'ABORTED', transaction_id)
+                           for transaction_id, outcome in self.outcomes.items()]
+                records.extend(('PREPARED', transaction_id, *peers) for transaction_id, peers in self.prepared.items())
+                records.extend(('PRECOMMITTED', transaction_id) for transaction_id in self.precommitted)
+            # The history of the commits whose tombstones are dropped has to be durable first
+            with self.history_lock:
+                self.committed_file.flush()
+                if self.wal.sync:
+                    os.fsync(self.committed_file.fileno())
+            self.wal.checkpoint(sequence, records)
+        finally:
+            with self.lock:
+                self.checkpointing = False
+
+
+def tail_lines(path, count, chunk_size=65536):
+    """ The last count lines of a text file, read backwards from its end. """
+    with open(path, 'rb') as file:
+        position = file.seek(0, os.SEEK_END)
+        data = b''
+        while position > 0 and data.count(b'\n') <= count:
+            step = min(chunk_size, position)
+            position -= step
+            file.seek(position)
+            data = file.read(step) + data
+    return [line.decode() for line in data.splitlines()[-count:]]
@@ -0,0 +1,201 @@
+import struct
+
+# Binary wire protocol shared by every node.
+#
+# A frame is a fixed header followed by a body of one or more messages, so many
+# messages (for many transactions) can be batched into a single send:
+#   frame header:   version (B) | flags (B) | message count (H) | body length (I)
+#   message header: kind (B) | request ID (I) | verb code (B) | argument count (H)
+#   argument:       length (H) | UTF-8 bytes
+# kind is REQUEST (a request, or a one-way message when the request ID is 0) or
+# REPLY (the answer to the request with that ID). A frame holds at most
+# MAX_MESSAGES_PER_FRAME messages and MAX_FRAME_SIZE bytes, so a message larger
+# than a frame cannot be encoded; anything bigger is sent as several messages.
+#
+# PREPARE carries the transaction ID followed by the addresses of every
+# participant in the transaction; PREPARE_BATCH starts with those addresses as one
+# comma-separated argument, followed by the transaction IDs.
+
+VERSION = 3  # 2: argument count widened to 16 bits for batched messages; 3: peer addresses in PREPARE
+FRAME_HEADER = struct.Struct('!BBHI')
+MESSAGE_HEADER = struct.Struct('!BIBH')
+ARGUMENT_LENGTH = struct.Struct('!H')
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+MAX_MESSAGES_PER_FRAME = 0xFFFF
+
+REQUEST = 0
+REPLY = 1
+
+VERBS = ['START', 'PREPARE', 'COMMIT', 'ABORT', 'INQUIRE', 'YES', 'NO',
+         # Batched rounds: one message carries many transaction IDs, and VOTES
+         # answers PREPARE_BATCH with one 'Y', 'N' or 'R' (read-only) per ID, in the same order
+         'PREPARE_BATCH', 'VOTES', 'COMMIT_BATCH', 'ABORT_BATCH',
+         # Bulk inquiry: OUTCOMES answers INQUIRE_BATCH with one 'C' (commit), 'A' (abort) or '?'
+         # (outcome not known to the coordinator) per ID
+         'INQUIRE_BATCH', 'OUTCOMES',
+         # READ_ONLY is a vote ('R' in VOTES); ACK answers a COMMIT, ABORT or PRECOMMIT request (or its batch)
+         'READ_ONLY', 'ACK',
+         # Termination: PEER_INQUIRE asks another participant about transactions, and STATES
+         # answers with one letter per ID: 'C' committed, 'A' aborted, 'P' precommitted,
+         # 'U' uncertain (prepared, outcome unknown), '?' nothing known. PRECOMMIT is the
+         # extra round of three-phase commit.
+         'PEER_INQUIRE', 'STATES', 'PRECOMMIT', 'PRECOMMIT_BATCH',
+         # Replicated coordinators: a replica that is not the leader answers any request with
+         # NOT_LEADER and the leader's address ('' if unknown). BEGIN runs a transaction for a
+         # client and is answered with COMMIT or ABORT, or UNDECIDED if the coordinator lost
+         # the leadership before logging a decision; UNDECIDED also answers an inquiry whose
+         # outcome the coordinator does not know. The rest is replication.py's.
+         'BEGIN', 'NOT_LEADER', 'UNDECIDED', 'APPEND_ENTRIES', 'INSTALL_SNAPSHOT', 'REQUEST_VOTE', 'REPLICA_STATE',
+         # Sharded coordinators: WRONG_SHARD answers a BEGIN or inquiry about another shard's
+         # transaction with that shard's coordinators, comma-separated (see sharding.py)
+         'WRONG_SHARD',
+         # One-phase commit: a transaction with a single participant is sent to it as ONE_PHASE,
+         # answered with COMMIT (committed durably) or ABORT
+         'ONE_PHASE',
+         # Three-phase commit: a restarted TC asks the participants about its unfinished commits with
+         # RECONCILE, answered with STATES like PEER_INQUIRE. A participant that answers 'U' or 'P'
+         # leaves the outcome to the TC from then on
+         'RECONCILE']
+VERB_CODES = {verb: code for code, verb in enumerate(VERBS)}
+
+
+def batch_verb(verb, transaction_ids):
+    """ verb (COMMIT, ABORT or PRECOMMIT) for one transaction, or its _BATCH form for several. """
+    return verb if len(transaction_ids) == 1 else f"{verb}_BATCH"
+
+
+class ProtocolError(ValueError):
+    """ Raised when a peer sends bytes that are not a valid frame. """
+
+
+def encode_message(kind, request_id, verb, args=()):
+    """ Encode one message (without a frame header). """
+    try:
+        parts = [MESSAGE_HEADER.pack(kind, request_id, VERB_CODES[verb], len(args))]
+        for arg in args:
+            data = arg.encode() if isinstance(arg, str) else bytes(arg)
+            parts.append(ARGUMENT_LENGTH.pack(len(data)))
+            parts.append(data)
+    except KeyError:
+        raise ProtocolError(f"Unknown verb {verb!r}") from None
+    except struct.error as e:
+        # More than 65535 arguments, or an argument longer than 65535 bytes
+        raise ProtocolError(f"Cannot encode {verb} with {len(args)} arguments: {e}") from None
+    message = b''.join(parts)
+    if len(message) > MAX_FRAME_SIZE:
+        raise ProtocolError(f"{verb} message of {len(message)} bytes does not fit in a frame")
+    return message
+
+
+def encode_frame(encoded_messages):
+    """ Wrap already-encoded messages into one frame. """
+    body = b''.join(encoded_messages)
+    if len(body) > MAX_FRAME_SIZE:
+        raise ProtocolError(f"Frame of {len(body)} bytes exceeds {MAX_FRAME_SIZE}")
+    return FRAME_HEADER.pack(VERSION, 0, len(encoded_messages), len(body)) + body
+
+
+def take_frame(outgoing):
+    """ Remove as many encoded messages from the front of outgoing, a list, as fit in one frame; return that frame.
+
+    A frame is limited by MAX_MESSAGES_PER_FRAME and by MAX_FRAME_SIZE bytes,
+    which every encoded message fits in on its own.
+    """
+    count = size = 0
+    for message in outgoing:
+        if count == MAX_MESSAGES_PER_FRAME or size + len(message) > MAX_FRAME_SIZE:
+            break
+        count += 1
+        size += len(message)
+    batch = outgoing[:count]
+    del outgoing[:count]
+    return encode_frame(batch)
+
+
+def decode_frame_header(data, offset=0):
+    """ Check the frame header at offset and return (message count, body length). """
+    version, flags, count, length = FRAME_HEADER.unpack_from(data, offset)
+    if version != VERSION:
+        raise ProtocolError(f"Unsupported protocol version {version}")
+    if length > MAX_FRAME_SIZE:
+        raise ProtocolError(f"Frame of {length} bytes exceeds {MAX_FRAME_SIZE}")
+    return count, length
+
+
+def decode_messages(body, count):
+    """ Decode count messages from a frame body (a memoryview) into (kind, request_id, verb, args) tuples. """
+    messages = []
+    offset = 0
+    try:
+        for _ in range(count):
+            kind, request_id, code, nargs = MESSAGE_HEADER.unpack_from(body, offset)
+            offset += MESSAGE_HEADER.size
+            args = []
+            for _ in range(nargs):
+                (length,) = ARGUMENT_LENGTH.unpack_from(body, offset)
+                offset += ARGUMENT_LENGTH.size
+                args.append(str(body[offset:offset + length], 'utf-8'))
+                offset += length
+            if code >= len(VERBS):
+                raise ProtocolError(f"Unknown verb code {code}")
+            messages.append((kind, request_id, VERBS[code], args))
+    except struct.error:
+        raise ProtocolError("Frame body is shorter than its messages") from None
+    except UnicodeDecodeError:
+        raise ProtocolError("Argument is not valid UTF-8") from None
+    if offset != len(body):
+        raise ProtocolError("Frame length does not match its messages")
+    return messages
+
+
+class FrameReader:
+    """ Reads frames from a stream socket into one reusable buffer and yields the messages they carry. """
+
+    def __init__(self, sock, buffer_size=65536):
+        self.sock = sock
+        self.buffer = bytearray(buffer_size)
+        self.start = 0  # First unparsed byte
+        self.end = 0  # End of the received bytes
+
+    def messages(self):
+        """ Yield (kind, request_id, verb, args) tuples until the peer closes the connection. """
+        while True:
+            frame = self.next_frame()
+            if frame is None:
+                return
+            yield from frame
+
+    def next_frame(self):
+        """ Return the messages of the next complete frame, or None at end of stream. """
+        if not self.fill(FRAME_HEADER.size):
+            return None
+        count, length = decode_frame_header(self.buffer, self.start)
+        if not self.fill(FRAME_HEADER.size + length):
+            raise ProtocolError("Connection closed in the middle of a frame")
+        body_start = self.start + FRAME_HEADER.size
+        self.start = body_start + length
+        with memoryview(self.buffer) as view:
+            return decode_messages(view[body_start:self.start], count)
+
+    def fill(self, needed):
+        """ Receive until at least needed unparsed bytes are buffered. Returns False on a clean end of stream. """
+        if self.end - self.start >= needed:
+            return True
+        if self.start == self.end:
+            self.start = self.end = 0
+        if self.start + needed > len(self.buffer):
+            # Move the partial frame to the front, growing the buffer for large frames
+            pending = self.buffer[self.start:self.end]
+            if needed > len(self.buffer):
+                self.buffer = bytearray(needed)
+            self.buffer[:len(pending)] = pending
+            self.start, self.end = 0, len(pending)
+        with memoryview(self.buffer) as view:
+            while self.end - self.start < needed:
+                received = self.sock.recv_into(view[self.end:])
+                if received == 0:
+                    if self.end == self.start:
+                        return False
+                    raise ProtocolError("Connection closed in the middle of a frame")
+                self.end += received
+        return True
@@ -0,0 +1,435 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import metrics
+from channel import ChannelPool
+
+# Replication of the coordinator's decision log across a group of coordinator
+# processes, after Raft (leader election and log replication, without
+# membership changes).
+#
+# One replica is the leader: it alone runs transactions and answers inquiries,
+# and the others redirect participants and clients to it with NOT_LEADER. Every
+# append to the leader's decision log becomes one log entry, numbered by
+# (index, term) with an ('INDEX', index, term) record after the entry's records.
+# A forced append returns only once a majority of the group has the entry on
+# disk, so a decision is never acted on (COMMIT sent, inquiry answered) unless it
+# survives the loss of the leader.
+#
+# Messages between replicas, each answered with REPLICA_STATE term success last_index last_term:
+#   APPEND_ENTRIES term leader prev_index prev_term records...  (no records: heartbeat)
+#   INSTALL_SNAPSHOT term leader part last records...  replaces a follower log that has diverged from the
+#       leader's; a snapshot too large for one message is sent as parts 0, 1, ... in order, last '1' on the final one
+#   REQUEST_VOTE term candidate last_index last_term
+# Records travel JSON-encoded, several to an argument.
+#
+# A follower that hears from no leader for a random election timeout (between
+# election_timeout and twice that) stands for election in a new term, and wins
+# with the votes of a majority; a replica only votes for a candidate whose log is
+# at least as up to date as its own. The new leader commits an empty entry
+# before it serves, which also commits whatever it inherited from earlier terms.
+# Followers apply entries as they arrive but never act on them, and a leader
+# that loses touch with the majority steps down. Term and vote are kept in
+# replica.json in the log directory.
+
+log = logging.getLogger('replication')
+VERBS = ('APPEND_ENTRIES', 'INSTALL_SNAPSHOT', 'REQUEST_VOTE')
+MAX_ARGUMENT = 60000  # Bytes of JSON-encoded records per message argument
+MAX_APPEND = 5000  # Most records in one APPEND_ENTRIES
+MAX_SNAPSHOT_ARGUMENTS = 100  # Most record arguments in one INSTALL_SNAPSHOT message (about 6 MB)
+
+leader_gauge = metrics.gauge('tpc_replica_leader', "1 while this coordinator leads its replica group")
+term_gauge = metrics.gauge('tpc_replica_term', "Current term of this coordinator's replica group")
+elections = metrics.counter('tpc_replica_elections_total', "Elections this coordinator stood in, by result",
+                            labels=('result',))
+
+
+class NotLeader(Exception):
+    """ Raised by operations that need the leader on a replica that is not (or no longer) the leader. """
+
+    def __init__(self, leader=None):
+        super().__init__(f"This coordinator is not the leader; the leader is {leader or 'unknown'}")
+        self.leader = leader
+
+
+def encode_records(records):
+    """ Pack records into as few message arguments as fit MAX_ARGUMENT bytes each. """
+    arguments, chunk, size = [], [], 2
+    for record in records:
+        encoded = json.dumps(record, separators=(',', ':'))
+        if chunk and size + len(encoded) + 1 > MAX_ARGUMENT:
+            arguments.append('[' + ','.join(chunk) + ']')
+            chunk, size = [], 2
+        chunk.append(encoded)
+        size += len(encoded) + 1
+    if chunk:
+        arguments.append('[' + ','.join(chunk) + ']')
+    return arguments
+
+
+def decode_records(arguments):
+    return [tuple(record) for argument in arguments for record in json.loads(argument)]
+
+
+class Replica:
+    """ This coordinator's member of a replicated coordinator group. """
+
+    def __init__(self, address, peers, decision_log, directory, on_leader=None, on_follower=None,
+                 election_timeout=0.15, heartbeat_interval=0.05, max_entries=10000):
+        self.address = address  # 'host:port' of this replica
+        self.peers = list(peers)  # 'host:port' of the other replicas
+        self.decision_log = decision_log
+        self.state_path = os.path.join(directory, 'replica.json')
+        self.on_leader = on_leader  # Called once this replica leads and its log is committed, before it serves
+        self.on_follower = on_follower  # Called when this replica stops leading
+        self.election_timeout = election_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.max_entries = max_entries
+        self.majority = (len(self.peers) + 1) // 2 + 1
+        self.condition = threading.Condition()
+        self.term = 0
+        self.voted_for = None
+        self.role = 'follower'
+        self.leader = None  # Address of the current leader, if known
+        self.serving = False  # Leader whose first entry is committed, so it may act on its log
+        self.election_deadline = 0
+        # Leader only: entries not yet trimmed, the entry before them, and each follower's progress
+        self.entries = deque()  # (index, term, records), consecutive indexes
+        self.base = (0, 0)
+        self.match = {}  # peer -> index of its last entry known to match this log
+        self.next = {}  # peer -> index of the next entry to send it, or None when it needs a snapshot
+        self.contacted = {}  # peer -> monotonic time of its last answer in this term
+        self.elected = 0
+        self.accept_lock = threading.Lock()  # Serializes the entries and snapshots a follower accepts
+        self.snapshot_parts = []  # Follower: the record arguments of a snapshot still arriving in parts
+        self.pool = ChannelPool(connect_timeout=election_timeout)
+
+    def start(self):
+        self.load_state()
+        self.reset_election_deadline()
+        threading.Thread(target=self.run, daemon=True, name='replica').start()
+
+    def load_state(self):
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+            self.term, self.voted_for = state['term'], state['voted_for']
+        except FileNotFoundError:
+            pass
+        self.term = max(self.term, self.decision_log.position()[1])
+        term_gauge.set(self.term)
+
+    def save_state(self):
+        """ Durably store the term and vote. Callers hold self.condition. """
+        temporary = self.state_path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump({'term': self.term, 'voted_for': self.voted_for}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.state_path)
+        term_gauge.set(self.term)
+
+    def reset_election_deadline(self):
+        self.election_deadline = time.monotonic() + self.election_timeout * (1 + random.random())
+
+    @property
+    def leading(self):
+        """ True while this replica is the leader and may run transactions. """
+        return self.role == 'leader' and self.serving
+
+    def leader_term(self):
+        """ The term to number a new entry with. Raises NotLeader unless this replica is the leader. """
+        with self.condition:
+            if self.role != 'leader':
+                raise NotLeader(self.leader)
+            return self.term
+
+    def run(self):
+        """ Stand for election when no leader has been heard from; as leader, step down when cut off. """
+        while True:
+            time.sleep(self.heartbeat_interval / 5)
+            now = time.monotonic()
+            with self.condition:
+                if self.role == 'leader':
+                    recent = sum(now - contacted < 4 * self.election_timeout for contacted in self.contacted.values())
+                    cut_off = recent + 1 < self.majority and now - self.elected > 4 * self.election_timeout
+                    if not cut_off:
+                        continue
+                    log.warning("Lost touch with the majority of the group; stepping down")
+                    self.become_follower(None)
+                    due = False
+                else:
+                    due = now >= self.election_deadline
+            if due:
+                self.stand_for_election()
+
+    # Elections
+
+    def stand_for_election(self):
+        position = self.decision_log.position()
+        with self.condition:
+            self.term += 1
+            self.role = 'candidate'
+            self.voted_for = self.address
+            self.leader = None
+            self.save_state()
+            self.reset_election_deadline()
+            term = self.term
+        log.info("Standing for election in term %d", term)
+        replies = self.pool.request_all({peer: ("REQUEST_VOTE", str(term), self.address, str(position[0]),
+                                                str(position[1])) for peer in self.peers}, self.election_timeout)
+        votes = 1
+        for reply in replies.values():
+            if reply is not None:
+                _, args = reply
+                if int(args[0]) > term:
+                    self.observe_term(int(args[0]))
+                    elections.labels('lost').inc()
+                    return
+                votes += args[1] == '1'
+        with self.condition:
+            if self.term != term or self.role != 'candidate':
+                return
+            if votes < self.majority:
+                elections.labels('lost').inc()
+                return
+            self.become_leader(position)
+        elections.labels('won').inc()
+        log.warning("Elected leader of term %d with %d of %d votes", term, votes, len(self.peers) + 1)
+        for peer in self.peers:
+            threading.Thread(target=self.replicate, args=(peer, term), daemon=True, name=f'replicate-{peer}').start()
+        threading.Thread(target=self.take_office, args=(term,), daemon=True).start()
+
+    def become_leader(self, position):
+        """ Callers hold self.condition. """
+        self.role = 'leader'
+        self.leader = self.address
+        self.serving = False
+        self.entries = deque()
+        self.base = position
+        self.match = {peer: 0 for peer in self.peers}
+        self.next = {peer: position[0] + 1 for peer in self.peers}
+        self.contacted = {}
+        self.elected = time.monotonic()
+
+    def take_office(self, term):
+        """ Commit an empty entry of the new term, then start serving. """
+        try:
+            self.decision_log.barrier()
+            if self.on_leader is not None:
+                self.on_leader()
+        except NotLeader:
+            return
+        with self.condition:
+            if self.role != 'leader' or self.term != term:
+                return
+            self.serving = True
+        leader_gauge.set(1)
+
+    def become_follower(self, leader):
+        """ Callers hold self.condition. """
+        was_leading = self.role == 'leader'
+        self.role = 'follower'
+        self.leader = leader
+        self.serving = False
+        self.reset_election_deadline()
+        self.condition.notify_all()
+        if was_leading:
+            leader_gauge.set(0)
+            if self.on_follower is not None:
+                threading.Thread(target=self.on_follower, daemon=True).start()
+
+    def observe_term(self, term, leader=None):
+        """ Move to a newer term seen in a message, as a follower. """
+        with self.condition:
+            if term > self.term:
+                self.term = term
+                self.voted_for = None
+                self.save_state()
+                self.become_follower(leader)
+
+    def vote(self, term, candidate, last_index, last_term):
+        """ Answer a REQUEST_VOTE. Returns (current term, granted). """
+        position = self.decision_log.position()
+        with self.condition:
+            if term > self.term:
+                self.term = term
+                self.voted_for = None
+                self.become_follower(None)
+            granted = (term == self.term and self.voted_for in (None, candidate)
+                       and (last_term, last_index) >= (position[1], position[0]))
+            if granted:
+                self.voted_for = candidate
+                self.reset_election_deadline()
+            self.save_state()
+            return self.term, granted
+
+    # Leader: log replication
+
+    def appended(self, index, term, records):
+        """ Called by the decision log, under its lock, for each entry it appends as leader. """
+        with self.condition:
+            self.entries.append((index, term, records))
+            while len(self.entries) > self.max_entries:
+                trimmed = self.entries.popleft()
+                self.base = trimmed[0], trimmed[1]
+            self.condition.notify_all()
+
+    def wait_replicated(self, index, term):
+        """ Block until a majority has the entry. Raises NotLeader if leadership is lost first. """
+        with self.condition:
+            while True:
+                if self.role != 'leader' or self.term != term:
+                    raise NotLeader(self.leader)
+                if 1 + sum(match >= index for match in self.match.values()) >= self.majority:
+                    return
+                self.condition.wait()
+
+    def entry_term(self, index):
+        """ Term of the entry at index if this leader still has it, else None. Callers hold self.condition. """
+        if index == self.base[0]:
+            return self.base[1]
+        if self.entries and self.entries[0][0] <= index <= self.entries[-1][0]:
+            return self.entries[index - self.entries[0][0]][1]
+        return None
+
+    def replicate(self, peer, term):
+        """ Leader: keep one follower in step with this log, one request at a time. """
+        last_sent = 0
+        while True:
+            with self.condition:
+                while True:
+                    if self.role != 'leader' or self.term != term:
+                        return
+                    next_index = self.next[peer]
+                    last_index = self.entries[-1][0] if self.entries else self.base[0]
+                    waited = time.monotonic() - last_sent
+                    if next_index is None or next_index <= last_index or waited >= self.heartbeat_interval:
+                        break
+                    self.condition.wait(self.heartbeat_interval - waited)
+                if next_index is not None and self.entry_term(next_index - 1) is None:
+                    self.next[peer] = next_index = None  # Trimmed: only a snapshot can catch it up
+                if next_index is not None:
+                    previous = next_index - 1, self.entry_term(next_index - 1)
+                    records = []
+                    if self.entries and next_index >= self.entries[0][0]:
+                        for _, _, entry_records in list(self.entries)[next_index - self.entries[0][0]:]:
+                            records.extend(entry_records)
+                            if len(records) >= MAX_APPEND:
+                                break
+            last_sent = time.monotonic()
+            try:
+                channel = self.pool.get(peer)
+                if next_index is None:
+                    snapshot = self.decision_log.snapshot()
+                    log.info("Sending a snapshot of %d records to %s", len(snapshot), peer)
+                    reply = self.send_snapshot(channel, term, snapshot)
+                else:
+                    reply = channel.request("APPEND_ENTRIES", str(term), self.address, str(previous[0]),
+                                            str(previous[1]), *encode_records(records))
+                _, args = reply.result(timeout=self.reply_timeout())
+            except (ConnectionError, TimeoutError) as e:
+                log.debug("Replication to %s failed: %s", peer, e)
+                time.sleep(self.heartbeat_interval)
+                continue
+            except Exception:
+                # Anything else must not end replication to this follower for the rest of the term
+                log.exception("Replication to %s failed", peer)
+                time.sleep(self.heartbeat_interval)
+                continue
+            reply_term, success, position = int(args[0]), args[1] == '1', (int(args[2]), int(args[3]))
+            if reply_term > term:
+                self.observe_term(reply_term)
+                return
+            with self.condition:
+                if self.role != 'leader' or self.term != term:
+                    return
+                self.contacted[peer] = time.monotonic()
+                if success:
+                    self.match[peer] = position[0]
+                    self.next[peer] = position[0] + 1
+                    self.condition.notify_all()
+                elif self.entry_term(position[0]) == position[1]:
+                    self.next[peer] = position[0] + 1  # Its log is a prefix of this one
+                else:
+                    self.next[peer] = None
+
+    def reply_timeout(self):
+        return max(1.0, 4 * self.election_timeout)
+
+    def send_snapshot(self, channel, term, records):
+        """ Send records as INSTALL_SNAPSHOT parts small enough for a frame, each once the one before is accepted.
+
+        Returns the Future of the reply to the last part, or to the first part the follower refused.
+        """
+        arguments = encode_records(records)
+        parts = [arguments[i:i + MAX_SNAPSHOT_ARGUMENTS] for i in range(0, len(arguments), MAX_SNAPSHOT_ARGUMENTS)]
+        parts = parts or [[]]
+        for number, part in enumerate(parts):
+            last = number == len(parts) - 1
+            reply = channel.request("INSTALL_SNAPSHOT", str(term), self.address, str(number), '1' if last else '0',
+                                    *part)
+            if not last and reply.result(timeout=self.reply_timeout())[1][1] != '1':
+                break
+        return reply
+
+    # Follower
+
+    def accept(self, verb, args):
+        """ Handle APPEND_ENTRIES or INSTALL_SNAPSHOT from a leader. Returns (term, success, position). """
+        term, leader = int(args[0]), args[1]
+        # The decision log's lock is never taken while holding self.condition, as the log takes them the other way
+        with self.condition:
+            current = self.term
+            stale = term < current
+            if term > current:
+                self.term = term
+                self.voted_for = None
+                self.save_state()
+            if not stale and (self.role != 'follower' or self.leader != leader):
+                if self.leader != leader:
+                    log.info("Following %s in term %d", leader, term)
+                self.become_follower(leader)
+            self.reset_election_deadline()
+        if stale:
+            return current, False, self.decision_log.position()
+        with self.accept_lock:
+            if verb == 'INSTALL_SNAPSHOT':
+                number, last = int(args[2]), args[3] == '1'
+                if number == 0:
+                    self.snapshot_parts = []
+                elif number != len(self.snapshot_parts):
+                    return term, False, self.decision_log.position()  # A part went missing: the leader starts over
+                self.snapshot_parts.append(args[4:])
+                if not last:
+                    return term, True, self.decision_log.position()
+                parts, self.snapshot_parts = self.snapshot_parts, []
+                self.decision_log.restore(decode_records([argument for part in parts for argument in part]))
+                return term, True, self.decision_log.position()
+            position = self.decision_log.position()
+            if (int(args[2]), int(args[3])) != position:
+                return term, False, position
+            records = decode_records(args[4:])
+            if records:
+                self.decision_log.apply_entries(records)
+            return term, True, self.decision_log.position()
+
+    async def handle(self, connection, request_id, verb, args):
+        """ Serve a message from another replica on the coordinator's event loop. """
+        loop = asyncio.get_running_loop()
+        if verb == 'REQUEST_VOTE':
+            term, granted = await loop.run_in_executor(None, self.vote, int(args[0]), args[1], int(args[2]),
+                                                       int(args[3]))
+            position = self.decision_log.position()
+            connection.reply(request_id, "REPLICA_STATE", str(term), '1' if granted else '0', str(position[0]),
+                             str(position[1]))
+        else:
+            term, success, position = await loop.run_in_executor(None, self.accept, verb, args)
+            connection.reply(request_id, "REPLICA_STATE", str(term), '1' if success else '0', str(position[0]),
+                             str(position[1]))
@@ -0,0 +1,89 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+# Second-phase messages a node has not acknowledged wait here and are resent in the
+# background, so an unreachable node never holds up new transactions.
+#
+# Each node has its own queue of unacknowledged transaction IDs per verb (COMMIT,
+# ABORT) and its own backoff: after a failed attempt the next one waits twice as
+# long, up to max_backoff; a successful attempt resets it. Retries are driven by
+# the timer wheel and run on a small thread pool, one attempt per node at a time,
+# each sending up to max_batch IDs in one message.
+
+log = logging.getLogger('retry_queue')
+redeliveries = metrics.counter('tpc_redeliveries_total', "Redelivery attempts of unacknowledged decisions, by result",
+                               labels=('result',))
+
+
+class RetryQueue:
+    """ Unacknowledged decisions per node, redelivered with exponential backoff. """
+
+    def __init__(self, deliver, timers, initial_backoff=0.05, max_backoff=30, max_batch=1000, max_workers=8):
+        self.deliver = deliver  # deliver(node, verb, transaction_ids) returns once the node has acknowledged them
+        self.timers = timers
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.max_batch = max_batch
+        self.queues = {}  # node -> {verb: {transaction_id: None}}, oldest first
+        self.backoff = {}  # node -> delay before its next attempt
+        self.scheduled = set()  # Nodes with an attempt scheduled or running
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='retry')
+
+    def add(self, node, verb, transaction_ids):
+        """ Queue transaction_ids for redelivery of verb to node. """
+        if not transaction_ids:
+            return
+        with self.lock:
+            queue = self.queues.setdefault(node, {}).setdefault(verb, {})
+            queue.update(dict.fromkeys(transaction_ids))
+            if node not in self.scheduled:
+                self.scheduled.add(node)
+                self.timers.schedule(self.backoff.setdefault(node, self.initial_backoff), self.due, node)
+
+    def due(self, node):
+        # Runs on the timer wheel's thread, which must not block
+        self.executor.submit(self.retry, node)
+
+    def retry(self, node):
+        """ Try to deliver the oldest queued IDs of every verb to node, then schedule the next attempt. """
+        with self.lock:
+            attempt = {verb: list(queue)[:self.max_batch] for verb, queue in self.queues.get(node, {}).items() if queue}
+        delivered = True
+        for verb, transaction_ids in attempt.items():
+            try:
+                self.deliver(node, verb, transaction_ids)
+            except Exception as e:
+                log.info("Redelivery of %d %s to %s failed: %s", len(transaction_ids), verb, node, e)
+                redeliveries.labels('failed').inc()
+                delivered = False
+                break
+            redeliveries.labels('delivered').inc()
+            with self.lock:
+                queue = self.queues.get(node, {}).get(verb, {})
+                for transaction_id in transaction_ids:
+                    queue.pop(transaction_id, None)
+        with self.lock:
+            if delivered:
+                self.backoff[node] = self.initial_backoff
+            else:
+                self.backoff[node] = min(self.backoff[node] * 2, self.max_backoff)
+            if any(self.queues.get(node, {}).values()):
+                self.timers.schedule(0 if delivered else self.backoff[node], self.due, node)
+            else:
+                self.queues.pop(node, None)
+                self.scheduled.discard(node)
+
+    def clear(self):
+        """ Drop every queued delivery; attempts already running still finish. """
+        with self.lock:
+            for queues in self.queues.values():
+                queues.clear()
+
+    def pending(self):
+        """ Number of queued (node, transaction) deliveries. """
+        with self.lock:
+            return sum(len(queue) for queues in self.queues.values() for queue in queues.values())
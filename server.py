@@ -0,0 +1,120 @@
+import asyncio
+import logging
+
+import metrics
+from protocol import (REQUEST, REPLY, FRAME_HEADER, ProtocolError,
+                      decode_frame_header, decode_messages, encode_message, take_frame)
+
+# asyncio server core shared by the coordinator and the participants.
+#
+# One event loop serves every open connection. Each incoming request is handled
+# by its own task running handler(connection, request_id, verb, args), a
+# coroutine, so a slow request never holds up the other messages on the same
+# connection or the other connections. Handlers that have to block (fsync,
+# console input) move that work to a thread with loop.run_in_executor().
+
+log = logging.getLogger('server')
+open_connections = metrics.gauge('tpc_inbound_connections', "Open connections accepted from other nodes")
+
+
+class Connection:
+    """ Server side of a channel: receives requests and sends replies using the framed protocol. """
+
+    def __init__(self, reader, writer, handler):
+        self.reader = reader
+        self.writer = writer
+        self.handler = handler
+        self.loop = asyncio.get_running_loop()
+        self.outgoing = []  # Encoded messages to write on the next loop iteration
+        self.tasks = set()
+        peer = writer.get_extra_info('peername')
+        self.name = f"{peer[0]}:{peer[1]}" if peer else '?'
+        open_connections.inc()
+
+    @property
+    def closed(self):
+        return self.writer.is_closing()
+
+    def send(self, verb, *args):
+        """ Send a one-way message that expects no reply. Safe to call from any thread. """
+        self.write(encode_message(REQUEST, 0, verb, args))
+
+    def reply(self, request_id, verb, *args):
+        """ Answer the request with the given ID. Safe to call from any thread. """
+        self.write(encode_message(REPLY, request_id, verb, args))
+
+    def write(self, message):
+        if self.closed:
+            raise ConnectionError(f"Connection to {self.name} is closed")
+        try:
+            running = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            running = False
+        if running:
+            self.queue(message)
+        else:
+            self.loop.call_soon_threadsafe(self.queue, message)
+
+    def queue(self, message):
+        """ Queue a message; everything queued during one loop iteration goes out as one frame. """
+        if not self.outgoing:
+            self.loop.call_soon(self.flush)
+        self.outgoing.append(message)
+
+    def flush(self):
+        try:
+            while self.outgoing and not self.closed:
+                self.writer.write(take_frame(self.outgoing))
+        except Exception as e:
+            log.warning("Closing connection from %s: cannot write to it: %s", self.name, e)
+            self.writer.close()
+        finally:
+            # Left over only when closed; an empty queue lets the next message schedule a flush again
+            self.outgoing.clear()
+
+    async def run(self):
+        """ Read frames until the peer disconnects, starting one handler task per message. """
+        try:
+            while True:
+                header = await self.reader.readexactly(FRAME_HEADER.size)
+                count, length = decode_frame_header(header)
+                body = await self.reader.readexactly(length)
+                for kind, request_id, verb, args in decode_messages(memoryview(body), count):
+                    if kind == REQUEST:
+                        task = self.loop.create_task(self.handle(request_id, verb, args))
+                        self.tasks.add(task)
+                        task.add_done_callback(self.tasks.discard)
+        except asyncio.IncompleteReadError:
+            pass
+        except ProtocolError as e:
+            log.warning("Closing connection from %s: %s", self.name, e)
+        except ConnectionError:
+            pass
+        finally:
+            open_connections.dec()
+            self.writer.close()
+
+    async def handle(self, request_id, verb, args):
+        try:
+            await self.handler(self, request_id, verb, args)
+        except ConnectionError as e:
+            log.warning("Lost connection from %s while handling %s: %s", self.name, verb, e)
+        except Exception:
+            log.exception("Error handling %s %s from %s", verb, ' '.join(args), self.name)
+
+
+async def serve_forever(address, handler, backlog=1024, started=None):
+    """ Serve address on the running event loop until cancelled. """
+    async def on_connect(reader, writer):
+        await Connection(reader, writer, handler).run()
+
+    server = await asyncio.start_server(on_connect, address[0], address[1], backlog=backlog, reuse_address=True)
+    if started is not None:
+        started.set()
+    async with server:
+        await server.serve_forever()
+
+
+def serve(address, handler, started=None):
+    """ Run an event loop in the calling thread that serves address forever. """
+    asyncio.run(serve_forever(address, handler, started=started))
@@ -0,0 +1,76 @@
+import bisect
+import zlib
+
+# Routing of transaction IDs to coordinator shards.
+#
+# Each shard is a coordinator (or a replicated coordinator group, see
+# replication.py) with its own decision log, and owns a range of the 32-bit hash
+# space: transaction ID t belongs to the shard whose range holds crc32(t). The
+# ranges are listed in the cluster file and must cover the whole space without
+# gaps or overlaps:
+#   "shards": [
+#     {"range": [0, 2147483648], "coordinators": ["localhost:1025"]},
+#     {"range": [2147483648, 4294967296], "coordinators": ["localhost:1035"]}
+#   ]
+# A coordinator only runs and answers for the transactions of its own shard, and
+# answers the others with WRONG_SHARD and the owning shard's coordinators.
+# Participants send each inquiry to the shard that owns the transaction.
+
+HASH_SPACE = 1 << 32
+
+
+def transaction_hash(transaction_id):
+    return zlib.crc32(transaction_id.encode())
+
+
+class WrongShard(ValueError):
+    """ Raised for a transaction that belongs to another shard. """
+
+    def __init__(self, transaction_id, coordinators):
+        super().__init__(f"Transaction {transaction_id} belongs to the shard of {', '.join(coordinators)}")
+        self.coordinators = coordinators
+
+
+class RoutingTable:
+    """ Hash ranges of the transaction ID space and the coordinators that own them. """
+
+    def __init__(self, shards):
+        # shards: [(start, end, ['host:port', ...])], in any order
+        self.shards = sorted((int(start), int(end), list(coordinators)) for start, end, coordinators in shards)
+        position = 0
+        for start, end, coordinators in self.shards:
+            if start != position or end <= start or not coordinators:
+                raise ValueError(f"Shard ranges must cover 0-{HASH_SPACE} without gaps or overlaps, "
+                                 f"each with a coordinator; found {start}-{end}")
+            position = end
+        if position != HASH_SPACE:
+            raise ValueError(f"Shard ranges end at {position} instead of {HASH_SPACE}")
+        self.starts = [start for start, _, _ in self.shards]
+
+    @classmethod
+    def even(cls, coordinator_groups):
+        """ Split the space into equal ranges, one per coordinator group (a list of 'host:port'). """
+        count = len(coordinator_groups)
+        return cls([(HASH_SPACE * index // count, HASH_SPACE * (index + 1) // count, group)
+                    for index, group in enumerate(coordinator_groups)])
+
+    def __len__(self):
+        return len(self.shards)
+
+    def shard(self, transaction_id):
+        """ Index of the shard that owns transaction_id. """
+        return bisect.bisect_right(self.starts, transaction_hash(transaction_id)) - 1
+
+    def coordinators(self, shard):
+        """ 'host:port' of every coordinator of a shard. """
+        return self.shards[shard][2]
+
+    def group(self, transaction_ids):
+        """ {shard: [transaction_id]} for a list of transaction IDs, keeping their order. """
+        groups = {}
+        for transaction_id in transaction_ids:
+            groups.setdefault(self.shard(transaction_id), []).append(transaction_id)
+        return groups
+
+    def to_config(self):
+        return [{'range': [start, end], 'coordinators': coordinators} for start, end, coordinators in self.shards]
@@ -0,0 +1,590 @@
+import argparse
+import heapq
+import itertools
+import random
+import sys
+import time
+
+import cluster
+from commit_rules import presumed_outcome, vote_outcome, second_phase_nodes, acknowledged, termination_outcome
+
+# Deterministic simulation of the commit protocol, e.g.
+#   python simulation.py --seeds 2000 --presumption commit
+#   python simulation.py --seed 1234 --trace
+# The coordinator and the participants run in one process as message handlers
+# over a virtual network and a virtual clock, so a scenario of many transactions
+# with crashes takes milliseconds and replays exactly from its seed.
+#
+# The nodes follow node1.py and participant.py: presumed abort or presumed commit,
+# YES / NO / READ_ONLY votes, acknowledged decisions with redelivery, inquiries
+# and cooperative termination, and recovery from the log after a restart. The
+# decisions themselves (the outcome of a set of votes, which nodes take part in
+# the second phase and acknowledge it, what an unknown transaction presumes and
+# how peers' states settle an in-doubt one) come from commit_rules.py, as they
+# do in the real nodes; only the messaging, logging and timing are modelled here.
+#
+# Faults, drawn from the seed while the fault period lasts:
+#   drop    a message is lost (as when its connection breaks)
+#   stall   a message is held back for up to stall_time, and so is every later
+#           message on the same link: links are FIFO like TCP, so messages are
+#           reordered across links, never within one
+#   crash   a node loses everything not yet fsynced (a forced write takes a
+#           random fsync time) and every message to or from it still in flight,
+#           and restarts after a random downtime
+# After the fault period the network is reliable, and the scenario runs until
+# no event is left.
+#
+# Checked invariants:
+#   atomicity    no transaction is committed on one participant and aborted on another
+#   validity     a transaction commits only if every participant voted YES or READ_ONLY
+#   agreement    every participant applies the outcome the coordinator reported, and
+#                every participant that voted YES on a reported commit commits it
+#   termination  once the faults stop, no participant is left in doubt and every
+#                logged decision is acknowledged
+#
+# Three-phase commit is not simulated: its termination rule assumes that a
+# participant that does not answer in time has crashed, which a stalled network
+# breaks by design.
+
+
+class Disk:
+    """ A node's log. Records survive a crash once a forced write issued after them has finished. """
+
+    def __init__(self):
+        self.records = []
+        self.durable = 0  # Number of leading records on disk
+
+    def crash(self):
+        del self.records[self.durable:]
+
+
+class Node:
+    """ A simulated process, with a disk that survives its crashes.
+
+    Subclasses define reset(), which sets up the volatile state, apply(), which
+    replays one log record into it, and recover(), which finishes whatever the
+    log shows was left open when the node restarts.
+    """
+
+    def __init__(self, simulation, name):
+        self.simulation = simulation
+        self.name = name
+        self.disk = Disk()
+        self.up = True
+        self.incarnation = 0
+        self.reset()
+
+    def send(self, destination, verb, *args):
+        self.simulation.send(self, destination, verb, args)
+
+    def after(self, delay, callback, *args):
+        """ Run callback(*args) after delay virtual seconds, unless this node crashes first. """
+        self.simulation.schedule(delay, self, callback, *args)
+
+    def append(self, *records):
+        self.disk.records.extend(records)
+        for record in records:
+            self.apply(record)
+
+    def force(self, callback, *args):
+        """ fsync everything appended so far, then run callback(*args). """
+        self.after(self.simulation.fsync_time(), self.synced, len(self.disk.records), callback, args)
+
+    def synced(self, length, callback, args):
+        self.disk.durable = max(self.disk.durable, length)
+        callback(*args)
+
+    def crash(self):
+        self.up = False
+        self.incarnation += 1
+        self.disk.crash()
+        self.reset()
+
+    def restart(self):
+        self.up = True
+        for record in self.disk.records:
+            self.apply(record)
+        self.recover()
+
+    def receive(self, source, verb, args):
+        getattr(self, 'on_' + verb)(source, *args)
+
+
+class Coordinator(Node):
+    """ node1.py without batching: one round of messages per transaction. """
+
+    def __init__(self, simulation, name, participants):
+        self.participants = participants
+        super().__init__(simulation, name)
+
+    def reset(self):
+        self.transactions = {}  # transaction_id -> Transaction state, for transactions in flight
+        self.cache = {}  # Outcomes decided by this incarnation, transaction_id -> 'COMMIT' | 'ABORT'
+        self.pending = {}  # transaction_id -> (decision, {node: 'pending' | 'done'}), as in the decision log
+        self.collecting = {}  # Presumed commit: transaction_id -> nodes, logged before PREPARE
+        self.unacknowledged = {}  # (node, verb, transaction_id) -> backoff of its redelivery
+        self.deferred = []  # Inquiries waiting for a decision to become durable
+
+    def apply(self, record):
+        kind, transaction_id, nodes = record[0], record[1], record[2:]
+        if kind == 'COLLECTING':
+            self.collecting[transaction_id] = nodes
+        elif kind in ('COMMIT', 'ABORT'):
+            self.collecting.pop(transaction_id, None)
+            self.pending[transaction_id] = (kind, {node: 'pending' for node in nodes})
+            if not nodes:
+                del self.pending[transaction_id]
+        elif kind == 'DONE':
+            decision, status = self.pending.get(transaction_id, (None, {}))
+            if record[2] in status:
+                status[record[2]] = 'done'
+                if all(value == 'done' for value in status.values()):
+                    del self.pending[transaction_id]
+        elif kind == 'COMPLETED':
+            self.collecting.pop(transaction_id, None)
+
+    def recover(self):
+        """ As recover_transactions(): abort what was still collecting, redeliver every unacknowledged decision. """
+        for transaction_id, nodes in list(self.collecting.items()):
+            self.append(('ABORT', transaction_id, *nodes))
+        for transaction_id, (decision, status) in self.pending.items():
+            for node, value in status.items():
+                if value == 'pending':
+                    self.deliver(node, decision, transaction_id)
+
+    def presumed(self):
+        return presumed_outcome(self.simulation.presumption)
+
+    def begin(self, transaction_id):
+        self.transactions[transaction_id] = {'responses': dict.fromkeys(self.participants), 'decision': None}
+        if self.simulation.presumption == 'commit':
+            self.append(('COLLECTING', transaction_id, *self.participants))
+            self.force(self.prepare, transaction_id)
+        else:
+            self.prepare(transaction_id)
+
+    def prepare(self, transaction_id):
+        for node in self.participants:
+            self.send(node, 'PREPARE', transaction_id, tuple(self.participants))
+        self.after(self.simulation.vote_timeout, self.vote_timed_out, transaction_id)
+
+    def vote_timed_out(self, transaction_id):
+        transaction = self.transactions.get(transaction_id)
+        if transaction is not None and transaction['decision'] is None:
+            self.decide(transaction_id, 'ABORT')
+
+    def on_VOTE(self, source, transaction_id, vote):
+        transaction = self.transactions.get(transaction_id)
+        if transaction is None or transaction['decision'] is not None:
+            return
+        transaction['responses'][source] = vote
+        outcome = vote_outcome(transaction['responses'].values())
+        if outcome is not None:
+            self.decide(transaction_id, outcome)
+
+    def decide(self, transaction_id, decision):
+        transaction = self.transactions[transaction_id]
+        transaction['decision'] = decision
+        nodes = second_phase_nodes(decision, transaction['responses'])
+        if decision == 'COMMIT':
+            if self.simulation.presumption == 'commit':
+                self.append(('COMPLETED', transaction_id))
+            elif nodes:
+                self.append(('COMMIT', transaction_id, *nodes))
+            if nodes:
+                self.force(self.decided, transaction_id, decision, nodes)
+            else:
+                self.decided(transaction_id, decision, nodes)
+        elif self.simulation.presumption == 'commit':
+            self.append(('ABORT', transaction_id, *nodes))
+            self.decided(transaction_id, decision, nodes)
+        else:
+            self.decided(transaction_id, decision, nodes)
+
+    def decided(self, transaction_id, decision, nodes):
+        """ The decision is durable (or needs no log): report it and start the second phase. """
+        self.cache[transaction_id] = decision
+        self.simulation.reported(transaction_id, decision)
+        tracked = acknowledged(decision, self.simulation.presumption)
+        for node in nodes:
+            if tracked:
+                self.deliver(node, decision, transaction_id)
+            else:
+                self.send(node, decision, transaction_id, False)
+        del self.transactions[transaction_id]
+        deferred, self.deferred = self.deferred, []
+        for source, attempt, transaction_ids in deferred:
+            self.on_INQUIRE(source, attempt, transaction_ids)
+
+    def deliver(self, node, verb, transaction_id, backoff=None):
+        """ Send a decision that node has to acknowledge, resending it with a growing backoff until it does. """
+        key = node, verb, transaction_id
+        if backoff is None:
+            backoff = self.simulation.retry_backoff
+        elif key not in self.unacknowledged:
+            return
+        self.unacknowledged[key] = backoff
+        self.send(node, verb, transaction_id, True)
+        self.after(backoff, self.deliver, node, verb, transaction_id, min(backoff * 2, self.simulation.max_backoff))
+
+    def on_ACK(self, source, verb, transaction_id):
+        if self.unacknowledged.pop((source, verb, transaction_id), None) is not None:
+            self.append(('DONE', transaction_id, source))
+
+    def outcome(self, transaction_id):
+        """ As resolve(): abort an undecided transaction; None while a decision is not durable yet. """
+        transaction = self.transactions.get(transaction_id)
+        if transaction is not None:
+            if transaction['decision'] is None:
+                self.decide(transaction_id, 'ABORT')
+            if transaction_id in self.transactions:
+                return None
+        if transaction_id in self.cache:
+            return self.cache[transaction_id]
+        if transaction_id in self.pending:
+            return self.pending[transaction_id][0]
+        if transaction_id in self.collecting:
+            return 'ABORT'
+        return self.presumed()
+
+    def on_INQUIRE(self, source, attempt, transaction_ids):
+        outcomes = [self.outcome(transaction_id) for transaction_id in transaction_ids]
+        if None in outcomes:
+            self.deferred.append((source, attempt, transaction_ids))
+        else:
+            self.send(source, 'OUTCOMES', attempt, dict(zip(transaction_ids, outcomes)))
+
+
+class Participant(Node):
+    """ participant.py: prepared log, votes, and termination of in-doubt transactions. """
+
+    def reset(self):
+        self.prepared = {}  # In-doubt transactions, transaction_id -> peers
+        self.outcomes = {}  # Resolved transactions, transaction_id -> 'C' | 'A'
+        self.aborted = set()  # timed_out_transactions: voted NO, or aborted before its PREPARE arrived
+        self.attempts = {}  # Termination attempts in progress, attempt -> {'ids', 'stage', 'states'}
+        self.numbers = itertools.count(1)
+
+    def apply(self, record):
+        kind, transaction_id = record[0], record[1]
+        if kind == 'PREPARED':
+            self.prepared[transaction_id] = record[2:]
+        elif self.prepared.pop(transaction_id, None) is not None:
+            self.outcomes[transaction_id] = 'C' if kind == 'COMMITTED' else 'A'
+            self.simulation.applied(self.name, transaction_id, kind)
+
+    def recover(self):
+        """ As check_aborted_transactions(): settle every transaction found in doubt. """
+        if self.prepared:
+            self.settle(list(self.prepared))
+
+    def on_PREPARE(self, source, transaction_id, peers):
+        vote = self.simulation.vote()
+        if transaction_id in self.aborted or vote == 'NO':
+            self.aborted.add(transaction_id)
+            self.vote(source, transaction_id, 'NO')
+        elif vote == 'READ_ONLY':
+            self.vote(source, transaction_id, 'READ_ONLY')
+        else:
+            self.append(('PREPARED', transaction_id, *peers))
+            self.force(self.prepared_durably, source, transaction_id)
+
+    def prepared_durably(self, source, transaction_id):
+        self.after(self.simulation.termination_timeout, self.settle, [transaction_id])
+        self.vote(source, transaction_id, 'YES')
+
+    def vote(self, source, transaction_id, vote):
+        self.simulation.voted(self.name, transaction_id, vote)
+        self.send(source, 'VOTE', transaction_id, vote)
+
+    def on_COMMIT(self, source, transaction_id, acknowledge):
+        forced = self.simulation.presumption == 'abort'
+        self.resolve({transaction_id: 'COMMITTED'}, forced, self.acknowledge if acknowledge else None,
+                     source, 'COMMIT', transaction_id)
+
+    def on_ABORT(self, source, transaction_id, acknowledge):
+        if transaction_id not in self.prepared:
+            self.aborted.add(transaction_id)
+        self.resolve({transaction_id: 'ABORTED'}, acknowledge, self.acknowledge if acknowledge else None,
+                     source, 'ABORT', transaction_id)
+
+    def acknowledge(self, source, verb, transaction_id):
+        self.send(source, 'ACK', verb, transaction_id)
+
+    def resolve(self, outcomes, forced, callback=None, *args):
+        """ Apply outcomes to the transactions still in doubt, then run callback once they are durable. """
+        self.append(*((kind, transaction_id) for transaction_id, kind in outcomes.items()
+                      if transaction_id in self.prepared))
+        if forced:
+            self.force(callback or (lambda: None), *args)
+        elif callback is not None:
+            callback(*args)
+
+    def settle(self, transaction_ids):
+        """ Ask the TC about the transactions still in doubt; the peers, if it does not answer in time. """
+        in_doubt = [transaction_id for transaction_id in transaction_ids if transaction_id in self.prepared]
+        if not in_doubt:
+            return
+        attempt = next(self.numbers)
+        self.attempts[attempt] = {'ids': in_doubt, 'stage': 'coordinator', 'states': {}}
+        self.send(self.simulation.coordinator.name, 'INQUIRE', attempt, in_doubt)
+        self.after(self.simulation.inquiry_timeout, self.terminate, attempt)
+
+    def on_OUTCOMES(self, source, attempt, outcomes):
+        state = self.attempts.get(attempt)
+        if state is None or state['stage'] != 'coordinator':
+            return  # Too late: the attempt has moved on to the peers
+        del self.attempts[attempt]
+        self.resolve({transaction_id: 'COMMITTED' if outcome == 'COMMIT' else 'ABORTED'
+                      for transaction_id, outcome in outcomes.items()}, True)
+
+    def terminate(self, attempt):
+        """ Cooperative termination: ask every peer of the transactions the TC did not answer for. """
+        state = self.attempts.get(attempt)
+        if state is None or state['stage'] != 'coordinator':
+            return
+        state['stage'] = 'peers'
+        peer_transactions = {}
+        for transaction_id in state['ids']:
+            for peer in self.prepared.get(transaction_id, ()):
+                if peer != self.name:
+                    peer_transactions.setdefault(peer, []).append(transaction_id)
+        for peer, transaction_ids in peer_transactions.items():
+            self.send(peer, 'PEER_INQUIRE', attempt, transaction_ids)
+        self.after(self.simulation.peer_timeout, self.terminated, attempt)
+
+    def on_PEER_INQUIRE(self, source, attempt, transaction_ids):
+        self.send(source, 'STATES', attempt, {transaction_id: self.state(transaction_id)
+                                               for transaction_id in transaction_ids})
+
+    def state(self, transaction_id):
+        """ As peer_states(), for a node that votes as soon as the PREPARE arrives. """
+        if transaction_id in self.prepared:
+            return 'U'
+        if transaction_id in self.outcomes:
+            return self.outcomes[transaction_id]
+        return 'A' if transaction_id in self.aborted else '?'
+
+    def on_STATES(self, source, attempt, states):
+        state = self.attempts.get(attempt)
+        if state is not None and state['stage'] == 'peers':
+            for transaction_id, letter in states.items():
+                state['states'].setdefault(transaction_id, set()).add(letter)
+
+    def terminated(self, attempt):
+        state = self.attempts.pop(attempt)
+        outcomes = {}
+        for transaction_id, letters in state['states'].items():
+            outcome = termination_outcome(letters)
+            if outcome is not None:
+                outcomes[transaction_id] = 'COMMITTED' if outcome == 'COMMIT' else 'ABORTED'
+        self.resolve(outcomes, True)
+        blocked = [transaction_id for transaction_id in state['ids'] if transaction_id not in outcomes]
+        if blocked:
+            self.after(self.simulation.recovery_retry, self.settle, blocked)
+
+
+class Simulation:
+    """ One scenario: the nodes, the virtual clock and network, the injected faults and the invariant checks. """
+
+    def __init__(self, seed, participants=3, transactions=20, presumption='abort', drop=0.02, stall=0.02,
+                 crash_rate=0.5, vote_no=0.05, read_only=0.1, fault_period=5.0, trace=False):
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.presumption = presumption
+        self.drop, self.stall, self.crash_rate = drop, stall, crash_rate
+        self.vote_no, self.read_only = vote_no, read_only
+        self.fault_period = fault_period
+        self.trace = trace
+        # Virtual timing, in seconds
+        self.delay = 0.0005, 0.005  # Network delay of one message
+        self.stall_time = 0.05, 2.0
+        self.fsync = 0.0005, 0.005
+        self.downtime = 0.05, 1.0
+        self.vote_timeout = 1.0
+        self.retry_backoff, self.max_backoff = 0.05, 2.0
+        self.termination_timeout = 1.0
+        self.inquiry_timeout = 0.5
+        self.peer_timeout = 0.5
+        self.recovery_retry = 0.5
+        self.horizon = 3600  # A scenario still running by then has not terminated
+
+        self.now = 0.0
+        self.events = []
+        self.sequence = itertools.count()
+        self.links = {}  # (source, destination) -> arrival time of the last message sent on it
+        self.events_run = 0
+        names = [f"node{index + 2}" for index in range(participants)]
+        self.coordinator = Coordinator(self, 'node1', names)
+        self.nodes = {'node1': self.coordinator, **{name: Participant(self, name) for name in names}}
+        self.votes = {}  # transaction_id -> {node: vote}
+        self.outcomes = {}  # transaction_id -> {node: 'COMMITTED' | 'ABORTED'}, as applied
+        self.reports = {}  # transaction_id -> decisions the coordinator reported
+        self.violations = []
+        for index in range(transactions):
+            self.schedule(self.random.uniform(0, fault_period), None, self.begin, f"t{index}")
+        moment = self.random.expovariate(crash_rate) if crash_rate else fault_period
+        while moment < fault_period:
+            self.schedule(moment, None, self.crash, self.random.choice(list(self.nodes)))
+            moment += self.random.expovariate(crash_rate)
+
+    # Virtual clock and network
+
+    def schedule(self, delay, node, callback, *args):
+        """ Run callback(*args) at now + delay; dropped if node (when given) has crashed in between. """
+        incarnation = node.incarnation if node is not None else None
+        heapq.heappush(self.events, (self.now + delay, next(self.sequence), node, incarnation, callback, args))
+
+    def faulty(self):
+        return self.now < self.fault_period
+
+    def send(self, source, destination, verb, args):
+        if self.faulty() and self.random.random() < self.drop:
+            self.log(f"{source.name} -> {destination} {verb} {args} dropped")
+            return
+        delay = self.random.uniform(*self.delay)
+        if self.faulty() and self.random.random() < self.stall:
+            delay += self.random.uniform(*self.stall_time)
+        arrival = max(self.now + delay, self.links.get((source.name, destination), 0))
+        self.links[source.name, destination] = arrival
+        receiver = self.nodes[destination]
+        self.schedule(arrival - self.now, receiver, self.deliver, source, source.incarnation, receiver, verb, args)
+
+    def deliver(self, source, incarnation, receiver, verb, args):
+        if source.incarnation != incarnation:
+            return  # Lost with the sender's crash
+        self.log(f"{source.name} -> {receiver.name} {verb} {args}")
+        receiver.receive(source.name, verb, args)
+
+    def begin(self, transaction_id):
+        """ A client starts a transaction; it fails if the coordinator is down. """
+        if self.coordinator.up:
+            self.log(f"node1 begins {transaction_id}")
+            self.coordinator.begin(transaction_id)
+
+    def fsync_time(self):
+        return self.random.uniform(*self.fsync)
+
+    def crash(self, name):
+        node = self.nodes[name]
+        if not node.up:
+            return
+        self.log(f"{name} crashes")
+        node.crash()
+        self.schedule(self.random.uniform(*self.downtime), None, self.restart, name)
+
+    def restart(self, name):
+        self.log(f"{name} restarts")
+        self.nodes[name].restart()
+
+    def vote(self):
+        draw = self.random.random()
+        return 'NO' if draw < self.vote_no else 'READ_ONLY' if draw < self.vote_no + self.read_only else 'YES'
+
+    def log(self, message):
+        if self.trace:
+            print(f"{self.now:10.6f}  {message}")
+
+    def run(self):
+        """ Run the scenario until no event is left. Returns the invariant violations found. """
+        while self.events:
+            moment, _, node, incarnation, callback, args = heapq.heappop(self.events)
+            if moment > self.horizon:
+                break
+            self.now = moment
+            if node is not None and (not node.up or node.incarnation != incarnation):
+                continue
+            self.events_run += 1
+            callback(*args)
+        self.check_termination()
+        return self.violations
+
+    # Invariants
+
+    def violation(self, message):
+        self.log(f"VIOLATION: {message}")
+        self.violations.append(message)
+
+    def voted(self, node, transaction_id, vote):
+        self.votes.setdefault(transaction_id, {})[node] = vote
+
+    def reported(self, transaction_id, decision):
+        self.log(f"node1 decides {decision} for {transaction_id}")
+        reports = self.reports.setdefault(transaction_id, set())
+        reports.add(decision)
+        self.check(transaction_id)
+
+    def applied(self, node, transaction_id, outcome):
+        self.outcomes.setdefault(transaction_id, {})[node] = outcome
+        self.check(transaction_id)
+
+    def check(self, transaction_id):
+        applied = set(self.outcomes.get(transaction_id, {}).values())
+        if len(applied) > 1:
+            self.violation(f"atomicity: {transaction_id} committed and aborted: {self.outcomes[transaction_id]}")
+        if 'COMMITTED' in applied:
+            votes = self.votes.get(transaction_id, {})
+            if any(votes.get(node) not in ('YES', 'READ_ONLY') for node in self.coordinator.participants):
+                self.violation(f"validity: {transaction_id} committed with votes {votes}")
+        reports = self.reports.get(transaction_id, set())
+        if ('COMMITTED' in applied and 'ABORT' in reports) or ('ABORTED' in applied and 'COMMIT' in reports):
+            self.violation(f"agreement: {transaction_id} reported {reports} but applied {self.outcomes[transaction_id]}")
+
+    def check_termination(self):
+        for name, node in self.nodes.items():
+            if not node.up:
+                self.violation(f"termination: {name} is still down")
+            elif isinstance(node, Participant) and node.prepared:
+                self.violation(f"termination: {name} still has {sorted(node.prepared)} in doubt")
+        if self.coordinator.pending:
+            self.violation(f"termination: unacknowledged decisions {self.coordinator.pending}")
+        for transaction_id, reports in self.reports.items():
+            if 'COMMIT' in reports:
+                outcomes = self.outcomes.get(transaction_id, {})
+                for node, vote in self.votes.get(transaction_id, {}).items():
+                    if vote == 'YES' and outcomes.get(node) != 'COMMITTED':
+                        self.violation(f"agreement: {node} voted YES on {transaction_id} but never committed it")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run seeded fault-injection scenarios of the commit protocol.")
+    parser.add_argument('--seeds', type=int, default=1000, help="number of scenarios, with seeds from --first-seed")
+    parser.add_argument('--first-seed', type=int, default=0, help="seed of the first scenario")
+    parser.add_argument('--seed', type=int, help="run only this scenario (with --trace to see every event)")
+    parser.add_argument('--trace', action='store_true', help="print every message, crash and decision")
+    parser.add_argument('--presumption', default='abort', choices=cluster.presumptions,
+                        help="protocol variant: presumed abort or presumed commit")
+    parser.add_argument('--participants', type=int, default=3, help="participants in every transaction")
+    parser.add_argument('--transactions', type=int, default=20, help="transactions per scenario")
+    parser.add_argument('--drop', type=float, default=0.02, help="probability that a message is lost")
+    parser.add_argument('--stall', type=float, default=0.02, help="probability that a message (and its link) stalls")
+    parser.add_argument('--crash-rate', type=float, default=0.5, help="node crashes per virtual second")
+    parser.add_argument('--vote-no', type=float, default=0.05, help="probability of a NO vote")
+    parser.add_argument('--read-only', type=float, default=0.1, help="probability of a READ_ONLY vote")
+    parser.add_argument('--fault-period', type=float, default=5.0, help="virtual seconds of faults and new transactions")
+    options = parser.parse_args()
+    seeds = [options.seed] if options.seed is not None else range(options.first_seed,
+                                                                   options.first_seed + options.seeds)
+
+    started = time.monotonic()
+    failed = 0
+    events = 0
+    for seed in seeds:
+        simulation = Simulation(seed, options.participants, options.transactions, options.presumption,
+                                options.drop, options.stall, options.crash_rate, options.vote_no, options.read_only,
+                                options.fault_period, options.trace)
+        violations = simulation.run()
+        events += simulation.events_run
+        if violations:
+            failed += 1
+            print(f"seed {seed}: {len(violations)} violations", file=sys.stderr)
+            for violation in violations[:5]:
+                print(f"  {violation}", file=sys.stderr)
+    elapsed = time.monotonic() - started
+    print(f"{len(seeds)} scenarios ({events} events) in {elapsed:.1f}s, {len(seeds) / elapsed * 60:.0f} per minute: "
+          f"{failed} failed", file=sys.stderr)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
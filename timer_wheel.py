@@ -0,0 +1,124 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+# Timeouts for every transaction on a node share one hashed timer wheel driven by
+# a single thread, instead of one threading.Timer thread per transaction.
+# The wheel is a ring of slots, one per tick. A timer due in n ticks goes into
+# slot (current + n) % slots with n // slots rounds still to wait, so scheduling
+# and cancelling are O(1) however many timers are pending.
+
+log = logging.getLogger('timer_wheel')
+
+
+class Timer:
+    """ Handle of one scheduled callback. """
+
+    __slots__ = ('wheel', 'callback', 'args', 'rounds', 'slot', 'cancelled')
+
+    def __init__(self, wheel, callback, args, rounds, slot):
+        self.wheel = wheel
+        self.callback = callback
+        self.args = args
+        self.rounds = rounds
+        self.slot = slot
+        self.cancelled = False
+
+    def cancel(self):
+        self.wheel.cancel(self)
+
+
+class TimerWheel:
+    """ Runs callbacks after a delay. Callbacks run on the wheel's thread, so they must not block. """
+
+    def __init__(self, tick=0.01, slots=512):
+        self.tick = tick
+        self.slots = [set() for _ in range(slots)]
+        self.current = 0
+        self.pending = 0
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True, name='timer-wheel')
+        self.thread.start()
+
+    def schedule(self, delay, callback, *args):
+        """ Call callback(*args) after delay seconds (rounded up to the next tick). Returns a Timer. """
+        ticks = max(1, int(-(-delay // self.tick)))
+        with self.condition:
+            slot = (self.current + ticks) % len(self.slots)
+            timer = Timer(self, callback, args, (ticks - 1) // len(self.slots), slot)
+            self.slots[slot].add(timer)
+            self.pending += 1
+            if self.pending == 1:
+                self.condition.notify()
+        return timer
+
+    def cancel(self, timer):
+        """ Stop a timer from firing. Cancelling a fired or cancelled timer does nothing. """
+        with self.condition:
+            if not timer.cancelled and timer in self.slots[timer.slot]:
+                self.slots[timer.slot].discard(timer)
+                self.pending -= 1
+            timer.cancelled = True
+
+    def run(self):
+        next_tick = time.monotonic() + self.tick
+        while True:
+            with self.condition:
+                while self.pending == 0:
+                    self.condition.wait()
+                    next_tick = time.monotonic() + self.tick
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            next_tick += self.tick
+            due = []
+            with self.condition:
+                self.current = (self.current + 1) % len(self.slots)
+                slot = self.slots[self.current]
+                for timer in list(slot):
+                    if timer.rounds == 0:
+                        slot.discard(timer)
+                        self.pending -= 1
+                        due.append(timer)
+                    else:
+                        timer.rounds -= 1
+            for timer in due:
+                if not timer.cancelled:
+                    try:
+                        timer.callback(*timer.args)
+                    except Exception:
+                        log.exception("Timer callback %s failed", timer.callback.__name__)
+
+
+class ExpiringSet:
+    """ A set whose members are forgotten after ttl seconds, holding at most max_size of them. """
+
+    def __init__(self, ttl, max_size=100000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.members = OrderedDict()  # member -> expiry time, oldest first
+        self.lock = threading.Lock()
+
+    def add(self, member):
+        now = time.monotonic()
+        with self.lock:
+            self.members.pop(member, None)
+            self.members[member] = now + self.ttl
+            while self.members:
+                oldest, expiry = next(iter(self.members.items()))
+                if expiry > now and len(self.members) <= self.max_size:
+                    break
+                del self.members[oldest]
+
+    def discard(self, member):
+        with self.lock:
+            self.members.pop(member, None)
+
+    def __contains__(self, member):
+        with self.lock:
+            expiry = self.members.get(member)
+            return expiry is not None and expiry > time.monotonic()
+
+    def __len__(self):
+        return len(self.members)
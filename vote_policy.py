@@ -0,0 +1,108 @@
+import importlib
+import random
+import threading
+import time
+
+# Vote policies decide how a participant answers PREPARE.
+#
+# A policy is any callable policy(transaction_id) that returns 'YES', 'NO' or
+# 'READ_ONLY' (the node changed nothing: it writes no prepared record and takes
+# no part in the second phase).
+# Policies are called from worker threads, one call per transaction, so several
+# votes can be evaluated at the same time; a policy that must not run
+# concurrently (like asking on the console) sets serial = True.
+#
+# load() builds a policy from a command-line spec:
+#   console                  ask on the console (the original behaviour)
+#   auto                     always vote YES
+#   random:0.1[:0.005[:42]]  vote NO with probability 0.1, optionally delaying
+#                            each vote by up to 0.005 s, seeded with 42
+#   limit:1000               vote YES unless 1000 transactions are already in doubt
+#   readonly[:0.5[:42]]      vote READ_ONLY (with probability 0.5, otherwise YES, seeded with 42)
+#   package.module:name      any other callable, imported by name
+
+
+def console(transaction_id):
+    """ Ask the operator. """
+    answer = input(f"Do you want to commit the transaction {transaction_id}? (yes/no): ").lower()
+    return 'YES' if answer == 'yes' else 'NO'
+
+
+console.serial = True
+
+
+def auto_commit(transaction_id):
+    """ Always vote YES. """
+    return 'YES'
+
+
+class RandomFaults:
+    """ Fault injection: vote NO with a fixed probability and optionally delay every vote. """
+
+    def __init__(self, abort_probability=0.1, max_delay=0.0, seed=None):
+        self.abort_probability = abort_probability
+        self.max_delay = max_delay
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def __call__(self, transaction_id):
+        with self.lock:
+            vote = 'NO' if self.random.random() < self.abort_probability else 'YES'
+            delay = self.random.uniform(0, self.max_delay) if self.max_delay else 0
+        if delay:
+            time.sleep(delay)
+        return vote
+
+
+class ReadOnly:
+    """ Vote READ_ONLY on a share of the transactions and ask another policy about the rest. """
+
+    def __init__(self, fraction=1.0, policy=auto_commit, seed=None):
+        self.fraction = fraction
+        self.policy = policy
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def __call__(self, transaction_id):
+        with self.lock:
+            read_only = self.random.random() < self.fraction
+        return 'READ_ONLY' if read_only else self.policy(transaction_id)
+
+
+class InDoubtLimit:
+    """ Resource check: vote NO while too many transactions are already prepared and waiting. """
+
+    def __init__(self, prepared_log, limit, policy=auto_commit):
+        self.prepared_log = prepared_log
+        self.limit = limit
+        self.policy = policy
+
+    def __call__(self, transaction_id):
+        if len(self.prepared_log.prepared) >= self.limit:
+            return 'NO'
+        return self.policy(transaction_id)
+
+
+def load(spec, prepared_log=None):
+    """ Build a vote policy from its command-line spec (see the top of this module). """
+    name, _, options = spec.partition(':')
+    if name == 'console':
+        return console
+    if name == 'auto':
+        return auto_commit
+    if name == 'random':
+        values = options.split(':') if options else []
+        abort_probability = float(values[0]) if len(values) > 0 else 0.1
+        max_delay = float(values[1]) if len(values) > 1 else 0.0
+        seed = int(values[2]) if len(values) > 2 else None
+        return RandomFaults(abort_probability, max_delay, seed)
+    if name == 'limit':
+        return InDoubtLimit(prepared_log, int(options))
+    if name == 'readonly':
+        values = options.split(':') if options else []
+        fraction = float(values[0]) if len(values) > 0 else 1.0
+        seed = int(values[1]) if len(values) > 1 else None
+        return ReadOnly(fraction, seed=seed)
+    if options:
+        return getattr(importlib.import_module(name), options)
+    raise ValueError(f"Unknown vote policy {spec!r}")
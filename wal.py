@@ -0,0 +1,232 @@
+import asyncio
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+import zlib
+
+import metrics
+
+# Segmented, append-only write-ahead log.
+#
+# The log directory holds numbered segments and checkpoints:
+#   segment-00000007.log     records appended since checkpoint 7 was taken
+#   checkpoint-00000007.log  every record still live when segment 7 was started
+# Recovery reads the newest checkpoint and the segments numbered at or after it,
+# so its cost follows the live state, not the whole history.
+#
+# Each record is a tuple of strings, stored as
+#   length (I) | crc32 (I) | field count (B) | (field length (H) | UTF-8 bytes)*
+# A torn record at the end of the last segment (a crash mid-write) ends replay.
+#
+# A failed write or fsync (a full disk, an I/O error) stops the process: what
+# reached the disk is unknown then, and retrying an fsync can report success for
+# data the kernel already dropped. The node recovers from the log at restart, as
+# after any crash.
+
+RECORD_HEADER = struct.Struct('!II')
+FIELD_COUNT = struct.Struct('!B')
+FIELD_LENGTH = struct.Struct('!H')
+
+fsync_seconds = metrics.histogram('tpc_fsync_seconds', "Duration of each write-ahead log fsync")
+group_size = metrics.histogram('tpc_log_group_size', "Appends written together by one group commit",
+                               buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024))
+
+
+def encode_record(fields):
+    parts = [FIELD_COUNT.pack(len(fields))]
+    for field in fields:
+        data = field.encode()
+        parts.append(FIELD_LENGTH.pack(len(data)))
+        parts.append(data)
+    payload = b''.join(parts)
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def decode_records(data):
+    """ Yield the records stored in data, stopping at the first torn or corrupt one. """
+    for fields, _ in scan_records(data):
+        yield fields
+
+
+def scan_records(data):
+    """ Yield (record, end offset) pairs for the valid prefix of data. """
+    view = memoryview(data)
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(view):
+        length, crc = RECORD_HEADER.unpack_from(view, offset)
+        payload = view[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            return
+        (count,) = FIELD_COUNT.unpack_from(payload, 0)
+        position = FIELD_COUNT.size
+        fields = []
+        for _ in range(count):
+            (field_length,) = FIELD_LENGTH.unpack_from(payload, position)
+            position += FIELD_LENGTH.size
+            fields.append(str(payload[position:position + field_length], 'utf-8'))
+            position += field_length
+        offset += RECORD_HEADER.size + length
+        yield tuple(fields), offset
+
+
+class Signal(threading.Event):
+    """ A threading.Event that coroutines on the event loop can also await without tying up a thread.
+
+    The log sets one when an append is durable; the coordinator also uses them for its decisions.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.waiters = []  # (loop, future) of each waiting coroutine
+
+    def set(self):
+        with self.lock:
+            super().set()
+            waiters, self.waiters = self.waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(lambda future=future: future.done() or future.set_result(None))
+
+    async def wait_async(self):
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            if self.is_set():
+                return
+            future = loop.create_future()
+            self.waiters.append((loop, future))
+        await future
+
+
+class WriteAheadLog:
+    """ Append-only log with group commit: concurrent appends share one write and one fsync. """
+
+    def __init__(self, directory, sync=True):
+        self.directory = directory
+        self.sync = sync
+        os.makedirs(directory, exist_ok=True)
+        self.checkpoint_sequence = max(self.sequences('checkpoint'), default=0)
+        self.sequence = max(self.sequences('segment') + [self.checkpoint_sequence])
+        self.file = open(self.path('segment', self.sequence), 'ab')
+        self.truncate_torn_tail()
+        self.segment_bytes = self.file.tell()
+        self.requests = queue.Queue()
+        self.writer = threading.Thread(target=self.write_batches, daemon=True)
+        self.writer.start()
+
+    def truncate_torn_tail(self):
+        """ Cut off a record left half-written by a crash so new appends stay readable. """
+        with open(self.file.name, 'rb') as file:
+            data = file.read()
+        valid = 0
+        for _, valid in scan_records(data):
+            pass
+        if valid < len(data):
+            self.file.truncate(valid)
+            self.file.seek(valid)
+
+    def path(self, kind, sequence):
+        return os.path.join(self.directory, f"{kind}-{sequence:08d}.log")
+
+    def sequences(self, kind):
+        prefix = f"{kind}-"
+        return [int(name[len(prefix):-4]) for name in os.listdir(self.directory)
+                if name.startswith(prefix) and name.endswith('.log')]
+
+    def replay(self):
+        """ Yield every record of the newest checkpoint, then of the segments written after it. """
+        if self.checkpoint_sequence:
+            with open(self.path('checkpoint', self.checkpoint_sequence), 'rb') as file:
+                yield from decode_records(file.read())
+        for sequence in sorted(self.sequences('segment')):
+            if sequence >= self.checkpoint_sequence:
+                with open(self.path('segment', sequence), 'rb') as file:
+                    yield from decode_records(file.read())
+
+    def append(self, records, wait=True):
+        """ Append records (tuples of strings). With wait, return only once they are durable. """
+        done = self.submit(records)
+        if wait:
+            done.wait()
+
+    def submit(self, records, after=None):
+        """ Queue records for the writer and return a Signal that is set once they are durable.
+
+        The writer calls after(), if given, once they are durable and before setting the Signal.
+        """
+        done = Signal()
+        self.requests.put((b''.join(encode_record(record) for record in records), done, after))
+        return done
+
+    def roll(self):
+        """ Start a new segment once everything appended so far is durable, and return its sequence number. """
+        done = threading.Event()
+        self.requests.put((None, done, None))
+        done.wait()
+        return self.sequence
+
+    def write_batches(self):
+        """ Writer thread: drain every queued append, write them together and fsync once. """
+        while True:
+            batch = [self.requests.get()]
+            while True:
+                try:
+                    batch.append(self.requests.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                for data, _, _ in batch:
+                    if data is None:
+                        self.flush()
+                        self.start_segment()
+                    else:
+                        self.file.write(data)
+                        self.segment_bytes += len(data)
+                self.flush()
+                for _, _, after in batch:
+                    if after is not None:
+                        after()
+            except OSError as e:
+                # Printed rather than logged: os._exit() does not wait for the logging thread
+                print(f"Write-ahead log {self.directory} failed: {e}; stopping", file=sys.stderr, flush=True)
+                os._exit(1)
+            group_size.observe(len(batch))
+            for _, done, _ in batch:
+                done.set()
+
+    def flush(self):
+        self.file.flush()
+        if self.sync:
+            started = time.monotonic()
+            os.fsync(self.file.fileno())
+            fsync_seconds.observe(time.monotonic() - started)
+
+    def start_segment(self):
+        self.file.close()
+        self.sequence += 1
+        self.file = open(self.path('segment', self.sequence), 'ab')
+        self.segment_bytes = 0
+
+    def checkpoint(self, sequence, records):
+        """ Store the live records as of the start of segment sequence and delete everything they supersede. """
+        temporary = self.path('checkpoint', sequence) + '.tmp'
+        with open(temporary, 'wb') as file:
+            for record in records:
+                file.write(encode_record(record))
+            file.flush()
+            if self.sync:
+                os.fsync(file.fileno())
+        os.replace(temporary, self.path('checkpoint', sequence))
+        if self.sync:
+            directory = os.open(self.directory, os.O_RDONLY)
+            try:
+                os.fsync(directory)
+            finally:
+                os.close(directory)
+        self.checkpoint_sequence = sequence
+        for kind in ('segment', 'checkpoint'):
+            for old in self.sequences(kind):
+                if old < sequence:
+                    os.remove(self.path(kind, old))